@@ -368,6 +368,10 @@ if [ -f "$HNM_LIB_DIR/device_detection_test.py" ]; then
     cp "$HNM_LIB_DIR/device_detection_test.py" "$HNM_PRODUCTION_ROOT/"
     echo -e "${GREEN}✅ device_detection_test.py copied${NC}"
 fi
+if [ -f "$HNM_LIB_DIR/batch_queue.py" ]; then
+    cp "$HNM_LIB_DIR/batch_queue.py" "$HNM_PRODUCTION_ROOT/"
+    echo -e "${GREEN}✅ batch_queue.py copied${NC}"
+fi
 if [ -f "$HNM_LIB_DIR/resource_monitor.py" ]; then
     cp "$HNM_LIB_DIR/resource_monitor.py" "$HNM_PRODUCTION_ROOT/"
     echo -e "${GREEN}✅ resource_monitor.py copied${NC}"
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Batch Queue Helpers
+Shared collection window for the servers' micro-batching loops
+"""
+
+import asyncio
+from typing import Any, Callable, List
+
+async def fill_window(queue: asyncio.Queue, max_wait_s: float, accept: Callable[[Any], bool]) -> None:
+    """Hand queued items to accept() for up to max_wait_s, stopping early once accept() returns True"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait_s
+    while True:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            return
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return
+        if accept(item):
+            return
+
+async def collect_batch(queue: asyncio.Queue, max_size: int, max_wait_s: float) -> List[Any]:
+    """Wait for one item, then collect arrivals for one window or until max_size items"""
+    batch = [await queue.get()]
+
+    def accept(item) -> bool:
+        batch.append(item)
+        return len(batch) >= max_size
+
+    if len(batch) < max_size:
+        await fill_window(queue, max_wait_s, accept)
+    return batch
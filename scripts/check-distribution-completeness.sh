@@ -84,6 +84,7 @@ EXPECTED_DIRS=(
 EXPECTED_SCRIPTS_FILES=(
     "activate_huddle_env.sh"
     "batch_indexer.sh"
+    "batch_queue.py"
     "device_detection_test.py"
     "ipfs_ocr_indexer.sh"
     "IPFS_UPLOAD.sh"
@@ -21,6 +21,9 @@ from dataclasses import dataclass, asdict
 os.environ["PYTORCH_MPS_HIGH_WATERMARK_RATIO"] = "0.0"
 os.environ["PYTORCH_MPS_LOW_WATERMARK_RATIO"] = "0.0"
 
+# GPU name line in `system_profiler SPDisplaysDataType` output
+GPU_CHIPSET_RE = re.compile(r'Chipset Model:\s*(.+)')
+
 @dataclass
 class SystemInfo:
     """System information and capabilities"""
@@ -68,6 +71,8 @@ class DeviceDetector:
         self.system_info = self._get_system_info()
         self.devices = self._detect_all_devices()
         self.other_processes = self._detect_other_processes()
+        # The process list is a construction-time snapshot, so its total is computed once
+        self.other_processes_gb = sum(p.memory_mb for p in self.other_processes) / 1024
         self.best_device = self._select_best_device()
         self.resource_allocation = self._calculate_resource_allocation()
         
@@ -126,7 +131,7 @@ class DeviceDetector:
                                       capture_output=True, text=True, timeout=10)
                 if result.returncode == 0:
                     output = result.stdout
-                    gpu_match = re.search(r'Chipset Model:\s*(.+)', output)
+                    gpu_match = GPU_CHIPSET_RE.search(output)
                     if gpu_match:
                         gpu_name = gpu_match.group(1).strip()
                         
@@ -292,7 +297,7 @@ class DeviceDetector:
         cpu_percent = self.system_info.cpu_percent
         
         # Calculate other processes memory usage
-        other_processes_memory_gb = sum(p.memory_mb for p in self.other_processes) / 1024
+        other_processes_memory_gb = self.other_processes_gb
         
         print(f"🔍 Dynamic Device Selection:")
         print(f"   Available Memory: {available_memory_gb:.1f}GB")
@@ -395,7 +400,7 @@ class DeviceDetector:
         available_memory_gb = self.system_info.available_memory_gb
         
         # Calculate other processes memory usage
-        other_processes_memory_gb = sum(p.memory_mb for p in self.other_processes) / 1024
+        other_processes_memory_gb = self.other_processes_gb
         
         print(f"📊 Resource Allocation for {self.best_device.upper()}:")
         print(f"   Total Memory: {total_memory_gb:.1f}GB")
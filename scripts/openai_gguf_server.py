@@ -10,22 +10,36 @@ import time
 import json
 import psutil
 import gc
+import gzip
+import hashlib
+import importlib
+import importlib.util
 import subprocess
-from typing import Optional, Dict, Any, AsyncGenerator, List
+from typing import Optional, Dict, Any, AsyncGenerator, List, Set
 import asyncio
+import concurrent.futures
 from pydantic import BaseModel, Field
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse, JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
-import threading
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from pathlib import Path
+from types import MappingProxyType
 from dotenv import load_dotenv
 from openai import AzureOpenAI
+from batch_queue import collect_batch
 import httpx
 
+# Prefer orjson for hot-path JSON work (with fallback to stdlib json)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
 # Add parent directory to sys.path for imports
 current_dir = Path(__file__).parent
 parent_dir = current_dir.parent
@@ -65,74 +79,128 @@ if not api_key or not endpoint:
     logger.error("Please set AZURE_OPENAI_4O_ENDPOINT and AZURE_OPENAI_4O_API_KEY in .env.local or .env")
     raise ValueError("Missing Azure OpenAI credentials")
 else:
-    logger.info(f"✅ Azure OpenAI Configuration Loaded:")
-    logger.info(f"   • Endpoint: {endpoint}")
-    logger.info(f"   • API Key: {'*' * 20}...{api_key[-4:] if api_key else 'NOT SET'}")
+    logger.info("✅ Azure OpenAI Configuration Loaded:")
+    logger.info("   • Endpoint: %s", endpoint)
+    logger.info("   • API Key: %s...%s", '*' * 20, api_key[-4:])
+
+# Resolve REST settings once so generate_response() doesn't hit os.getenv per request
+_API_KEY = api_key
+_ENDPOINT = endpoint
+_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+_URL_TEMPLATE = f"{_ENDPOINT}/openai/deployments/{{model}}/chat/completions?api-version={_API_VERSION}"
+_HEADERS = MappingProxyType({
+    "Content-Type": "application/json",
+    "api-key": _API_KEY
+})
+_GZIP_HEADERS = MappingProxyType({**_HEADERS, "Content-Encoding": "gzip"})
+
+# Gzip large request bodies only when the upstream gateway is known to accept them
+_GZIP_REQUESTS = os.getenv("AZURE_OPENAI_GZIP_REQUESTS", "false").lower() in ("1", "true", "yes")
+_GZIP_MIN_BYTES = 4096
+
+# Pooled client for the REST path; HTTP/2 needs the optional h2 package (httpx[http2]).
+# httpx already advertises gzip via Accept-Encoding, so responses are compressed as-is.
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+_http_client = httpx.AsyncClient(http2=HTTP2_AVAILABLE)
+logger.info("Azure REST client: %s", "HTTP/2" if HTTP2_AVAILABLE else "HTTP/1.1")
+
+def _json_loads(data):
+    """Parse a JSON string or bytes, using orjson when available"""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+def _json_dumps_bytes(obj) -> bytes:
+    """Serialize to UTF-8 JSON bytes, using orjson when available"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj).encode()
+
+def _json_dumps(obj) -> str:
+    """Serialize to a JSON string, using orjson when available"""
+    return _json_dumps_bytes(obj).decode()
+
+# Encoded tool schemas keyed by list identity; the list is kept alive so its id can't be reused
+_TOOLS_JSON_CACHE: "OrderedDict[int, tuple]" = OrderedDict()
+_TOOLS_JSON_CACHE_SIZE = 16
+
+def _tools_json(tools: List[Dict[str, Any]]) -> bytes:
+    """Encode a tools list once per list object (tool lists are treated as immutable)"""
+    key = id(tools)
+    entry = _TOOLS_JSON_CACHE.get(key)
+    if entry is not None and entry[0] is tools:
+        _TOOLS_JSON_CACHE.move_to_end(key)
+        return entry[1]
+    encoded = _json_dumps_bytes(tools)
+    _TOOLS_JSON_CACHE[key] = (tools, encoded)
+    if len(_TOOLS_JSON_CACHE) > _TOOLS_JSON_CACHE_SIZE:
+        _TOOLS_JSON_CACHE.popitem(last=False)
+    return encoded
+
+def _tool_result_content(result) -> str:
+    """Format a tool result as message content"""
+    return _json_dumps(result) if isinstance(result, (dict, list)) else str(result)
+
+# Tool functions are synchronous; run them on a dedicated pool so they don't block the event loop
+_tool_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv("TOOL_EXECUTOR_WORKERS", "32")),
+    thread_name_prefix="tool"
+)
+
+async def run_in_tool_executor(func, *args):
+    """Run a synchronous tool call on the tool thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(_tool_executor, func, *args)
+
+async def execute_one_tool(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+    """Execute a single tool call; failures are returned as error results, never raised"""
+    try:
+        tool_name = tool_call["function"]["name"]
+        arguments = _json_loads(tool_call["function"]["arguments"])
+        
+        # Use the existing execute_tool_endpoint logic
+        if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
+            return {"error": "Function tools not available"}
+        
+        if tool_name not in function_tools.functions:
+            return {"error": f"Tool '{tool_name}' not found"}
+        
+        logger.info("🔧 Executing %s with arguments: %s", tool_name, arguments)
+        result = await run_in_tool_executor(function_tools.execute_function, tool_name, arguments)
+        
+        return {
+            "tool": tool_name,
+            "arguments": arguments,
+            "result": result,
+            "success": True
+        }
+    except Exception as e:
+        logger.error("❌ Tool execution error for %s: %s", tool_call.get('function', {}).get('name', 'unknown'), e)
+        return {
+            "tool": tool_call.get('function', {}).get('name', 'unknown'),
+            "error": str(e),
+            "success": False
+        }
 
 async def execute_tools_parallel(tool_calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Execute multiple tools in parallel"""
-    import aiohttp
-    import json
+    """Execute multiple tools in parallel, preserving call order in the results"""
+    # A single call doesn't need task scheduling at all
+    if len(tool_calls) == 1:
+        return [await execute_one_tool(tool_calls[0])]
     
-    async def execute_single_tool(tool_call: Dict[str, Any]) -> Dict[str, Any]:
-        """Execute a single tool"""
-        try:
-            tool_name = tool_call["function"]["name"]
-            arguments = json.loads(tool_call["function"]["arguments"])
-            
-            # Use the existing execute_tool_endpoint logic
-            if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
-                return {"error": "Function tools not available"}
-            
-            if tool_name not in function_tools.functions:
-                return {"error": f"Tool '{tool_name}' not found"}
-            
-            logger.info(f"🔧 Executing {tool_name} with arguments: {arguments}")
-            result = function_tools.execute_function(tool_name, arguments)
-            
-            return {
-                "tool": tool_name,
-                "arguments": arguments,
-                "result": result,
-                "success": True
-            }
-        except Exception as e:
-            logger.error(f"❌ Tool execution error for {tool_call.get('function', {}).get('name', 'unknown')}: {str(e)}")
-            return {
-                "tool": tool_call.get('function', {}).get('name', 'unknown'),
-                "error": str(e),
-                "success": False
-            }
+    # TaskGroup (Python 3.11+) cancels the remaining tools if one is cancelled or crashes
+    if hasattr(asyncio, "TaskGroup"):
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(execute_one_tool(tool_call)) for tool_call in tool_calls]
+        return [task.result() for task in tasks]
     
-    # Execute all tools concurrently
-    tasks = [execute_single_tool(tool_call) for tool_call in tool_calls]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    # Handle any exceptions
-    final_results = []
-    for i, result in enumerate(results):
-        if isinstance(result, Exception):
-            final_results.append({
-                "tool": tool_calls[i].get('function', {}).get('name', 'unknown'),
-                "error": str(result),
-                "success": False
-            })
-        else:
-            final_results.append(result)
-    
-    return final_results
+    return list(await asyncio.gather(*(execute_one_tool(tool_call) for tool_call in tool_calls)))
 
-async def generate_response(messages, model, temperature=0.7, top_p=0.95, max_tokens=None, stream=False, tools=None, tool_choice="auto"):
-    """Generate a response from the Azure OpenAI API."""
-    api_key = os.getenv("AZURE_OPENAI_API_KEY") or os.getenv("AZURE_OPENAI_4O_API_KEY")
-    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT") or os.getenv("AZURE_OPENAI_4O_ENDPOINT")
-    api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
-    
-    if not api_key or not endpoint:
-        raise ValueError("Azure OpenAI API key and endpoint must be set")
-    
-    # Construct the API URL
-    url = f"{endpoint}/openai/deployments/{model}/chat/completions?api-version={api_version}"
+def _build_completion_request(messages, model, temperature, top_p, max_tokens, stream, tools, tool_choice, n):
+    """Build the URL, encoded body and headers for a chat completions REST call"""
+    # Construct the API URL (credentials are validated at import time)
+    url = _URL_TEMPLATE.format(model=model)
     
     # Prepare the request payload
     payload = {
@@ -145,52 +213,196 @@ async def generate_response(messages, model, temperature=0.7, top_p=0.95, max_to
     if max_tokens:
         payload["max_tokens"] = max_tokens
     
-    # Add tools if provided
+    if n > 1:
+        payload["n"] = n
+    
+    # Add tool_choice if provided (can be "auto", "none", or a specific tool)
+    if tools and tool_choice:
+        payload["tool_choice"] = tool_choice
+    
+    # Encode once; httpx would otherwise re-serialize the dict itself. Tool schemas
+    # are spliced in from their cached encoding instead of being re-serialized.
+    body = _json_dumps_bytes(payload)
     if tools:
-        payload["tools"] = tools
-        
-        # Add tool_choice if provided (can be "auto", "none", or a specific tool)
-        if tool_choice:
-            payload["tool_choice"] = tool_choice
+        body = b"".join((body[:-1], b',"tools":', _tools_json(tools), b"}"))
     
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key
-    }
+    headers = _HEADERS
+    if _GZIP_REQUESTS and len(body) > _GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=1)
+        headers = _GZIP_HEADERS
     
-    try:
-        async with httpx.AsyncClient() as client:
-            if stream:
-                # Handle streaming response
-                async with client.stream("POST", url, json=payload, headers=headers) as response:
-                    response.raise_for_status()
-                    async for line in response.aiter_lines():
-                        if line.strip():
-                            if line.startswith("data: "):
-                                line = line[6:]  # Remove "data: " prefix
-                            if line == "[DONE]":
-                                break
-                            try:
-                                chunk = json.loads(line)
-                                yield chunk
-                            except json.JSONDecodeError:
-                                logger.error(f"Failed to parse JSON: {line}")
-            else:
-                # Handle non-streaming response
-                response = await client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
-                result = response.json()
-                # Use yield instead of return for consistency with the streaming case
-                yield result
-    except httpx.HTTPStatusError as e:
-        logger.error(f"HTTP error: {e}")
+    return url, body, headers
+
+def _log_request_error(e: Exception):
+    """Log a failed Azure REST call"""
+    if isinstance(e, httpx.HTTPStatusError):
+        logger.error("HTTP error: %s", e)
         error_detail = e.response.text if hasattr(e, 'response') else str(e)
-        logger.error(f"Error detail: {error_detail}")
+        logger.error("Error detail: %s", error_detail)
+    else:
+        logger.error("Error generating response: %s", e)
+
+async def generate_response_once(messages, model, temperature=0.7, top_p=0.95, max_tokens=None, tools=None, tool_choice="auto", n=1) -> Dict[str, Any]:
+    """Generate a non-streaming response from the Azure OpenAI API."""
+    url, body, headers = _build_completion_request(
+        messages, model, temperature, top_p, max_tokens, False, tools, tool_choice, n
+    )
+    try:
+        response = await _http_client.post(url, content=body, headers=headers)
+        response.raise_for_status()
+        return _json_loads(response.content)
+    except Exception as e:
+        _log_request_error(e)
         raise
+
+async def generate_response(messages, model, temperature=0.7, top_p=0.95, max_tokens=None, stream=False, tools=None, tool_choice="auto", n=1):
+    """Generate a response from the Azure OpenAI API."""
+    if not stream:
+        # Kept for callers that iterate; prefer awaiting generate_response_once() directly
+        yield await generate_response_once(
+            messages, model, temperature=temperature, top_p=top_p, max_tokens=max_tokens,
+            tools=tools, tool_choice=tool_choice, n=n
+        )
+        return
+    
+    url, body, headers = _build_completion_request(
+        messages, model, temperature, top_p, max_tokens, True, tools, tool_choice, n
+    )
+    try:
+        # Handle streaming response
+        async with _http_client.stream("POST", url, content=body, headers=headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    if line.startswith("data: "):
+                        line = line[6:]  # Remove "data: " prefix
+                    if line == "[DONE]":
+                        break
+                    try:
+                        chunk = _json_loads(line)
+                        yield chunk
+                    except json.JSONDecodeError:
+                        logger.error("Failed to parse JSON: %s", line)
     except Exception as e:
-        logger.error(f"Error generating response: {e}")
+        _log_request_error(e)
         raise
 
+class CompletionBatcher:
+    """Coalesce identical in-flight completions into one upstream call.
+    
+    Azure OpenAI takes a single conversation per request, so only requests with
+    identical parameters can share a call: they are sent once with n=K and each
+    caller receives one of the K sampled choices. Requests are collected for up
+    to max_delay seconds (or max_batch requests) before dispatch.
+    """
+    
+    def __init__(self, max_delay: float = 0.01, max_batch: int = 16):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # The loop only keeps weak references to tasks, so in-flight dispatches are held here
+        self._dispatches: Set[asyncio.Task] = set()
+    
+    def start(self):
+        """Start the background dispatch loop"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background dispatch loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in self._dispatches:
+            task.cancel()
+        await asyncio.gather(*self._dispatches, return_exceptions=True)
+        self._dispatches.clear()
+    
+    async def submit(self, model: str, messages: List[Dict[str, Any]],
+                     temperature: float, max_tokens: Optional[int]) -> Dict[str, Any]:
+        """Queue a non-streaming, tool-free completion and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((model, messages, temperature, max_tokens), future))
+        return await future
+    
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self._queue, self.max_batch, self.max_delay)
+            
+            # Group identical requests; each group becomes one upstream call
+            groups: Dict[bytes, tuple] = {}
+            for params, future in batch:
+                groups.setdefault(_json_dumps_bytes(params), (params, []))[1].append(future)
+            for params, futures in groups.values():
+                task = asyncio.create_task(self._dispatch(params, futures))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+    
+    async def _dispatch(self, params: tuple, futures: List[asyncio.Future]):
+        model, messages, temperature, max_tokens = params
+        try:
+            response = await generate_response_once(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                n=len(futures)
+            )
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        if len(futures) == 1:
+            if not futures[0].done():
+                futures[0].set_result(response)
+            return
+        
+        # Hand each caller its own choice, renumbered as the only choice, with its share of the usage
+        choices = response.get("choices") or []
+        usages = self._split_usage(response.get("usage"), len(futures))
+        for i, future in enumerate(futures):
+            if future.done():
+                continue
+            if i < len(choices):
+                future.set_result({**response, "choices": [{**choices[i], "index": 0}], "usage": usages[i]})
+            else:
+                future.set_result({**response, "usage": usages[i]})
+    
+    @staticmethod
+    def _split_usage(usage: Optional[Dict[str, Any]], count: int) -> List[Optional[Dict[str, Any]]]:
+        """Per-caller usage for one n=count call: the shared prompt once each, completion tokens split across choices"""
+        if not usage:
+            return [usage] * count
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        share, extra = divmod(usage.get("completion_tokens", 0), count)
+        usages = []
+        for i in range(count):
+            completion_tokens = share + (1 if i < extra else 0)
+            usages.append({
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            })
+        return usages
+
+# Opt-in request coalescing for identical non-streaming, tool-free requests
+_BATCHING_ENABLED = os.getenv("OPENAI_REQUEST_BATCHING", "false").lower() in ("1", "true", "yes")
+completion_batcher = CompletionBatcher(
+    max_delay=float(os.getenv("OPENAI_BATCH_WINDOW_MS", "10")) / 1000.0,
+    max_batch=int(os.getenv("OPENAI_BATCH_MAX_SIZE", "16"))
+) if _BATCHING_ENABLED else None
+
 # Import platform-adaptive configuration
 try:
     from platform_adaptive_config import get_platform_config
@@ -251,46 +463,44 @@ except ImportError as e:
     WEB_SEARCH_CONFIRMATION_AVAILABLE = False
     WebSearchConfirmationSystem = None
 
-# Import multi-tool executor
-try:
-    # Try to import from the parent directory first (production version)
-    import sys
-    import os
-    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-    from multi_tool_executor import multi_tool_executor
-    MULTI_TOOL_AVAILABLE = True
-    print("✅ Production-ready multi-tool executor loaded")
-except ImportError as e:
-    print(f"⚠️ Production multi-tool executor not available: {e}")
-    MULTI_TOOL_AVAILABLE = False
-    # Fall back to tool triggers
-    try:
-        from tool_triggers import tool_trigger_system
-        TOOL_TRIGGERS_AVAILABLE = True
-        print("✅ Tool triggers system loaded")
-    except ImportError:
-        TOOL_TRIGGERS_AVAILABLE = False
-        print("⚠️ Tool triggers system not available")
+# Tool-selection backends in order of preference: (module, exported attributes, availability flag)
+_TOOL_BACKENDS = (
+    ("multi_tool_executor", ("multi_tool_executor",), "MULTI_TOOL_AVAILABLE"),
+    ("tool_triggers", ("tool_trigger_system",), "TOOL_TRIGGERS_AVAILABLE"),
+    ("enhanced_tool_identification", ("tool_integration",), "TOOL_IDENTIFICATION_AVAILABLE"),
+    ("enhanced_tool_selection", ("get_enhanced_system_prompt", "get_tool_selection_guidance"), "TOOL_SELECTION_AVAILABLE"),
+)
+
+MULTI_TOOL_AVAILABLE = False
+TOOL_TRIGGERS_AVAILABLE = False
+TOOL_IDENTIFICATION_AVAILABLE = False
+TOOL_SELECTION_AVAILABLE = False
+multi_tool_executor = None
+tool_trigger_system = None
+tool_integration = None
+
+# Empty fallbacks, replaced when enhanced_tool_selection is the chosen backend
+def get_enhanced_system_prompt(tools):
+    return ""
+
+def get_tool_selection_guidance(query, tools):
+    return ""
+
+def _load_tool_backend() -> Optional[str]:
+    """Import the first available tool-selection backend into module globals"""
+    for module_name, attrs, flag in _TOOL_BACKENDS:
         try:
-            from enhanced_tool_identification import tool_integration
-            TOOL_IDENTIFICATION_AVAILABLE = True
-            print("✅ Enhanced tool identification system loaded")
-        except ImportError:
-            TOOL_IDENTIFICATION_AVAILABLE = False
-            print("⚠️ Enhanced tool identification not available")
-            # Try to fall back to basic enhanced_tool_selection if available
-            try:
-                from enhanced_tool_selection import get_enhanced_system_prompt, get_tool_selection_guidance
-                TOOL_SELECTION_AVAILABLE = True
-                print("✅ Using legacy enhanced tool selection")
-            except ImportError:
-                TOOL_SELECTION_AVAILABLE = False
-                print("⚠️ Enhanced tool selection not available")
-                # Define empty functions as last resort
-                def get_enhanced_system_prompt(tools):
-                    return ""
-                def get_tool_selection_guidance(query, tools):
-                    return ""
+            module = importlib.import_module(module_name)
+            exports = {attr: getattr(module, attr) for attr in attrs}
+        except (ImportError, AttributeError):
+            continue
+        globals().update(exports)
+        globals()[flag] = True
+        return module_name
+    return None
+
+TOOL_BACKEND = _load_tool_backend()
+logger.info("Tool selection backend: %s", TOOL_BACKEND or "none")
 
 # Create Azure OpenAI client instance
 azure_client = AzureOpenAI(
@@ -347,20 +557,50 @@ class HealthResponse(BaseModel):
     uptime: float = Field(..., description="Server uptime in seconds")
     memory_usage: Dict[str, Any] = Field(..., description="Memory usage information")
 
+# Response cache for requests sampled at (near) zero temperature
+_RESPONSE_CACHE_MAXSIZE = int(os.getenv("OPENAI_RESPONSE_CACHE_SIZE", "1024"))
+_RESPONSE_CACHE_TTL = float(os.getenv("OPENAI_RESPONSE_CACHE_TTL", "300"))
+_RESPONSE_CACHE_MAX_TEMPERATURE = 0.05
+
+# Memory sampling for /health
+_MEMORY_SAMPLE_INTERVAL = 0.5  # seconds
+_MB = 1.0 / (1024 * 1024)
+
 class OpenAIModelManager:
     """Manages OpenAI API integration"""
     
+    __slots__ = (
+        "model_type", "model_path", "is_loaded", "start_time",
+        "config", "confirmation_system", "_response_cache", "_inflight",
+        "_process", "_memory_cache",
+        "_temperature", "_top_p", "_frequency_penalty", "_presence_penalty", "_max_tokens",
+    )
+    
     def __init__(self):
         self.model_type = "openai"
         self.model_path = None
         self.is_loaded = True  # Always true since we're using API
-        self.load_lock = threading.Lock()
         self.start_time = time.time()
         
         # Apply environment variable overrides
         self.config = PLATFORM_CONFIG
         self.apply_env_overrides()
         
+        # Resolve generation defaults once instead of per request
+        self._temperature = float(self.config.get("temperature", 0.7))
+        self._top_p = float(self.config.get("top_p", 0.9))
+        self._frequency_penalty = float(self.config.get("frequency_penalty", 0.0))
+        self._presence_penalty = float(self.config.get("presence_penalty", 0.0))
+        self._max_tokens = int(self.config.get("max_tokens", 800))
+        
+        # Reuse one process handle; memory readings are sampled at most every _MEMORY_SAMPLE_INTERVAL
+        self._process = psutil.Process(os.getpid())
+        self._memory_cache = (0.0, None)
+        
+        # Bounded TTL cache for near-deterministic completions (LRU order)
+        self._response_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        
         # Initialize web search confirmation system (if available)
         if WEB_SEARCH_CONFIRMATION_AVAILABLE and WebSearchConfirmationSystem:
             self.confirmation_system = WebSearchConfirmationSystem()
@@ -416,11 +656,11 @@ class OpenAIModelManager:
         """Generate response using Azure OpenAI API"""
         try:
             # Use config values if parameters are not provided
-            temperature = temperature if temperature is not None else self.config.get("temperature", 0.7)
-            top_p = top_p if top_p is not None else self.config.get("top_p", 0.9)
-            frequency_penalty = frequency_penalty if frequency_penalty is not None else self.config.get("frequency_penalty", 0.0)
-            presence_penalty = presence_penalty if presence_penalty is not None else self.config.get("presence_penalty", 0.0)
-            max_tokens = max_tokens if max_tokens is not None else self.config.get("max_tokens", 800)
+            temperature = temperature if temperature is not None else self._temperature
+            top_p = top_p if top_p is not None else self._top_p
+            frequency_penalty = frequency_penalty if frequency_penalty is not None else self._frequency_penalty
+            presence_penalty = presence_penalty if presence_penalty is not None else self._presence_penalty
+            max_tokens = max_tokens if max_tokens is not None else self._max_tokens
             
             # Check for medical RAG integration
             if MEDICAL_RAG_AVAILABLE and medical_rag:
@@ -448,7 +688,7 @@ class OpenAIModelManager:
                                 "sources": rag_response.get("sources", [])
                             }
                     except Exception as e:
-                        logger.error(f"Medical RAG error: {e}")
+                        logger.error("Medical RAG error: %s", e)
                         # Continue with normal processing
             
             # Check for enhanced system prompt
@@ -462,24 +702,19 @@ class OpenAIModelManager:
                         enhanced_prompt = get_enhanced_system_prompt(tools)
                         logger.info("Using legacy enhanced system prompt for tool selection")
                 except Exception as e:
-                    logger.error(f"Enhanced system prompt error: {e}")
+                    logger.error("Enhanced system prompt error: %s", e)
                 
                 if enhanced_prompt:
-                    # Check if there's already a system message
-                    has_system = False
-                    for msg in messages:
+                    # Build a new list rather than mutating the caller's messages
+                    for i, msg in enumerate(messages):
                         if msg.get("role") == "system":
                             # Append to existing system message
-                            msg["content"] = msg.get("content", "") + "\n\n" + enhanced_prompt
-                            has_system = True
+                            merged = {**msg, "content": (msg.get("content") or "") + "\n\n" + enhanced_prompt}
+                            messages = [*messages[:i], merged, *messages[i + 1:]]
                             break
-                    
-                    if not has_system:
+                    else:
                         # Add as first message
-                        messages.insert(0, {
-                            "role": "system",
-                            "content": enhanced_prompt
-                        })
+                        messages = [{"role": "system", "content": enhanced_prompt}, *messages]
             
             # Handle tool_choice parameter
             api_tool_choice = tool_choice
@@ -489,68 +724,135 @@ class OpenAIModelManager:
                     "type": "function",
                     "function": {"name": tool_choice.get("function", {}).get("name", "")}
                 }
-                logger.info(f"Using specific tool choice: {api_tool_choice}")
-            
-            # Generate response using Azure OpenAI API
-            completion = azure_client.chat.completions.create(
-                model=AZURE_OPENAI_DEPLOYMENT,
-                messages=messages,
-                temperature=temperature,
-                top_p=top_p,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-                max_tokens=max_tokens,
-                stop=stop,
-                tools=tools,
-                tool_choice=api_tool_choice
-            )
-            
-            # Extract response content
-            response_message = completion.choices[0].message
-            response_content = response_message.content or ""
-            
-            # Check for tool calls
-            tool_calls = None
-            if hasattr(response_message, 'tool_calls') and response_message.tool_calls:
-                tool_calls = []
-                for tool_call in response_message.tool_calls:
-                    tool_calls.append({
-                        "id": tool_call.id,
-                        "type": tool_call.type,
-                        "function": {
-                            "name": tool_call.function.name,
-                            "arguments": tool_call.function.arguments
-                        }
-                    })
-                    
-                    # Execute tool calls if function tools are available
-                    if FUNCTION_TOOLS_AVAILABLE and function_tools:
-                        try:
-                            # Parse arguments
-                            arguments = json.loads(tool_call.function.arguments)
-                            
-                            # Execute function
-                            result = function_tools.execute_function(tool_call.function.name, arguments)
-                            
-                            # Add result to tool call
-                            tool_calls[-1]["function"]["result"] = json.dumps(result) if isinstance(result, (dict, list)) else str(result)
-                        except Exception as e:
-                            logger.error(f"Error executing function {tool_call.function.name}: {e}")
-                            tool_calls[-1]["function"]["result"] = json.dumps({"error": str(e)})
+                logger.info("Using specific tool choice: %s", api_tool_choice)
             
-            return {
-                "success": True,
-                "response": response_content,
-                "tool_calls": tool_calls
-            }
+            # Generate response using Azure OpenAI API; near-deterministic requests are
+            # served from (and coalesced through) the response cache
+            completion_args = (messages, max_tokens, temperature, top_p, frequency_penalty,
+                               presence_penalty, stop, tools, api_tool_choice)
+            if temperature > _RESPONSE_CACHE_MAX_TEMPERATURE:
+                return await self._create_completion(*completion_args)
+            return await self._cached_completion(completion_args)
             
         except Exception as e:
-            logger.error(f"Error generating response: {e}")
+            logger.error("Error generating response: %s", e)
             return {
                 "success": False,
                 "error": str(e)
             }
     
+    async def _create_completion(self, messages: List[Dict[str, Any]], max_tokens: int,
+                                 temperature: float, top_p: float,
+                                 frequency_penalty: float, presence_penalty: float,
+                                 stop: Optional[List[str]], tools: Optional[List[Dict[str, Any]]],
+                                 tool_choice: Any) -> Dict[str, Any]:
+        """Call Azure OpenAI and execute any returned tool calls"""
+        # The SDK client is synchronous; keep the event loop free while Azure responds
+        completion = await asyncio.to_thread(
+            azure_client.chat.completions.create,
+            model=AZURE_OPENAI_DEPLOYMENT,
+            messages=messages,
+            temperature=temperature,
+            top_p=top_p,
+            frequency_penalty=frequency_penalty,
+            presence_penalty=presence_penalty,
+            max_tokens=max_tokens,
+            stop=stop,
+            tools=tools,
+            tool_choice=tool_choice
+        )
+        
+        # Extract response content
+        response_message = completion.choices[0].message
+        response_content = response_message.content or ""
+        
+        # Check for tool calls
+        tool_calls = None
+        if hasattr(response_message, 'tool_calls') and response_message.tool_calls:
+            tool_calls = []
+            for tool_call in response_message.tool_calls:
+                function_name = tool_call.function.name
+                raw_arguments = tool_call.function.arguments
+                function_entry = {
+                    "name": function_name,
+                    "arguments": raw_arguments
+                }
+                tool_calls.append({
+                    "id": tool_call.id,
+                    "type": tool_call.type,
+                    "function": function_entry
+                })
+                
+                # Execute tool calls if function tools are available
+                if FUNCTION_TOOLS_AVAILABLE and function_tools:
+                    try:
+                        # Parse arguments once and hand the dict straight to the tool
+                        arguments = _json_loads(raw_arguments)
+                        result = await run_in_tool_executor(function_tools.execute_function, function_name, arguments)
+                        function_entry["result"] = _tool_result_content(result)
+                    except Exception as e:
+                        logger.error("Error executing function %s: %s", function_name, e)
+                        function_entry["result"] = _json_dumps({"error": str(e)})
+        
+        return {
+            "success": True,
+            "response": response_content,
+            "tool_calls": tool_calls
+        }
+    
+    def _response_cache_key(self, completion_args: tuple) -> str:
+        """Hash the request parameters that determine a completion"""
+        key_parts = [AZURE_OPENAI_DEPLOYMENT, *completion_args]
+        if ORJSON_AVAILABLE:
+            encoded = orjson.dumps(key_parts, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+        else:
+            encoded = json.dumps(key_parts, sort_keys=True, default=str).encode()
+        return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+    
+    async def _cached_completion(self, completion_args: tuple) -> Dict[str, Any]:
+        """Serve a completion from the TTL cache, coalescing identical in-flight requests"""
+        cache_key = self._response_cache_key(completion_args)
+        now = time.monotonic()
+        
+        cached = self._response_cache.get(cache_key)
+        if cached is not None:
+            expires_at, result = cached
+            if expires_at > now:
+                self._response_cache.move_to_end(cache_key)
+                return dict(result)
+            del self._response_cache[cache_key]
+        
+        while (pending := self._inflight.get(cache_key)) is not None:
+            try:
+                return dict(await asyncio.shield(pending))
+            except asyncio.CancelledError:
+                # A cancelled leader (its client went away) isn't our failure: retry, taking
+                # over as leader if nobody else has; if we were the ones cancelled, propagate
+                if not pending.cancelled():
+                    raise
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            result = await self._create_completion(*completion_args)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved so an unawaited future doesn't log a warning
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+        
+        # Tool results can be time-sensitive, so only plain answers are cached
+        if result.get("success") and not result.get("tool_calls"):
+            self._response_cache[cache_key] = (time.monotonic() + _RESPONSE_CACHE_TTL, result)
+            if len(self._response_cache) > _RESPONSE_CACHE_MAXSIZE:
+                self._response_cache.popitem(last=False)
+        future.set_result(result)
+        return dict(result)
+    
     async def generate_stream(self, messages: List[Dict[str, Any]], max_tokens: int = 800, 
                        temperature: float = None, top_p: float = None,
                        frequency_penalty: float = None, presence_penalty: float = None,
@@ -559,10 +861,10 @@ class OpenAIModelManager:
         """Generate streaming response using Azure OpenAI API"""
         try:
             # Set default parameters if not provided
-            temperature = temperature if temperature is not None else self.config.get("temperature", 0.7)
-            top_p = top_p if top_p is not None else self.config.get("top_p", 0.9)
-            frequency_penalty = frequency_penalty if frequency_penalty is not None else self.config.get("frequency_penalty", 0.0)
-            presence_penalty = presence_penalty if presence_penalty is not None else self.config.get("presence_penalty", 0.0)
+            temperature = temperature if temperature is not None else self._temperature
+            top_p = top_p if top_p is not None else self._top_p
+            frequency_penalty = frequency_penalty if frequency_penalty is not None else self._frequency_penalty
+            presence_penalty = presence_penalty if presence_penalty is not None else self._presence_penalty
             
             # Call Azure OpenAI API with streaming
             response = azure_client.chat.completions.create(
@@ -579,35 +881,41 @@ class OpenAIModelManager:
                 stream=True
             )
             
+            # One id/timestamp per completion; the chunk skeleton is reused since each
+            # chunk is serialized before the next one is filled in
+            created = int(time.time())
+            choice_data = {
+                "index": 0,
+                "delta": {},
+                "finish_reason": None
+            }
+            chunk_data = {
+                "id": f"chatcmpl-{created}",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": AZURE_OPENAI_DEPLOYMENT,
+                "choices": [choice_data]
+            }
+            
             # Stream the response
             for chunk in response:
                 if chunk.choices and chunk.choices[0].delta:
                     delta = chunk.choices[0].delta
-                    
-                    # Format chunk as OpenAI-compatible streaming response
-                    chunk_data = {
-                        "id": f"chatcmpl-{int(time.time())}",
-                        "object": "chat.completion.chunk",
-                        "created": int(time.time()),
-                        "model": AZURE_OPENAI_DEPLOYMENT,
-                        "choices": [{
-                            "index": 0,
-                            "delta": {},
-                            "finish_reason": chunk.choices[0].finish_reason
-                        }]
-                    }
+                    delta_data = {}
+                    choice_data["delta"] = delta_data
+                    choice_data["finish_reason"] = chunk.choices[0].finish_reason
                     
                     # Add content if present
                     if hasattr(delta, "content") and delta.content is not None:
-                        chunk_data["choices"][0]["delta"]["content"] = delta.content
+                        delta_data["content"] = delta.content
                     
                     # Add role if present
                     if hasattr(delta, "role") and delta.role is not None:
-                        chunk_data["choices"][0]["delta"]["role"] = delta.role
+                        delta_data["role"] = delta.role
                     
                     # Add tool calls if present
                     if hasattr(delta, "tool_calls") and delta.tool_calls:
-                        chunk_data["choices"][0]["delta"]["tool_calls"] = [
+                        delta_data["tool_calls"] = [
                             {
                                 "id": tc.id,
                                 "type": tc.type,
@@ -619,20 +927,20 @@ class OpenAIModelManager:
                             for tc in delta.tool_calls
                         ]
                     
-                    yield f"data: {json.dumps(chunk_data)}\n\n"
+                    yield f"data: {_json_dumps(chunk_data)}\n\n"
             
             # Send final [DONE] message
             yield "data: [DONE]\n\n"
             
         except Exception as e:
-            logger.error(f"Error generating streaming response with OpenAI: {e}")
+            logger.error("Error generating streaming response with OpenAI: %s", e)
             error_chunk = {
                 "error": {
                     "message": f"Streaming error: {str(e)}",
                     "type": "openai_streaming_error"
                 }
             }
-            yield f"data: {json.dumps(error_chunk)}\n\n"
+            yield f"data: {_json_dumps(error_chunk)}\n\n"
     
     def execute_function_calls(self, tool_calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Execute function calls from OpenAI response"""
@@ -644,7 +952,7 @@ class OpenAIModelManager:
         for tool_call in tool_calls:
             try:
                 function_name = tool_call["function"]["name"]
-                arguments = json.loads(tool_call["function"]["arguments"])
+                arguments = _json_loads(tool_call["function"]["arguments"])
                 
                 # Execute function
                 result = function_tools.execute_function(function_name, arguments)
@@ -654,53 +962,154 @@ class OpenAIModelManager:
                     "tool_call_id": tool_call["id"],
                     "role": "tool",
                     "name": function_name,
-                    "content": json.dumps(result) if isinstance(result, (dict, list)) else str(result)
+                    "content": _tool_result_content(result)
                 })
             except Exception as e:
                 results.append({
                     "tool_call_id": tool_call["id"],
                     "role": "tool",
                     "name": tool_call["function"]["name"],
-                    "content": json.dumps({"error": str(e)})
+                    "content": _json_dumps({"error": str(e)})
                 })
         
         return results
     
     def get_memory_info(self) -> Dict[str, Any]:
         """Get memory usage information"""
-        process = psutil.Process(os.getpid())
+        now = time.monotonic()
+        sampled_at, cached = self._memory_cache
+        if cached is not None and now - sampled_at < _MEMORY_SAMPLE_INTERVAL:
+            return cached
+        
+        process = self._process
         memory_info = process.memory_info()
         
-        return {
-            "rss": memory_info.rss / (1024 * 1024),  # RSS in MB
-            "vms": memory_info.vms / (1024 * 1024),  # VMS in MB
+        info = {
+            "rss": memory_info.rss * _MB,  # RSS in MB
+            "vms": memory_info.vms * _MB,  # VMS in MB
             "percent": process.memory_percent(),
-            "available": psutil.virtual_memory().available / (1024 * 1024)  # Available memory in MB
+            "available": psutil.virtual_memory().available * _MB  # Available memory in MB
         }
+        self._memory_cache = (now, info)
+        return info
 
 # Initialize the model manager
 model_manager = OpenAIModelManager()
 
+_CORS_ALLOW_METHODS = b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+_CORS_MAX_AGE = b"600"
+
+class CORSHeadersMiddleware:
+    """Pure ASGI CORS allowing any origin with credentials.
+    
+    Equivalent to CORSMiddleware(allow_origins=["*"], allow_credentials=True,
+    allow_methods=["*"], allow_headers=["*"]) but only touches the response start
+    message, so streamed body chunks pass straight through.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        origin = None
+        request_method = None
+        request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+        
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+        
+        # Credentialed requests can't use "*", so the request origin is echoed back
+        cors_headers = [
+            (b"access-control-allow-origin", origin),
+            (b"access-control-allow-credentials", b"true"),
+            (b"vary", b"Origin"),
+        ]
+        
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            # Preflight: answer directly without reaching the app
+            cors_headers.append((b"access-control-allow-methods", _CORS_ALLOW_METHODS))
+            cors_headers.append((b"access-control-max-age", _CORS_MAX_AGE))
+            if request_headers:
+                cors_headers.append((b"access-control-allow-headers", request_headers))
+            cors_headers.append((b"content-length", b"2"))
+            cors_headers.append((b"content-type", b"text/plain; charset=utf-8"))
+            await send({"type": "http.response.start", "status": 200, "headers": cors_headers})
+            await send({"type": "http.response.body", "body": b"OK"})
+            return
+        
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *cors_headers]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_cors)
+
 # FastAPI app
+ResponseClass = ORJSONResponse if ORJSON_AVAILABLE else JSONResponse
 app = FastAPI(
     title="HuddleAI OpenAI Server",
     description="OpenAI-compatible API server using Azure OpenAI",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ResponseClass
 )
 
+@app.on_event("startup")
+async def start_completion_batcher():
+    """Start request coalescing if enabled"""
+    if completion_batcher is not None:
+        completion_batcher.start()
+        logger.info("Request batching enabled (window=%.0fms, max=%d)",
+                    completion_batcher.max_delay * 1000, completion_batcher.max_batch)
+
+@app.on_event("startup")
+async def warm_up():
+    """Exercise lazily initialized paths so the first real request doesn't pay for them"""
+    model_manager.get_memory_info()
+    try:
+        if MULTI_TOOL_AVAILABLE:
+            multi_tool_executor.analyze_query("warmup")
+        elif TOOL_TRIGGERS_AVAILABLE:
+            tool_trigger_system.identify_tool("warmup")
+        if FUNCTION_TOOLS_AVAILABLE and function_tools:
+            await get_function_definitions()
+    except Exception as e:
+        logger.warning("Warm-up step failed: %s", e)
+
+@app.on_event("shutdown")
+async def close_http_client():
+    """Stop request coalescing and close the pooled Azure REST client"""
+    if completion_batcher is not None:
+        await completion_batcher.stop()
+    await _http_client.aclose()
+    _tool_executor.shutdown(wait=False)
+
 # Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(CORSHeadersMiddleware)
 
-@app.get("/")
-async def root():
-    """Root endpoint with documentation"""
-    return HTMLResponse(content="""
+async def read_json_body(request: Request) -> Any:
+    """Parse a request body with the fast JSON helper instead of Starlette's stdlib json"""
+    return _json_loads(await request.body())
+
+# Static payloads built once at import
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_SSE_DONE = b"data: [DONE]\n\n"
+# Keep reverse proxies (nginx) from buffering the event stream
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+_ROOT_HTML = """
     <html>
         <head>
             <title>HuddleAI OpenAI Server</title>
@@ -724,32 +1133,204 @@ async def root():
             </div>
         </body>
     </html>
-    """)
+    """.encode()
+
+_HEALTH_STATIC = {
+    "status": "healthy",
+    "model_loaded": model_manager.is_loaded,
+    "model_type": model_manager.model_type,
+    "device": "azure"
+}
+
+_MODEL_INFO = {
+    "model_type": "openai",
+    "model_name": AZURE_OPENAI_DEPLOYMENT,
+    "provider": "Azure OpenAI",
+    "endpoint": AZURE_OPENAI_ENDPOINT.replace(AZURE_OPENAI_API_KEY, "***"),
+    "api_version": AZURE_OPENAI_API_VERSION,
+    "capabilities": {
+        "chat": True,
+        "streaming": True,
+        "function_calling": True,
+        "medical_rag": MEDICAL_RAG_AVAILABLE
+    },
+    "config": {
+        "temperature": model_manager.config.get("temperature", 0.7),
+        "max_tokens": model_manager.config.get("max_tokens", 800),
+        "top_p": model_manager.config.get("top_p", 0.9)
+    }
+}
 
-@app.get("/health", response_model=HealthResponse)
+@app.get("/")
+async def root():
+    """Root endpoint with documentation"""
+    return HTMLResponse(content=_ROOT_HTML)
+
+@app.get("/health", responses={200: {"model": HealthResponse}})
 async def health():
     """Health check endpoint"""
-    uptime = time.time() - model_manager.start_time
-    memory_usage = model_manager.get_memory_info()
-    
+    # Returned as a plain dict so FastAPI skips response_model re-validation
     return {
-        "status": "healthy",
-        "model_loaded": model_manager.is_loaded,
-        "model_type": model_manager.model_type,
-        "device": "azure",
-        "uptime": uptime,
-        "memory_usage": memory_usage
+        **_HEALTH_STATIC,
+        "uptime": time.time() - model_manager.start_time,
+        "memory_usage": model_manager.get_memory_info()
     }
 
+# Tool-selection strategies. Each returns (system messages to prepend, tool_choice, tools)
+# and is picked once at import from the loaded backend instead of per request.
+# Messages are appended in the order they are produced and reversed once on return,
+# so the most recently added instruction ends up first, as with repeated insert(0, ...).
+def _strategy_multi_tool(last_user_message: str, tools: List[Dict[str, Any]]):
+    """Use the multi-tool executor for complex queries"""
+    prefix = []
+    tool_choice = "auto"
+    try:
+        analysis = multi_tool_executor.analyze_query(last_user_message)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Multi-tool analysis: multi_tool=%s, tools=%s",
+                        analysis.get('multi_tool', False),
+                        [m['tool_name'] for m in analysis.get('all_matches', [])])
+        
+        if analysis["multi_tool"]:
+            execution_plan = analysis["execution_plan"]
+            
+            # Check if this is a parallel execution
+            if execution_plan["type"] == "parallel":
+                # Add parallel execution guidance
+                guidance = multi_tool_executor.enhance_prompt(last_user_message, tools)
+                if guidance:
+                    prefix.append({
+                        "role": "system",
+                        "content": guidance
+                    })
+                    logger.info("Added parallel multi-tool execution guidance")
+                
+                # For parallel execution, let the model decide based on guidance
+                prefix.append({
+                    "role": "system",
+                    "content": "This query requires multiple tools to be executed in parallel. Execute all identified tools simultaneously and combine their results."
+                })
+                logger.info("Added parallel execution hint")
+                
+            elif execution_plan["type"] == "multi":
+                # Add sequential multi-tool guidance
+                guidance = multi_tool_executor.enhance_prompt(last_user_message, tools)
+                if guidance:
+                    prefix.append({
+                        "role": "system",
+                        "content": guidance
+                    })
+                    logger.info("Added sequential multi-tool execution guidance")
+                # For sequential execution, let the model decide based on guidance
+            elif analysis["all_matches"]:
+                # Fall back to single tool handling
+                tool_name = analysis["all_matches"][0]["tool_name"]
+                tool_choice = {"type": "function", "function": {"name": tool_name}}
+                logger.info("Forcing single tool choice: %s", tool_name)
+        elif analysis["all_matches"]:
+            # Fall back to single tool handling
+            tool_name = analysis["all_matches"][0]["tool_name"]
+            tool_choice = {"type": "function", "function": {"name": tool_name}}
+            logger.info("Forcing single tool choice: %s", tool_name)
+    except Exception as e:
+        logger.error("Multi-tool executor error: %s", e)
+        # Fall back to default behavior
+        tool_choice = "auto"
+    return prefix[::-1], tool_choice, tools
+
+def _strategy_tool_triggers(last_user_message: str, tools: List[Dict[str, Any]]):
+    """Use the simple trigger-word system"""
+    prefix = []
+    tool_choice = "auto"
+    guidance = tool_trigger_system.enhance_prompt(last_user_message, tools)
+    if guidance:
+        prefix.append({
+            "role": "system",
+            "content": guidance
+        })
+        logger.info("Added tool triggers guidance")
+        
+        # Try to identify the tool and force tool choice if confident
+        tool_result = tool_trigger_system.identify_tool(last_user_message)
+        if tool_result:  # Always force tool choice if a tool is identified
+            tool_name = tool_result["tool_name"]
+            
+            # Force tool choice for all matches
+            tool_choice = {"type": "function", "function": {"name": tool_name}}
+            logger.info("Forcing tool choice: %s with confidence %.2f", tool_name, tool_result['confidence'])
+            
+            # Add a stronger system message to force tool use
+            prefix.append({
+                "role": "system",
+                "content": f"YOU MUST USE the {tool_name} tool for this query. DO NOT solve this manually."
+            })
+    return prefix[::-1], tool_choice, tools
+
+def _strategy_tool_identification(last_user_message: str, tools: List[Dict[str, Any]]):
+    """Use the enhanced tool identification system"""
+    prefix = []
+    analysis = tool_integration.analyze_query(last_user_message, tools)
+    
+    # Add tool selection guidance as a system message
+    if analysis and "guidance" in analysis:
+        prefix.append({
+            "role": "system",
+            "content": analysis["guidance"]
+        })
+        logger.info("Added tool selection guidance")
+    
+    # Add enhanced system prompt at the beginning
+    enhanced_prompt = tool_integration.enhance_system_prompt(tools)
+    if enhanced_prompt:
+        prefix.append({
+            "role": "system",
+            "content": enhanced_prompt
+        })
+        logger.info("Added enhanced system prompt")
+    return prefix[::-1], "auto", tools
+
+def _strategy_tool_selection(last_user_message: str, tools: List[Dict[str, Any]]):
+    """Fall back to legacy tool selection"""
+    prefix = []
+    guidance = get_tool_selection_guidance(last_user_message, tools)
+    if guidance:
+        prefix.append({
+            "role": "system",
+            "content": f"Tool selection guidance: {guidance}"
+        })
+        logger.info("Added legacy tool selection guidance")
+    
+    # Add enhanced system prompt at the beginning
+    enhanced_prompt = get_enhanced_system_prompt(tools)
+    if enhanced_prompt:
+        prefix.append({
+            "role": "system",
+            "content": enhanced_prompt
+        })
+        logger.info("Added legacy enhanced system prompt")
+    return prefix[::-1], "auto", tools
+
+def _strategy_none(last_user_message: str, tools: List[Dict[str, Any]]):
+    """No tool-selection backend available"""
+    return [], "auto", tools
+
+if MULTI_TOOL_AVAILABLE:
+    _tool_strategy = _strategy_multi_tool
+elif TOOL_TRIGGERS_AVAILABLE:
+    _tool_strategy = _strategy_tool_triggers
+elif TOOL_IDENTIFICATION_AVAILABLE:
+    _tool_strategy = _strategy_tool_identification
+elif TOOL_SELECTION_AVAILABLE:
+    _tool_strategy = _strategy_tool_selection
+else:
+    _tool_strategy = _strategy_none
+
 @app.post("/v1/chat/completions")
 async def create_chat_completion_endpoint(request: ChatCompletionRequest):
     """OpenAI-compatible chat completions endpoint."""
     try:
-        # Convert Pydantic model messages to dict if needed
-        if hasattr(request.messages[0], "dict"):
-            messages = [msg.dict() if hasattr(msg, "dict") else msg for msg in request.messages]
-        else:
-            messages = request.messages
+        # Messages are validated ChatMessage models; dump them with Pydantic v2's model_dump
+        messages = [msg.model_dump() for msg in request.messages]
             
         model = request.model
         temperature = request.temperature
@@ -759,152 +1340,22 @@ async def create_chat_completion_endpoint(request: ChatCompletionRequest):
         
         # Default tool_choice to "auto"
         tool_choice = "auto"
-        enhanced_tools = request.tools
+        tools = request.tools
+        enhanced_tools = tools
         
         # Check for enhanced tool selection
         try:
-            # Get the last user message
-            user_messages = [msg for msg in messages if msg.get("role") == "user"]
-            if user_messages and request.tools:
-                last_user_message = user_messages[-1].get("content", "")
-                
-                # Try different tool selection methods in order of preference
-                if MULTI_TOOL_AVAILABLE:
-                    # Use the multi-tool executor for complex queries
-                    try:
-                        analysis = multi_tool_executor.analyze_query(last_user_message)
-                        logger.info(f"Multi-tool analysis: multi_tool={analysis.get('multi_tool', False)}, tools={[m['tool_name'] for m in analysis.get('all_matches', [])]}")
-                        
-                        if analysis["multi_tool"]:
-                            execution_plan = analysis["execution_plan"]
-                            
-                            # Check if this is a parallel execution
-                            if execution_plan["type"] == "parallel":
-                                # Add parallel execution guidance
-                                guidance = multi_tool_executor.enhance_prompt(last_user_message, request.tools)
-                                if guidance:
-                                    guidance_msg = {
-                                        "role": "system",
-                                        "content": guidance
-                                    }
-                                    messages.insert(0, guidance_msg)
-                                    logger.info("Added parallel multi-tool execution guidance")
-                                
-                                # For parallel execution, let the model decide based on guidance
-                                enhanced_tools = request.tools
-                                tool_choice = "auto"
-                                
-                                # Add parallel execution hint
-                                parallel_msg = {
-                                    "role": "system",
-                                    "content": "This query requires multiple tools to be executed in parallel. Execute all identified tools simultaneously and combine their results."
-                                }
-                                messages.insert(0, parallel_msg)
-                                logger.info("Added parallel execution hint")
-                                
-                            elif execution_plan["type"] == "multi":
-                                # Add sequential multi-tool guidance
-                                guidance = multi_tool_executor.enhance_prompt(last_user_message, request.tools)
-                                if guidance:
-                                    guidance_msg = {
-                                        "role": "system",
-                                        "content": guidance
-                                    }
-                                    messages.insert(0, guidance_msg)
-                                    logger.info("Added sequential multi-tool execution guidance")
-                                
-                                # For sequential execution, let the model decide based on guidance
-                                enhanced_tools = request.tools
-                                tool_choice = "auto"
-                            else:
-                                # Fall back to single tool handling
-                                if analysis["all_matches"]:
-                                    tool_name = analysis["all_matches"][0]["tool_name"]
-                                    tool_choice = {"type": "function", "function": {"name": tool_name}}
-                                    logger.info(f"Forcing single tool choice: {tool_name}")
-                        else:
-                            # Fall back to single tool handling
-                            if analysis["all_matches"]:
-                                tool_name = analysis["all_matches"][0]["tool_name"]
-                                tool_choice = {"type": "function", "function": {"name": tool_name}}
-                                logger.info(f"Forcing single tool choice: {tool_name}")
-                    except Exception as e:
-                        logger.error(f"Multi-tool executor error: {e}")
-                        # Fall back to default behavior
-                        enhanced_tools = request.tools
-                        tool_choice = "auto"
-                elif TOOL_TRIGGERS_AVAILABLE:
-                    # Use the simple trigger-word system
-                    guidance = tool_trigger_system.enhance_prompt(last_user_message, request.tools)
-                    if guidance:
-                        guidance_msg = {
-                            "role": "system",
-                            "content": guidance
-                        }
-                        messages.insert(0, guidance_msg)
-                        logger.info("Added tool triggers guidance")
-                        
-                        # Try to identify the tool and force tool choice if confident
-                        tool_result = tool_trigger_system.identify_tool(last_user_message)
-                        if tool_result:  # Always force tool choice if a tool is identified
-                            tool_name = tool_result["tool_name"]
-                            parameters = tool_result["parameters"]
-                            
-                            # Force tool choice for all matches
-                            enhanced_tools = request.tools
-                            tool_choice = {"type": "function", "function": {"name": tool_name}}
-                            logger.info(f"Forcing tool choice: {tool_name} with confidence {tool_result['confidence']:.2f}")
-                            
-                            # Add a stronger system message to force tool use
-                            force_msg = {
-                                "role": "system",
-                                "content": f"YOU MUST USE the {tool_name} tool for this query. DO NOT solve this manually."
-                            }
-                            messages.insert(0, force_msg)
-                elif TOOL_IDENTIFICATION_AVAILABLE:
-                    # Use the enhanced tool identification system
-                    analysis = tool_integration.analyze_query(last_user_message, request.tools)
-                    
-                    # Add tool selection guidance as a system message
-                    if analysis and "guidance" in analysis:
-                        guidance_msg = {
-                            "role": "system",
-                            "content": analysis["guidance"]
-                        }
-                        messages.insert(0, guidance_msg)
-                        logger.info("Added tool selection guidance")
-                    
-                    # Add enhanced system prompt at the beginning
-                    enhanced_prompt = tool_integration.enhance_system_prompt(request.tools)
-                    if enhanced_prompt:
-                        system_msg = {
-                            "role": "system",
-                            "content": enhanced_prompt
-                        }
-                        messages.insert(0, system_msg)
-                        logger.info("Added enhanced system prompt")
-                elif TOOL_SELECTION_AVAILABLE:
-                    # Fall back to legacy tool selection
-                    guidance = get_tool_selection_guidance(last_user_message, request.tools)
-                    if guidance:
-                        guidance_msg = {
-                            "role": "system",
-                            "content": f"Tool selection guidance: {guidance}"
-                        }
-                        messages.insert(0, guidance_msg)
-                        logger.info("Added legacy tool selection guidance")
-                    
-                    # Add enhanced system prompt at the beginning
-                    enhanced_prompt = get_enhanced_system_prompt(request.tools)
-                    if enhanced_prompt:
-                        system_msg = {
-                            "role": "system",
-                            "content": enhanced_prompt
-                        }
-                        messages.insert(0, system_msg)
-                        logger.info("Added legacy enhanced system prompt")
+            # Get the last user message (scan from the end, no intermediate list)
+            last_user_message = next(
+                (msg.get("content", "") for msg in reversed(messages) if msg.get("role") == "user"),
+                None
+            )
+            if last_user_message is not None and tools:
+                prefix, tool_choice, enhanced_tools = _tool_strategy(last_user_message, tools)
+                if prefix:
+                    messages = prefix + messages
         except Exception as e:
-            logger.info(f"Enhanced tool selection error: {e}")
+            logger.info("Enhanced tool selection error: %s", e)
         
         if stream:
             # Return streaming response
@@ -918,72 +1369,73 @@ async def create_chat_completion_endpoint(request: ChatCompletionRequest):
                     tools=enhanced_tools,
                     tool_choice=tool_choice
                 ):
-                    yield f"data: {json.dumps(chunk)}\n\n"
-                yield "data: [DONE]\n\n"
+                    yield _SSE_PREFIX + _json_dumps_bytes(chunk) + _SSE_SUFFIX
+                yield _SSE_DONE
             
-            return StreamingResponse(generate_stream(), media_type="text/event-stream")
+            return StreamingResponse(generate_stream(), media_type="text/event-stream", headers=_SSE_HEADERS)
         else:
+            # Tool-free requests can share an upstream call with identical in-flight requests
+            if completion_batcher is not None and not enhanced_tools:
+                return await completion_batcher.submit(model, messages, temperature, max_tokens)
+            
             # Return non-streaming response
-            async for response in generate_response(
+            response = await generate_response_once(
                 messages=messages,
                 model=model,
                 temperature=temperature,
                 max_tokens=max_tokens,
-                stream=False,
                 tools=enhanced_tools,
                 tool_choice=tool_choice
-            ):
-                # Check if response contains tool calls that need execution
-                if response.get("choices") and response["choices"][0].get("message", {}).get("tool_calls"):
-                    tool_calls = response["choices"][0]["message"]["tool_calls"]
-                    
-                    # Execute tools in parallel if possible
-                    if len(tool_calls) > 1:
-                        logger.info(f"🔄 Executing {len(tool_calls)} tools in parallel")
-                        tool_results = await execute_tools_parallel(tool_calls)
-                    else:
-                        logger.info(f"🔄 Executing single tool")
-                        tool_results = await execute_tools_parallel(tool_calls)
-                    
-                    # Add tool results to messages for final response
-                    tool_result_messages = []
-                    for i, tool_call in enumerate(tool_calls):
-                        if i < len(tool_results):
-                            result = tool_results[i]
-                            tool_result_messages.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call["id"],
-                                "content": str(result.get("result", "Tool execution failed"))
-                            })
-                    
-                    # Generate final response with tool results
-                    if tool_result_messages:
-                        final_messages = messages + [
-                            response["choices"][0]["message"]
-                        ] + tool_result_messages
-                        
-                        logger.info("🔄 Generating final response with tool results")
-                        async for final_response in generate_response(
-                            messages=final_messages,
-                            model=model,
-                            temperature=temperature,
-                            max_tokens=max_tokens,
-                            stream=False,
-                            tools=enhanced_tools,
-                            tool_choice="none"  # Don't call tools again
-                        ):
-                            return final_response
+            )
+            
+            # Check if response contains tool calls that need execution
+            choices = response.get("choices")
+            response_message = (choices[0].get("message") or {}) if choices else {}
+            tool_calls = response_message.get("tool_calls")
+            if tool_calls:
+                
+                # Execute tools in parallel if possible
+                if len(tool_calls) > 1:
+                    logger.info("🔄 Executing %d tools in parallel", len(tool_calls))
+                else:
+                    logger.info("🔄 Executing single tool")
+                tool_results = await execute_tools_parallel(tool_calls)
                 
-                return response
+                # Add tool results to messages for final response
+                tool_result_messages = [
+                    {
+                        "role": "tool",
+                        "tool_call_id": tool_call["id"],
+                        "content": str(result.get("result", "Tool execution failed"))
+                    }
+                    for tool_call, result in zip(tool_calls, tool_results)
+                ]
+                
+                # Generate final response with tool results
+                if tool_result_messages:
+                    # One list built in place rather than two intermediate concatenations
+                    final_messages = [*messages, response_message, *tool_result_messages]
+                    
+                    logger.info("🔄 Generating final response with tool results")
+                    return await generate_response_once(
+                        messages=final_messages,
+                        model=model,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        tools=enhanced_tools,
+                        tool_choice="none"  # Don't call tools again
+                    )
+            
+            return response
     except Exception as e:
-        logger.error(f"Error in chat completion endpoint: {e}")
+        logger.error("Error in chat completion endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/v1/chat/completions/tool_results")
 async def chat_completion_tool_results(request: Request):
     """Handle tool results from previous chat completion"""
     try:
-        data = await request.json()
+        data = await read_json_body(request)
         
         # Extract messages and tool results
         messages = data.get("messages", [])
@@ -1000,6 +1452,11 @@ async def chat_completion_tool_results(request: Request):
         if not response_data.get("success"):
             raise HTTPException(status_code=500, detail=response_data.get("error", "Unknown error"))
         
+        # Approximate token usage (whitespace-delimited words), computed once
+        response_text = response_data.get("response")
+        prompt_tokens = sum(len(content.split()) for msg in messages if (content := msg.get("content")))
+        completion_tokens = len(response_text.split()) if response_text else 0
+        
         # Create response
         response = {
             "id": f"chatcmpl-{int(time.time())}",
@@ -1010,14 +1467,14 @@ async def chat_completion_tool_results(request: Request):
                 "index": 0,
                 "message": {
                     "role": "assistant",
-                    "content": response_data.get("response")
+                    "content": response_text
                 },
                 "finish_reason": "stop"
             }],
             "usage": {
-                "prompt_tokens": sum(len(msg.get("content", "").split()) if msg.get("content") else 0 for msg in messages),
-                "completion_tokens": len(response_data.get("response", "").split()) if response_data.get("response") else 0,
-                "total_tokens": sum(len(msg.get("content", "").split()) if msg.get("content") else 0 for msg in messages) + (len(response_data.get("response", "").split()) if response_data.get("response") else 0)
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
             }
         }
         
@@ -1029,41 +1486,36 @@ async def chat_completion_tool_results(request: Request):
         return response
         
     except Exception as e:
-        logger.error(f"Error in tool results endpoint: {e}")
+        logger.error("Error in tool results endpoint: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/model/info")
 async def model_info():
     """Get model information"""
-    return {
-        "model_type": "openai",
-        "model_name": AZURE_OPENAI_DEPLOYMENT,
-        "provider": "Azure OpenAI",
-        "endpoint": AZURE_OPENAI_ENDPOINT.replace(AZURE_OPENAI_API_KEY, "***"),
-        "api_version": AZURE_OPENAI_API_VERSION,
-        "capabilities": {
-            "chat": True,
-            "streaming": True,
-            "function_calling": True,
-            "medical_rag": MEDICAL_RAG_AVAILABLE
-        },
-        "config": {
-            "temperature": model_manager.config.get("temperature", 0.7),
-            "max_tokens": model_manager.config.get("max_tokens", 800),
-            "top_p": model_manager.config.get("top_p", 0.9)
-        }
-    }
+    return _MODEL_INFO
+
+# Function definitions are fixed once function_tools is imported, so they are loaded once
+_function_definitions = None
+_NO_FUNCTION_TOOLS = ResponseClass([], status_code=503)
+
+async def get_function_definitions():
+    """Return the cached function definitions, loading them on first use"""
+    global _function_definitions
+    if _function_definitions is None:
+        _function_definitions = await run_in_tool_executor(function_tools.get_function_definitions)
+    return _function_definitions
 
 @app.get("/functions")
 async def list_functions():
     """List available functions"""
     if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
-        return {"error": "Function tools not available"}
+        # Same list shape as the success case, flagged unavailable by status code
+        return _NO_FUNCTION_TOOLS
     
     try:
-        return function_tools.get_function_definitions()
+        return await get_function_definitions()
     except Exception as e:
-        logger.error(f"Error listing functions: {e}")
+        logger.error("Error listing functions: %s", e)
         # Return empty list as fallback
         return []
 
@@ -1071,7 +1523,7 @@ async def list_functions():
 async def execute_tool_endpoint(request: Request):
     """Execute a tool directly with user permission"""
     try:
-        data = await request.json()
+        data = await read_json_body(request)
         
         tool_name = data.get("name")
         arguments = data.get("arguments", {})
@@ -1088,8 +1540,8 @@ async def execute_tool_endpoint(request: Request):
             raise HTTPException(status_code=404, detail=f"Tool '{tool_name}' not found")
         
         # Execute the function
-        logger.info(f"🔧 Directly executing {tool_name} with arguments: {arguments}")
-        result = function_tools.execute_function(tool_name, arguments)
+        logger.info("🔧 Directly executing %s with arguments: %s", tool_name, arguments)
+        result = await run_in_tool_executor(function_tools.execute_function, tool_name, arguments)
         
         return {
             "tool": tool_name,
@@ -1100,7 +1552,7 @@ async def execute_tool_endpoint(request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Tool execution error: {str(e)}")
+        logger.error("❌ Tool execution error: %s", e)
         raise HTTPException(status_code=500, detail=f"Tool execution failed: {str(e)}")
 
 def main():
@@ -1118,12 +1570,21 @@ def main():
     # Get port from environment variable if set
     port = int(os.environ.get("PORT", args.port))
     
+    # Prefer the uvloop/httptools implementations from uvicorn[standard] when installed
+    # (uvloop is unavailable on Windows, so fall back rather than fail)
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    logger.info("Starting server with loop=%s http=%s", loop, http)
+    
     # Run the server
     uvicorn.run(
         "openai_gguf_server:app",
         host=args.host,
         port=port,
-        reload=args.reload
+        reload=args.reload,
+        loop=loop,
+        http=http,
+        access_log=False
     )
 
 if __name__ == "__main__":
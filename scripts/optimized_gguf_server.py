@@ -2,6 +2,9 @@
 """
 Optimized GGUF Resource Server
 Supports both GGUF models (via llama.cpp) and PyTorch models for maximum performance
+
+PYTORCH_CUDA_ALLOC_CONF defaults to expandable segments so variable-length
+generate calls don't fragment the CUDA caching allocator; set it to override.
 """
 
 import os
@@ -10,18 +13,36 @@ import time
 import json
 import psutil
 import gc
+import re
+import functools
+import hashlib
+import bisect
 import subprocess
-from typing import Optional, Dict, Any, AsyncGenerator, List
+from typing import Optional, Dict, Any, AsyncGenerator, List, Tuple, Union
 import asyncio
 from pydantic import BaseModel, Field
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse, JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import threading
+import concurrent.futures
 from contextlib import asynccontextmanager
 from pathlib import Path
+from types import MappingProxyType
+from collections import OrderedDict
+
+# Must be set before torch initializes CUDA
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,roundup_power2_divisions:16")
+
+# Prefer orjson for JSON encode/decode (with fallback to stdlib json)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
 
 # Add parent directory to sys.path for imports
 current_dir = Path(__file__).parent
@@ -31,17 +52,25 @@ sys.path.insert(0, str(current_dir))
 
 # Try importing llama-cpp-python for GGUF support
 try:
-    from llama_cpp import Llama
+    from llama_cpp import Llama, LlamaRAMCache
     LLAMA_CPP_AVAILABLE = True
     print("✅ llama-cpp-python available for GGUF models")
 except ImportError:
     LLAMA_CPP_AVAILABLE = False
     print("⚠️ llama-cpp-python not available - GGUF models disabled")
 
+# Try importing the GGUF reader for sizing GPU offload from the model header
+try:
+    from gguf import GGUFReader
+    GGUF_READER_AVAILABLE = True
+except ImportError:
+    GGUF_READER_AVAILABLE = False
+
 # Try importing transformers for PyTorch fallback
 try:
     import torch
-    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from transformers import AutoTokenizer, AutoModelForCausalLM, LogitsProcessor, LogitsProcessorList, BitsAndBytesConfig
+    from transformers import TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
     TORCH_AVAILABLE = True
     print("✅ PyTorch/transformers available for fallback")
 except ImportError:
@@ -51,6 +80,9 @@ except ImportError:
 # Import platform-adaptive configuration
 from platform_adaptive_config import get_platform_config
 
+# Import the shared micro-batching window
+from batch_queue import collect_batch, fill_window
+
 # Import function calling tools (with fallback)
 try:
     from function_tools import function_tools
@@ -91,6 +123,22 @@ except ImportError as e:
     WEB_SEARCH_CONFIRMATION_AVAILABLE = False
     WebSearchConfirmationSystem = None
 
+def _json_loads(data):
+    """Parse a JSON string or bytes, using orjson when available"""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+def _json_dumps_bytes(obj) -> bytes:
+    """Serialize to UTF-8 JSON bytes, using orjson when available"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj).encode()
+
+def _json_dumps(obj) -> str:
+    """Serialize to a JSON string, using orjson when available"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj)
+
 # Request/Response models (same as before)
 class ChatMessage(BaseModel):
     role: str = Field(..., description="Role of the message sender (system, user, assistant)")
@@ -124,6 +172,7 @@ class ChatCompletionRequest(BaseModel):
     user: Optional[str] = Field(default=None, description="User identifier")
     tools: Optional[List[Dict[str, Any]]] = Field(default=None, description="Available tools")
     tool_choice: Optional[str] = Field(default="auto", description="Tool choice strategy")
+    ai_enhance: Optional[bool] = Field(default=False, description="Have the model enrich tool results in its final answer")
 
 class HealthResponse(BaseModel):
     status: str = Field(..., description="Server status")
@@ -134,22 +183,430 @@ class HealthResponse(BaseModel):
     uptime: float = Field(..., description="Server uptime in seconds")
     memory_usage: Dict[str, Any] = Field(..., description="Memory usage information")
 
+_ENHANCED_SYSTEM_PREAMBLE = """You are an intelligent AI assistant with access to powerful tools and functions.
+
+IMPORTANT RULES:
+1. YOU MUST use the available tools for:
+   - Medical queries (use medical_search, loinc_search, or icd11_search functions)
+   - Mathematical calculations (use calculator function)
+   - Unit conversions (use convert_units function)
+   - Time and date queries (use get_current_time function)
+   - Weather information (use get_weather function)
+
+2. NEVER answer medical queries from your own knowledge - ALWAYS call the appropriate medical tool.
+
+3. When using tools, ALWAYS format your response like this:
+   "I'll use the [tool_name] tool to answer this question."
+   Then provide the parameters you're using.
+
+4. After mentioning the tool, WAIT for the tool's response before continuing.
+
+5. Be precise and accurate in your responses.
+
+Available tools: """
+
+# Leading text of every prompt without a caller-supplied system message, cut at a line break
+# so it tokenizes identically on its own
+_STATIC_PROMPT_PREFIX = "System: " + _ENHANCED_SYSTEM_PREAMBLE[:_ENHANCED_SYSTEM_PREAMBLE.rindex("\n") + 1]
+
+@functools.lru_cache(maxsize=64)
+def _build_system_prompt(tools_key: tuple) -> str:
+    """Build the enhanced system prompt for a tuple of (name, description) pairs"""
+    if not tools_key:
+        return _ENHANCED_SYSTEM_PREAMBLE + "None available"
+    
+    parts = [_ENHANCED_SYSTEM_PREAMBLE + ", ".join(name or "" for name, _ in tools_key), "\nTool descriptions:"]
+    parts.extend(f"- {name}: {description}" for name, description in tools_key)
+    return "\n".join(parts)
+
+_ENV_OVERRIDES = {
+    "HUDDLE_MODEL_TYPE": "model_type",
+    "HUDDLE_DEVICE": "device",
+    "HUDDLE_BATCH_SIZE": "batch_size",
+    "HUDDLE_MAX_CONCURRENT": "max_concurrent_requests",
+    "HUDDLE_MEMORY_FRACTION": "memory_fraction",
+    "HUDDLE_ATTENTION_IMPL": "attention_implementation",
+    "HUDDLE_N_GPU_LAYERS": "n_gpu_layers",
+    "HUDDLE_N_CTX": "n_ctx",
+    "HUDDLE_N_BATCH": "n_batch",
+    "HUDDLE_N_THREADS": "n_threads",
+    "HUDDLE_N_PARALLEL": "n_parallel"
+}
+_INT_CONFIG_KEYS = frozenset(["batch_size", "max_concurrent_requests", "n_gpu_layers", "n_ctx", "n_batch", "n_threads",
+                              "n_parallel"])
+_LOADING_CONFIG_KEYS = ("n_ctx", "n_batch", "n_threads", "n_gpu_layers")
+
+@functools.cache
+def _build_config() -> MappingProxyType:
+    """Resolve the platform configuration and environment overrides once"""
+    config = get_platform_config()
+    
+    for env_var, config_key in _ENV_OVERRIDES.items():
+        if env_var not in os.environ:
+            continue
+        value = os.environ[env_var]
+        
+        # Convert to appropriate type
+        if config_key in _INT_CONFIG_KEYS:
+            try:
+                value = int(value)
+            except ValueError:
+                print(f"⚠️ Invalid value for {env_var}: {value}. Must be an integer.")
+                continue
+        elif config_key == "memory_fraction":
+            try:
+                value = float(value)
+            except ValueError:
+                print(f"⚠️ Invalid value for {env_var}: {value}. Must be a float.")
+                continue
+        
+        config[config_key] = value
+        print(f"🔧 Override from environment: {config_key} = {value}")
+    
+    config["loading_config"] = {
+        **config.get("loading_config", {}),
+        **{key: config[key] for key in _LOADING_CONFIG_KEYS if key in config},
+    }
+    return MappingProxyType(config)
+
+if TORCH_AVAILABLE:
+    class OpenAIFrequencyPresencePenaltyProcessor(LogitsProcessor):
+        """OpenAI-style frequency/presence penalties over the tokens generated so far"""
+        
+        def __init__(self, prompt_len: int, frequency_penalty: float, presence_penalty: float):
+            self.prompt_len = prompt_len
+            self.frequency_penalty = frequency_penalty
+            self.presence_penalty = presence_penalty
+        
+        def __call__(self, input_ids, scores):
+            generated = input_ids[:, self.prompt_len:]
+            if generated.shape[-1] == 0:
+                return scores
+            counts = torch.zeros_like(scores).scatter_add_(1, generated, torch.ones_like(generated, dtype=scores.dtype))
+            return scores - counts * self.frequency_penalty - (counts > 0).to(scores.dtype) * self.presence_penalty
+    
+    class StopOnEvent(StoppingCriteria):
+        """Ends generate() early once the streaming consumer sets the event"""
+        
+        def __init__(self, event: threading.Event):
+            self.event = event
+        
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def _penalty_kwargs(prompt_len: int, frequency_penalty: float, presence_penalty: float) -> Dict[str, Any]:
+    """generate() kwargs applying OpenAI penalties; empty when both are zero"""
+    if not frequency_penalty and not presence_penalty:
+        return {}
+    return {"logits_processor": LogitsProcessorList([
+        OpenAIFrequencyPresencePenaltyProcessor(prompt_len, frequency_penalty, presence_penalty)
+    ])}
+
+@functools.lru_cache(maxsize=32)
+def _stop_pattern(stops: tuple):
+    """Single-pass matcher for a set of literal stop sequences"""
+    return re.compile("|".join(map(re.escape, stops)))
+
+def _find_stop(text: str, stops: tuple) -> int:
+    """Index of the earliest stop sequence in text, or -1"""
+    if len(stops) == 1:
+        return text.find(stops[0])
+    match = _stop_pattern(stops).search(text)
+    return match.start() if match else -1
+
+def _truncate_at_stop(text: str, stop: Optional[List[str]]) -> str:
+    """Cut text at the earliest occurrence of any stop sequence"""
+    stops = tuple(seq for seq in stop or () if seq)
+    if not stops:
+        return text
+    index = _find_stop(text, stops)
+    return text if index < 0 else text[:index].strip()
+
+def _stream_until_stop(pieces, stop: Optional[List[str]]):
+    """Re-yield streamed text, ending before the first stop sequence.
+    
+    The last len(longest stop) - 1 characters are held back so a stop split
+    across pieces is never partially emitted.
+    """
+    stops = tuple(seq for seq in stop or () if seq)
+    holdback = max(map(len, stops)) - 1 if stops else 0
+    pending = ""
+    for piece in pieces:
+        pending += piece
+        if stops:
+            index = _find_stop(pending, stops)
+            if index >= 0:
+                if index:
+                    yield pending[:index]
+                return
+        if len(pending) > holdback:
+            yield pending[:len(pending) - holdback]
+            pending = pending[len(pending) - holdback:]
+    if pending:
+        yield pending
+
+def _autosize_gpu_layers(gguf_path: Path, platform: str) -> Optional[int]:
+    """Layers that fit in free GPU memory per the GGUF header, or None if it can't be determined"""
+    if not GGUF_READER_AVAILABLE:
+        return None
+    
+    # Free accelerator memory (unified memory on Apple Silicon)
+    if platform == "macos_apple_silicon":
+        free_bytes = psutil.virtual_memory().available * 0.6
+    elif "cuda" in platform and TORCH_AVAILABLE and torch.cuda.is_available():
+        free_bytes = torch.cuda.mem_get_info()[0]
+    else:
+        return None
+    
+    try:
+        reader = GGUFReader(str(gguf_path))
+        block_count = next(
+            int(field.parts[field.data[0]][0])
+            for name, field in reader.fields.items() if name.endswith(".block_count")
+        )
+        layer_bytes = sum(int(t.n_bytes) for t in reader.tensors if t.name.startswith("blk.")) / block_count
+    except Exception as e:
+        print(f"⚠️ Could not read GGUF header for GPU sizing: {e}")
+        return None
+    
+    # Keep two layers' worth of headroom for the KV cache and compute buffers
+    layers = int(free_bytes // layer_bytes) - 2
+    return -1 if layers >= block_count else max(0, layers)
+
+def _prefetch_file(path: Path):
+    """Ask the kernel to start reading a (to be mmap'd) file ahead of first use"""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"⚠️ Readahead hint failed for {path}: {e}")
+
+def _auto_threads() -> int:
+    """CPU threads for llama.cpp: usable cores (capped at 16) minus one for the server"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, min(16, cores) - 1)
+
+def _model_size(path: Path) -> str:
+    """On-disk size of a model file or checkpoint directory"""
+    if not path or not path.exists():
+        return "Unknown"
+    if path.is_file():
+        total_size = path.stat().st_size
+    else:
+        total_size = sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+    return f"{total_size / (1024**3):.1f}GB"
+
+_VM_TTL_S = 0.5
+_vm_cache = (0.0, None)
+
+def _virtual_memory():
+    """psutil.virtual_memory(), reused for _VM_TTL_S so health probes don't hammer /proc"""
+    global _vm_cache
+    now = time.monotonic()
+    stamp, memory = _vm_cache
+    if memory is None or now - stamp > _VM_TTL_S:
+        memory = psutil.virtual_memory()
+        _vm_cache = (now, memory)
+    return memory
+
+class AsyncDynamicBatchTokenizer:
+    """Micro-batch concurrent tokenize calls into one tokenizer invocation.
+    
+    Prompts are collected for up to batch_wait_timeout_s (or max_batch_size
+    prompts) and encoded together on the given executor; each caller gets its
+    own unpadded input_ids list back.
+    """
+    
+    def __init__(self, tokenizer, executor: concurrent.futures.Executor, max_batch_size: int = 32,
+                 batch_wait_timeout_s: float = 0.002, max_length: int = 1024):
+        self.tokenizer = tokenizer
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.batch_wait_timeout_s = batch_wait_timeout_s
+        self.max_length = max_length
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def stop(self):
+        """Stop the background batching loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def encode(self, prompt: str) -> List[int]:
+        """Queue a prompt and wait for its token ids"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompt, future))
+        return await future
+    
+    def _encode_batch(self, prompts: List[str]) -> List[List[int]]:
+        return self.tokenizer(prompts, truncation=True, max_length=self.max_length)["input_ids"]
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await collect_batch(self._queue, self.max_batch_size, self.batch_wait_timeout_s)
+            
+            try:
+                encoded = await loop.run_in_executor(self.executor, self._encode_batch, [prompt for prompt, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), input_ids in zip(batch, encoded):
+                if not future.done():
+                    future.set_result(input_ids)
+
+class GenerationBatcher:
+    """Shared generation queue in front of the model: one engine task, many awaiting requests.
+    
+    Requests that arrive within batch_wait_timeout_s of each other (up to
+    max_batch_size) and share sampling parameters are left-padded and decoded as
+    one PyTorch batch (GGUF models don't use the queue). Each caller gets its own
+    completion back. While a batch runs, new requests queue up and form the next.
+    
+    Pending jobs are binned by max_tokens and only batched within a bin, so short
+    completions aren't held behind long ones; each dispatch takes the fullest bin,
+    unless a bin's oldest job has waited max_wait_s, in which case the most overdue
+    bin goes first so sparse bins aren't starved by busy ones.
+    """
+    
+    MAX_TOKEN_BINS = (128, 512, 2048)  # Upper bounds; anything larger lands in the last bin
+    
+    def __init__(self, manager: "OptimizedModelManager", max_batch_size: int = 8,
+                 batch_wait_timeout_s: float = 0.005, max_wait_s: float = 1.0):
+        self.manager = manager
+        self.max_batch_size = max_batch_size
+        self.batch_wait_timeout_s = batch_wait_timeout_s
+        self.max_wait_s = max_wait_s
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._bins: List[list] = [[] for _ in range(len(self.MAX_TOKEN_BINS) + 1)]
+    
+    async def stop(self):
+        """Stop the background batching loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def submit(self, prompt: str, max_tokens: int = 100, temperature: float = None, top_p: float = None,
+                     frequency_penalty: float = None, presence_penalty: float = None,
+                     stop: List[str] = None, **_) -> Dict[str, Any]:
+        """Queue a generation and wait for its generate_response-style result"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        sampling = self.manager._resolve_sampling(temperature, top_p, frequency_penalty, presence_penalty, stop)
+        start_time = time.time()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put((prompt, max_tokens, sampling, future, loop.time()))
+        response, completion_tokens = await future
+        return self.manager._response_payload(response, completion_tokens, start_time, max_tokens, *sampling)
+    
+    def _add(self, item) -> int:
+        """Place a queued job in its max_tokens bin; returns that bin's size"""
+        max_tokens = item[1] if item[1] is not None else float("inf")
+        pending = self._bins[bisect.bisect_left(self.MAX_TOKEN_BINS, max_tokens)]
+        pending.append(item)
+        return len(pending)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not any(self._bins):
+                self._add(await self._queue.get())
+            
+            # Collect arrivals for one window, or until some bin can fill a batch
+            if max(len(pending) for pending in self._bins) < self.max_batch_size:
+                await fill_window(self._queue, self.batch_wait_timeout_s,
+                                  lambda item: self._add(item) >= self.max_batch_size)
+            while not self._queue.empty():
+                self._add(self._queue.get_nowait())
+            
+            # Bins are FIFO, so pending[0] is each bin's oldest job; ties go to the older bin
+            now = loop.time()
+            occupied = [pending for pending in self._bins if pending]
+            overdue = [pending for pending in occupied if now - pending[0][4] >= self.max_wait_s]
+            if overdue:
+                pending = min(overdue, key=lambda pending: pending[0][4])
+            else:
+                pending = max(occupied, key=lambda pending: (len(pending), -pending[0][4]))
+            batch = pending[:self.max_batch_size]
+            del pending[:self.max_batch_size]
+            
+            # Only requests with the same temperature/top_p/penalties can share a generate call
+            groups: Dict[tuple, list] = {}
+            for item in batch:
+                groups.setdefault(item[2][:4], []).append(item)
+            for (temperature, top_p, frequency_penalty, presence_penalty), items in groups.items():
+                requests = [(prompt, max_tokens, sampling[4]) for prompt, max_tokens, sampling, *_ in items]
+                try:
+                    results = await self.manager.run_inference(
+                        self.manager._generate_pytorch_batch, requests,
+                        temperature, top_p, frequency_penalty, presence_penalty
+                    )
+                except Exception as e:
+                    for *_, future, _ in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (*_, future, _), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
+
+_ENHANCE_CACHE_MAXSIZE = int(os.getenv("HUDDLE_ENHANCE_CACHE_SIZE", "2048"))
+_ENHANCE_CACHE_TTL = float(os.getenv("HUDDLE_ENHANCE_CACHE_TTL", "3600"))
+
 class OptimizedModelManager:
+    ASSISTANT_CUE = "\nAssistant: "  # Closes every format_chat_prompt result
+    
     def __init__(self):
         self.model = None
         self.tokenizer = None
+        self.batch_tokenizer = None  # AsyncDynamicBatchTokenizer (PyTorch backend, opt-in)
+        self.generation_batcher = None  # GenerationBatcher (opt-in via HUDDLE_N_PARALLEL)
+        self._device = None  # Input device for the PyTorch backend, pinned at load
+        self._prefix_ids = None  # Token ids of _STATIC_PROMPT_PREFIX (PyTorch backend)
+        self._max_prompt_tokens = 1024
         self.model_type = None  # "gguf" or "pytorch"
         self.model_path = None
+        self.model_size = "Unknown"  # Measured once at load for /health
         self.is_loaded = False
-        self.load_lock = threading.Lock()
+        self._load_lock = asyncio.Lock()
+        self._load_event = asyncio.Event()  # Set once the model is ready
         
-        # Get platform configuration
-        self.config = get_platform_config()
+        # Platform configuration with environment overrides (resolved once per process)
+        self.config = _build_config()
         self.platform = self.config.get("platform", "unknown")
         print(f"🔧 Platform detected: {self.platform}")
         
-        # Apply environment variable overrides
-        self.apply_env_overrides()
+        # Inference runs off the event loop on a single worker (llama.cpp contexts aren't reentrant)
+        self._infer_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="llama")
+        self._infer_slots = asyncio.Semaphore(self.config.get("max_concurrent_requests", 8))
+        
+        # Bounded TTL cache of rewrite-style generations (tool enhancement/integration), LRU order
+        self._enhance_cache: "OrderedDict[str, tuple]" = OrderedDict()
         
         # Initialize web search confirmation system (if available)
         if WEB_SEARCH_CONFIRMATION_AVAILABLE and WebSearchConfirmationSystem:
@@ -157,55 +614,6 @@ class OptimizedModelManager:
         else:
             self.confirmation_system = None
             
-    def apply_env_overrides(self):
-        """Apply environment variable overrides to configuration"""
-        # Check for environment variables and override config
-        env_overrides = {
-            "HUDDLE_MODEL_TYPE": "model_type",
-            "HUDDLE_DEVICE": "device",
-            "HUDDLE_BATCH_SIZE": "batch_size",
-            "HUDDLE_MAX_CONCURRENT": "max_concurrent_requests",
-            "HUDDLE_MEMORY_FRACTION": "memory_fraction",
-            "HUDDLE_ATTENTION_IMPL": "attention_implementation",
-            "HUDDLE_N_GPU_LAYERS": "n_gpu_layers",
-            "HUDDLE_N_CTX": "n_ctx",
-            "HUDDLE_N_BATCH": "n_batch",
-            "HUDDLE_N_THREADS": "n_threads"
-        }
-        
-        # Apply overrides if they exist in environment
-        for env_var, config_key in env_overrides.items():
-            if env_var in os.environ:
-                value = os.environ[env_var]
-                
-                # Convert to appropriate type
-                if config_key in ["batch_size", "max_concurrent_requests", "n_gpu_layers", "n_ctx", "n_batch", "n_threads"]:
-                    try:
-                        value = int(value)
-                    except ValueError:
-                        print(f"⚠️ Invalid value for {env_var}: {value}. Must be an integer.")
-                        continue
-                elif config_key in ["memory_fraction"]:
-                    try:
-                        value = float(value)
-                    except ValueError:
-                        print(f"⚠️ Invalid value for {env_var}: {value}. Must be a float.")
-                        continue
-                
-                # Update config
-                self.config[config_key] = value
-                print(f"🔧 Override from environment: {config_key} = {value}")
-                
-        # Special handling for loading_config
-        loading_config_keys = ["n_ctx", "n_batch", "n_threads", "n_gpu_layers"]
-        loading_config = self.config.get("loading_config", {})
-        
-        for key in loading_config_keys:
-            if key in self.config:
-                loading_config[key] = self.config[key]
-                
-        self.config["loading_config"] = loading_config
-        
     def get_model_path(self) -> Path:
         """Get the full path to the model"""
         # Check for environment variable override
@@ -243,35 +651,56 @@ class OptimizedModelManager:
             return "pytorch"
     
     def load_model(self):
-        """Load the appropriate model type"""
-        with self.load_lock:
-            if self.is_loaded:
-                return
-                
-            model_path = self.get_model_path()
-            if not model_path.exists():
-                raise FileNotFoundError(f"Model not found: {model_path}")
-            
-            self.model_type = self.detect_model_type(model_path)
-            print(f"🔍 Detected model type: {self.model_type}")
-            print(f"📁 Model path: {model_path}")
+        """Load the appropriate model type (blocking; runs on the inference pool via ensure_loaded)"""
+        if self.is_loaded:
+            return
             
-            if self.model_type == "gguf":
-                if LLAMA_CPP_AVAILABLE:
-                    self._load_gguf_model(model_path)
-                else:
-                    print("⚠️ llama-cpp-python not available - falling back to PyTorch model")
-                    # Fall back to original PyTorch model directory
-                    fallback_path = Path(__file__).parent / "llama-3.2-3b-quantized-q4km"
-                    print(f"🔄 Using PyTorch fallback model: {fallback_path}")
-                    self._load_pytorch_model(fallback_path)
-                    self.model_type = "pytorch"  # Update type to reflect actual loading method
+        model_path = self.get_model_path()
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model not found: {model_path}")
+        
+        self.model_type = self.detect_model_type(model_path)
+        print(f"🔍 Detected model type: {self.model_type}")
+        print(f"📁 Model path: {model_path}")
+        
+        if self.model_type == "gguf":
+            if LLAMA_CPP_AVAILABLE:
+                self._load_gguf_model(model_path)
             else:
-                self._load_pytorch_model(model_path)
-                
-            self.model_path = model_path
-            self.is_loaded = True
-            print(f"✅ Model loaded successfully ({self.model_type})")
+                print("⚠️ llama-cpp-python not available - falling back to PyTorch model")
+                # Fall back to original PyTorch model directory
+                fallback_path = Path(__file__).parent / "llama-3.2-3b-quantized-q4km"
+                print(f"🔄 Using PyTorch fallback model: {fallback_path}")
+                self._load_pytorch_model(fallback_path)
+                self.model_type = "pytorch"  # Update type to reflect actual loading method
+        else:
+            self._load_pytorch_model(model_path)
+            
+        self.model_path = model_path
+        self.model_size = _model_size(model_path)
+        
+        # Shared generation queue; n_parallel (HUDDLE_N_PARALLEL) caps how many requests share a dispatch.
+        # PyTorch only: llama.cpp decodes one sequence per context, so a GGUF "batch" would just hold
+        # every caller until the last job finished; the single-worker inference pool already serializes them
+        n_parallel = self.config.get("n_parallel", 0)
+        batching_requested = n_parallel > 1 or os.environ.get("HUDDLE_ENABLE_GENERATION_BATCHING", "false").lower() in ("1", "true", "yes")
+        if batching_requested and self.model_type == "gguf":
+            print("ℹ️ Generation batching skipped for GGUF models (one sequence per llama.cpp context)")
+        elif batching_requested:
+            max_batch_size = n_parallel if n_parallel > 1 else self.config.get("batch_size", 8)
+            self.generation_batcher = GenerationBatcher(self, max_batch_size=max_batch_size)
+            print(f"🔧 Generation queue enabled (up to {self.generation_batcher.max_batch_size} requests per dispatch)")
+        self.is_loaded = True
+        print(f"✅ Model loaded successfully ({self.model_type})")
+    
+    async def ensure_loaded(self):
+        """Load the model once without blocking the event loop"""
+        if self.is_loaded:
+            return
+        async with self._load_lock:
+            if not self.is_loaded:
+                await asyncio.get_running_loop().run_in_executor(self._infer_pool, self.load_model)
+                self._load_event.set()
     
     def _load_gguf_model(self, model_path: Path):
         """Load GGUF model using llama.cpp with config-based parameters"""
@@ -293,72 +722,77 @@ class OptimizedModelManager:
         model_config = {}
         if config_path.exists():
             try:
-                with open(config_path, 'r') as f:
-                    model_config = json.load(f)
+                with open(config_path, 'rb') as f:
+                    model_config = _json_loads(f.read())
                 print(f"📋 Loaded model config: {model_config.get('model_name', 'unknown')}")
             except Exception as e:
                 print(f"⚠️ Failed to load model config: {e}")
         
-        # Get loading config with defaults
-        loading_config = model_config.get("loading_config", {})
+        # Model defaults, with environment overrides already resolved in self.config
+        loading_config = {**model_config.get("loading_config", {}), **self.config["loading_config"]}
         
-        # Apply environment variable overrides to loading_config
-        for key in ["n_ctx", "n_batch", "n_threads", "n_gpu_layers"]:
-            env_key = f"HUDDLE_{key.upper()}"
-            if env_key in os.environ:
-                try:
-                    loading_config[key] = int(os.environ[env_key])
-                    print(f"🔧 Override from environment: {key} = {loading_config[key]}")
-                except ValueError:
-                    print(f"⚠️ Invalid value for {env_key}: {os.environ[env_key]}. Must be an integer.")
+        n_threads = loading_config.get("n_threads") or _auto_threads()
+        
+        # Larger prefill batches on hosts with room for the bigger compute buffers
+        default_n_batch = 2048 if psutil.virtual_memory().total >= 8 * 1024**3 else 512
         
         # Configure llama.cpp with config parameters
         llama_kwargs = {
             "model_path": str(gguf_file),
             "n_ctx": loading_config.get("n_ctx", 8192),
-            "n_batch": loading_config.get("n_batch", 512),
+            "n_batch": loading_config.get("n_batch", default_n_batch),
+            "n_ubatch": loading_config.get("n_ubatch", 512),
             "verbose": loading_config.get("verbose", False),
             "use_mmap": loading_config.get("use_mmap", True),
             "use_mlock": loading_config.get("use_mlock", False),
-            "n_threads": loading_config.get("n_threads", None),
+            "n_threads": n_threads,
+            "n_threads_batch": n_threads,
             "f16_kv": loading_config.get("f16_kv", True),
         }
         
-        # Platform-specific overrides (only if not specified in config or env)
-        if "n_gpu_layers" not in loading_config:
-            # Check for environment variable override
-            if "HUDDLE_N_GPU_LAYERS" in os.environ:
-                try:
-                    llama_kwargs["n_gpu_layers"] = int(os.environ["HUDDLE_N_GPU_LAYERS"])
-                    print(f"🔧 Using GPU layers from environment: {llama_kwargs['n_gpu_layers']}")
-                except ValueError:
-                    print(f"⚠️ Invalid value for HUDDLE_N_GPU_LAYERS: {os.environ['HUDDLE_N_GPU_LAYERS']}. Using platform default.")
-                    if self.platform == "macos_apple_silicon":
-                        llama_kwargs["n_gpu_layers"] = 1
-                        print("🍎 Apple Silicon optimizations applied")
-                    elif "cuda" in self.platform:
-                        llama_kwargs["n_gpu_layers"] = -1
-                        print("🚀 CUDA optimizations applied")
-                    else:
-                        llama_kwargs["n_gpu_layers"] = 0
-                        print("💻 CPU optimizations applied")
+        # Size offload from free GPU memory, then platform defaults (only if not specified in config or env)
+        auto_layers = None if "n_gpu_layers" in loading_config else _autosize_gpu_layers(gguf_file, self.platform)
+        if auto_layers is not None:
+            llama_kwargs["n_gpu_layers"] = auto_layers
+            print(f"🔧 Auto-sized GPU layers from free memory: {auto_layers}")
+        elif "n_gpu_layers" not in loading_config:
+            if self.platform == "macos_apple_silicon":
+                llama_kwargs["n_gpu_layers"] = 1
+                print("🍎 Apple Silicon optimizations applied")
+            elif "cuda" in self.platform:
+                llama_kwargs["n_gpu_layers"] = -1
+                print("🚀 CUDA optimizations applied")
             else:
-                if self.platform == "macos_apple_silicon":
-                    llama_kwargs["n_gpu_layers"] = 1
-                    print("🍎 Apple Silicon optimizations applied")
-                elif "cuda" in self.platform:
-                    llama_kwargs["n_gpu_layers"] = -1
-                    print("🚀 CUDA optimizations applied")
-                else:
-                    llama_kwargs["n_gpu_layers"] = 0
-                    print("💻 CPU optimizations applied")
+                llama_kwargs["n_gpu_layers"] = 0
+                print("💻 CPU optimizations applied")
         else:
             llama_kwargs["n_gpu_layers"] = loading_config["n_gpu_layers"]
             print(f"🔧 Using config GPU layers: {llama_kwargs['n_gpu_layers']}")
         
         # Load the model
         try:
+            _prefetch_file(gguf_file)
             self.model = Llama(**llama_kwargs)
+            
+            # One-token warmup so kernel setup and page faults don't land on the first request
+            try:
+                self.model("warmup", max_tokens=1, echo=False)
+            except Exception as e:
+                print(f"⚠️ GGUF warmup failed: {e}")
+            
+            # Keep KV state for recent prompts so interleaved conversations reuse their prefix
+            cache_mb = int(os.environ.get("HUDDLE_PROMPT_CACHE_MB", "2048"))
+            if cache_mb > 0:
+                self.model.set_cache(LlamaRAMCache(capacity_bytes=cache_mb * 1024**2))
+                print(f"🧠 Prompt prefix cache enabled ({cache_mb}MB)")
+                
+                # Prefill the tool-less system prompt once so chat requests resume from its KV state
+                if os.environ.get("HUDDLE_PRIME_PROMPT_CACHE", "1") != "0":
+                    try:
+                        self.model(self.format_chat_prompt([]), max_tokens=1, echo=False)
+                        print("🧠 Prompt cache primed with the system prompt")
+                    except Exception as e:
+                        print(f"⚠️ Prompt cache priming failed: {e}")
             set_model_interface(self.model)  # Make the model available to other modules
             
             # For GGUF models, we don't need a separate tokenizer
@@ -389,9 +823,10 @@ class OptimizedModelManager:
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
         
-        # Load model with optimizations
+        # Load model with optimizations (bf16 on GPUs that support it: fp16 range without overflow risk)
+        default_dtype = torch.bfloat16 if torch.cuda.is_available() and torch.cuda.is_bf16_supported() else torch.float16
         model_kwargs = {
-            "torch_dtype": torch.float16,
+            "torch_dtype": default_dtype,
             "low_cpu_mem_usage": True,
             "device_map": "auto",
         }
@@ -413,6 +848,16 @@ class OptimizedModelManager:
             else:
                 model_kwargs["device_map"] = "cpu"
         
+        # Fused attention kernels: SDPA by default, or an explicit HUDDLE_ATTENTION_IMPL
+        env_attn = os.environ.get("HUDDLE_ATTENTION_IMPL")
+        if env_attn:
+            model_kwargs["attn_implementation"] = env_attn
+            print(f"🔧 Using attention implementation from environment: {env_attn}")
+        elif self.config.get("attention_implementation") == "flash_attention_2":
+            model_kwargs["attn_implementation"] = "flash_attention_2"
+        else:
+            model_kwargs["attn_implementation"] = "sdpa"
+        
         # Check for dtype override
         env_dtype = os.environ.get("HUDDLE_DTYPE")
         if env_dtype:
@@ -426,7 +871,26 @@ class OptimizedModelManager:
                 model_kwargs["torch_dtype"] = torch.bfloat16
                 print("🔧 Using bfloat16 precision from environment")
             else:
-                print(f"⚠️ Invalid dtype: {env_dtype}. Using default float16.")
+                print(f"⚠️ Invalid dtype: {env_dtype}. Using default {default_dtype}.")
+        
+        # Optional bitsandbytes weight quantization (CUDA only; MPS/CPU keep the fp16 path)
+        load_in_4bit = os.environ.get("HUDDLE_LOAD_IN_4BIT", "false").lower() in ("1", "true", "yes")
+        load_in_8bit = os.environ.get("HUDDLE_LOAD_IN_8BIT", "false").lower() in ("1", "true", "yes")
+        quantized = (load_in_4bit or load_in_8bit) and torch.cuda.is_available()
+        if quantized:
+            if load_in_4bit:
+                model_kwargs["quantization_config"] = BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_compute_dtype=torch.bfloat16,
+                    bnb_4bit_quant_type="nf4"
+                )
+                print("🔧 Loading weights in 4-bit NF4 (bitsandbytes)")
+            else:
+                model_kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+                print("🔧 Loading weights in 8-bit (bitsandbytes)")
+            model_kwargs.pop("torch_dtype", None)
+        elif load_in_4bit or load_in_8bit:
+            print("⚠️ bitsandbytes quantization requires CUDA - using unquantized weights")
         
         self.model = AutoModelForCausalLM.from_pretrained(
             str(model_path),
@@ -434,58 +898,65 @@ class OptimizedModelManager:
         )
         
         self.model.eval()
+        self._device = next(self.model.parameters()).device
+        self._max_prompt_tokens = self.config["loading_config"].get("n_ctx", 1024)
+        self._prefix_ids = self.tokenizer(_STATIC_PROMPT_PREFIX, return_tensors="pt")["input_ids"].to(self._device)
+        
+        if os.environ.get("HUDDLE_ENABLE_DYN_BATCH_TOKENIZER", "false").lower() in ("1", "true", "yes"):
+            # Runs on the inference pool: HF fast tokenizers aren't safe to share across threads
+            self.batch_tokenizer = AsyncDynamicBatchTokenizer(self.tokenizer, self._infer_pool,
+                                                              max_length=self._max_prompt_tokens)
+            print("🔧 Dynamic batch tokenizer enabled")
+        
+        # Static KV cache + compiled forward so CUDA decode steps can be captured as graphs
+        eager_forward = None
+        if self._device.type == "cuda" and not quantized and os.environ.get("HUDDLE_COMPILE", "1") != "0":
+            eager_forward = self.model.forward
+            generation_defaults = (self.model.generation_config.cache_implementation,
+                                   self.model.generation_config.max_length)
+            self.model.generation_config.cache_implementation = "static"
+            self.model.generation_config.max_length = self.config["loading_config"].get("n_ctx", 8192)
+            self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead", fullgraph=True)
+            print("🚀 Static KV cache + torch.compile enabled (set HUDDLE_COMPILE=0 to disable)")
+        
+        # One-token warmup so kernel compilation doesn't land on the first request
+        try:
+            with torch.inference_mode():
+                self.model.generate(**self.tokenizer("warmup", return_tensors="pt").to(self._device),
+                                    max_new_tokens=1, pad_token_id=self.tokenizer.eos_token_id)
+        except Exception as e:
+            print(f"⚠️ PyTorch warmup failed: {e}")
+            if eager_forward is not None:
+                # A compiled forward that can't warm up would fail every request, so fall back to eager
+                self.model.forward = eager_forward
+                (self.model.generation_config.cache_implementation,
+                 self.model.generation_config.max_length) = generation_defaults
+                print("↩️ Reverted to the eager forward and dynamic KV cache")
         print(f"✅ PyTorch model loaded on {model_kwargs.get('device_map', 'auto')}")
         
         # Try to load model config if available
         config_path = model_path / "optimization_config.json"
         if config_path.exists():
             try:
-                with open(config_path, 'r') as f:
-                    self.model_config = json.load(f)
+                with open(config_path, 'rb') as f:
+                    self.model_config = _json_loads(f.read())
                 print(f"📋 Loaded model config: {self.model_config.get('model_name', 'unknown')}")
             except Exception as e:
                 print(f"⚠️ Failed to load model config: {e}")
                 self.model_config = {}
     
-    def format_chat_prompt(self, messages: List[Dict[str, str]], tools: List[Dict[str, Any]] = None) -> str:
-        """Format chat messages for the model with enhanced system prompts"""
+    def format_chat_prompt(self, messages: List[Union[Dict[str, str], "ChatMessage"]],
+                           tools: List[Dict[str, Any]] = None) -> str:
+        """Format chat messages (dicts or ChatMessage) for the model with enhanced system prompts"""
         formatted_parts = []
         
-        # Enhanced system prompt for function calling
-        enhanced_system_prompt = """You are an intelligent AI assistant with access to powerful tools and functions.
-
-IMPORTANT RULES:
-1. YOU MUST use the available tools for:
-   - Medical queries (use medical_search, loinc_search, or icd11_search functions)
-   - Mathematical calculations (use calculator function)
-   - Unit conversions (use convert_units function)
-   - Time and date queries (use get_current_time function)
-   - Weather information (use get_weather function)
-
-2. NEVER answer medical queries from your own knowledge - ALWAYS call the appropriate medical tool.
-
-3. When using tools, ALWAYS format your response like this:
-   "I'll use the [tool_name] tool to answer this question."
-   Then provide the parameters you're using.
-
-4. After mentioning the tool, WAIT for the tool's response before continuing.
-
-5. Be precise and accurate in your responses.
-
-Available tools: """
-        
-        if tools:
-            tool_names = [tool.get("function", {}).get("name", "") for tool in tools]
-            enhanced_system_prompt += ", ".join(tool_names)
-            
-            # Add detailed tool descriptions
-            enhanced_system_prompt += "\n\nTool descriptions:"
-            for tool in tools:
-                if isinstance(tool, dict) and "function" in tool:
-                    func = tool["function"]
-                    enhanced_system_prompt += f"\n- {func.get('name')}: {func.get('description')}"
-        else:
-            enhanced_system_prompt += "None available"
+        # Enhanced system prompt for function calling (cached per tool set)
+        tools_key = tuple(
+            (tool["function"].get("name"), tool["function"].get("description"))
+            for tool in tools or ()
+            if isinstance(tool, dict) and "function" in tool
+        )
+        enhanced_system_prompt = _build_system_prompt(tools_key)
         
         # Check if there's already a system message
         has_system_message = any(msg.get('role') == 'system' for msg in messages)
@@ -495,7 +966,7 @@ Available tools: """
         
         for message in messages:
             role = message.get('role', 'user')
-            content = message.get('content', '').strip()
+            content = (message.get('content') or '').strip()
             
             if not content:
                 continue
@@ -514,18 +985,74 @@ Available tools: """
                 formatted_parts.append(f"Tool ({tool_name}): {content}")
         
         # Add the assistant prompt
-        formatted_prompt = "\n".join(formatted_parts) + "\nAssistant: "
+        formatted_prompt = "\n".join(formatted_parts) + self.ASSISTANT_CUE
         return formatted_prompt
     
+    def extend_chat_prompt(self, prompt: str, system_content: str) -> str:
+        """Add a system turn to a format_chat_prompt result, keeping everything before the assistant cue as an exact prefix"""
+        return f"{prompt[:-len(self.ASSISTANT_CUE)]}\nSystem: {system_content.strip()}{self.ASSISTANT_CUE}"
+    
+    async def run_inference(self, func, *args, **kwargs):
+        """Run a blocking model call on the inference pool"""
+        await self.ensure_loaded()
+        loop = asyncio.get_running_loop()
+        async with self._infer_slots:
+            return await loop.run_in_executor(self._infer_pool, functools.partial(func, *args, **kwargs))
+    
+    async def generate_response_async(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        """Non-blocking wrapper around generate_response"""
+        if self.generation_batcher is not None:
+            return await self.generation_batcher.submit(prompt, **kwargs)
+        if self.batch_tokenizer is not None:
+            kwargs["input_ids"] = await self.batch_tokenizer.encode(prompt)
+        return await self.run_inference(self.generate_response, prompt, **kwargs)
+    
+    async def generate_cached(self, prompt: str, max_tokens: int, temperature: float, top_p: float = None) -> str:
+        """Response text for a deterministic-enough prompt, served from the TTL cache when it recurs"""
+        cache_key = hashlib.blake2b(_json_dumps_bytes([prompt, max_tokens, temperature, top_p]),
+                                    digest_size=16).hexdigest()
+        cached = self._enhance_cache.get(cache_key)
+        if cached is not None:
+            expires_at, response = cached
+            if expires_at > time.monotonic():
+                self._enhance_cache.move_to_end(cache_key)
+                return response
+            del self._enhance_cache[cache_key]
+        
+        response_data = await self.generate_response_async(prompt, max_tokens=max_tokens,
+                                                           temperature=temperature, top_p=top_p)
+        response = response_data["response"]
+        if response_data.get("completion_tokens"):
+            # Error fallbacks report zero tokens and are not cached
+            self._enhance_cache[cache_key] = (time.monotonic() + _ENHANCE_CACHE_TTL, response)
+            if len(self._enhance_cache) > _ENHANCE_CACHE_MAXSIZE:
+                self._enhance_cache.popitem(last=False)
+        return response
+    
     def generate_response(self, prompt: str, max_tokens: int = 100, 
                          temperature: float = None, top_p: float = None,
                          frequency_penalty: float = None, presence_penalty: float = None,
-                         stop: List[str] = None) -> Dict[str, Any]:
+                         stop: List[str] = None, input_ids: Optional[List[int]] = None) -> Dict[str, Any]:
         """Generate response using the appropriate model type with config defaults"""
         if not self.is_loaded:
             self.load_model()
         
-        # Get runtime defaults from config
+        temperature, top_p, frequency_penalty, presence_penalty, stop = self._resolve_sampling(
+            temperature, top_p, frequency_penalty, presence_penalty, stop)
+        
+        start_time = time.time()
+        
+        if self.model_type == "gguf":
+            response, completion_tokens = self._generate_gguf(prompt, max_tokens, temperature, top_p, frequency_penalty, presence_penalty, stop)
+        else:
+            response, completion_tokens = self._generate_pytorch(prompt, max_tokens, temperature, top_p, frequency_penalty, presence_penalty, stop, input_ids)
+        
+        return self._response_payload(response, completion_tokens, start_time, max_tokens,
+                                      temperature, top_p, frequency_penalty, presence_penalty, stop)
+    
+    def _resolve_sampling(self, temperature: float, top_p: float, frequency_penalty: float,
+                          presence_penalty: float, stop: List[str]) -> tuple:
+        """Fill unset sampling parameters from the runtime defaults in config"""
         runtime_defaults = getattr(self, 'model_config', {}).get("runtime_defaults", {})
         if temperature is None:
             temperature = runtime_defaults.get("temperature", 0.7)
@@ -537,21 +1064,20 @@ Available tools: """
             presence_penalty = runtime_defaults.get("presence_penalty", 0.0)
         if stop is None:
             stop = runtime_defaults.get("stop_sequences", ["User:", "System:"])
-        
-        start_time = time.time()
-        
-        if self.model_type == "gguf":
-            response = self._generate_gguf(prompt, max_tokens, temperature, top_p, frequency_penalty, presence_penalty, stop)
-        else:
-            response = self._generate_pytorch(prompt, max_tokens, temperature, top_p, frequency_penalty, presence_penalty, stop)
-        
+        return temperature, top_p, frequency_penalty, presence_penalty, stop
+    
+    def _response_payload(self, response: str, completion_tokens: int, start_time: float, max_tokens: int,
+                          temperature: float, top_p: float, frequency_penalty: float,
+                          presence_penalty: float, stop: List[str]) -> Dict[str, Any]:
+        """generate_response result dict"""
         generation_time = time.time() - start_time
         
         return {
             "response": response,
             "generation_time": generation_time,
             "model_type": self.model_type,
-            "tokens_per_second": len(response.split()) / generation_time if generation_time > 0 else 0,
+            "completion_tokens": completion_tokens,
+            "tokens_per_second": completion_tokens / generation_time if generation_time > 0 else 0,
             "config_used": {
                 "temperature": temperature,
                 "top_p": top_p,
@@ -563,8 +1089,8 @@ Available tools: """
         }
     
     def _generate_gguf(self, prompt: str, max_tokens: int, temperature: float, top_p: float,
-                       frequency_penalty: float = 0.0, presence_penalty: float = 0.0, stop: List[str] = None) -> str:
-        """Generate using GGUF model with enhanced parameters"""
+                       frequency_penalty: float = 0.0, presence_penalty: float = 0.0, stop: List[str] = None) -> Tuple[str, int]:
+        """Generate using GGUF model with enhanced parameters; returns (text, completion_tokens)"""
         try:
             if stop is None:
                 stop = ["User:", "System:"]
@@ -580,21 +1106,34 @@ Available tools: """
                 stop=stop,
             )
             
-            return output['choices'][0]['text'].strip()
+            return output['choices'][0]['text'].strip(), output.get('usage', {}).get('completion_tokens', 0)
             
         except Exception as e:
             print(f"❌ GGUF generation error: {e}")
-            return f"I apologize, but I encountered an error while generating a response. Please try again."
+            return f"I apologize, but I encountered an error while generating a response. Please try again.", 0
+    
+    def _encode_prompt(self, prompt: str) -> Dict[str, Any]:
+        """Tokenize a prompt for the PyTorch model, reusing the cached static prefix ids"""
+        if self._prefix_ids is None or not prompt.startswith(_STATIC_PROMPT_PREFIX):
+            return self.tokenizer(prompt, return_tensors="pt", truncation=True,
+                                  max_length=self._max_prompt_tokens, padding=False).to(self._device)
+        
+        tail = self.tokenizer(prompt[len(_STATIC_PROMPT_PREFIX):], add_special_tokens=False,
+                              return_tensors="pt", padding=False)["input_ids"].to(self._device)
+        ids = torch.cat([self._prefix_ids, tail], dim=-1)[:, :self._max_prompt_tokens]
+        return {"input_ids": ids, "attention_mask": torch.ones_like(ids)}
     
     def _generate_pytorch(self, prompt: str, max_tokens: int, temperature: float, top_p: float,
-                         frequency_penalty: float = 0.0, presence_penalty: float = 0.0, stop: List[str] = None) -> str:
-        """Generate using PyTorch model with enhanced parameters"""
+                         frequency_penalty: float = 0.0, presence_penalty: float = 0.0, stop: List[str] = None,
+                         input_ids: Optional[List[int]] = None) -> Tuple[str, int]:
+        """Generate using PyTorch model with enhanced parameters; returns (text, completion_tokens)"""
         try:
-            inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True, max_length=1024)
-            
-            # Move to appropriate device
-            if hasattr(self.model, 'device'):
-                inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+            if input_ids is not None:
+                # Already tokenized by the batch tokenizer
+                ids = torch.tensor([input_ids], device=self._device)
+                inputs = {"input_ids": ids, "attention_mask": torch.ones_like(ids)}
+            else:
+                inputs = self._encode_prompt(prompt)
             
             # Prepare generation kwargs
             generation_kwargs = {
@@ -610,34 +1149,73 @@ Available tools: """
             if hasattr(self.model, 'config') and hasattr(self.model.config, 'use_cache'):
                 generation_kwargs["use_cache"] = True
             
-            # Note: frequency_penalty and presence_penalty are not directly supported in transformers
-            # but can be implemented via repetition_penalty or custom logic if needed
+            prompt_len = inputs['input_ids'].shape[-1]
+            generation_kwargs.update(_penalty_kwargs(prompt_len, frequency_penalty, presence_penalty))
             
-            with torch.no_grad():
+            with torch.inference_mode():
                 outputs = self.model.generate(**inputs, **generation_kwargs)
             
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            response = response[len(prompt):].strip()
+            completion_tokens = outputs.shape[-1] - prompt_len
+            
+            # Decode only the generated tokens
+            response = self.tokenizer.decode(outputs[0, prompt_len:], skip_special_tokens=True).strip()
             
             # Apply stop sequences if provided
-            if stop:
-                for stop_seq in stop:
-                    if stop_seq in response:
-                        response = response.split(stop_seq)[0].strip()
+            response = _truncate_at_stop(response, stop)
             
-            return response
+            return response, completion_tokens
             
         except Exception as e:
             print(f"❌ PyTorch generation error: {e}")
-            return f"I apologize, but I encountered an error while generating a response. Please try again."
+            return f"I apologize, but I encountered an error while generating a response. Please try again.", 0
+    
+    def _generate_pytorch_batch(self, requests: List[Tuple[str, int, List[str]]], temperature: float, top_p: float,
+                                frequency_penalty: float = 0.0, presence_penalty: float = 0.0) -> List[Tuple[str, int]]:
+        """Generate (prompt, max_tokens, stop) requests in one left-padded batch; returns (text, completion_tokens) each"""
+        try:
+            encoded = [self._encode_prompt(prompt)["input_ids"][0] for prompt, _, _ in requests]
+            prompt_len = max(ids.shape[-1] for ids in encoded)
+            input_ids = torch.full((len(encoded), prompt_len), self.tokenizer.pad_token_id,
+                                   dtype=encoded[0].dtype, device=self._device)
+            attention_mask = torch.zeros_like(input_ids)
+            for row, ids in enumerate(encoded):
+                input_ids[row, prompt_len - ids.shape[-1]:] = ids
+                attention_mask[row, prompt_len - ids.shape[-1]:] = 1
+            
+            generation_kwargs = {
+                "max_new_tokens": max(max_tokens for _, max_tokens, _ in requests),
+                "temperature": temperature,
+                "top_p": top_p,
+                "do_sample": True,
+                "pad_token_id": self.tokenizer.eos_token_id,
+                "eos_token_id": self.tokenizer.eos_token_id,
+                "use_cache": True,
+            }
+            generation_kwargs.update(_penalty_kwargs(prompt_len, frequency_penalty, presence_penalty))
+            
+            with torch.inference_mode():
+                outputs = self.model.generate(input_ids=input_ids, attention_mask=attention_mask, **generation_kwargs)
+            
+            results = []
+            for row, (_, max_tokens, stop) in enumerate(requests):
+                # Finished rows are padded with EOS; trim each row to its own token budget
+                generated = outputs[row, prompt_len:prompt_len + max_tokens]
+                completion_tokens = int((generated != self.tokenizer.eos_token_id).sum())
+                response = self.tokenizer.decode(generated, skip_special_tokens=True).strip()
+                results.append((_truncate_at_stop(response, stop), completion_tokens))
+            return results
+            
+        except Exception as e:
+            print(f"❌ PyTorch batch generation error: {e}")
+            error = "I apologize, but I encountered an error while generating a response. Please try again."
+            return [(error, 0)] * len(requests)
     
     async def generate_stream(self, prompt: str, max_tokens: int = 100, temperature: float = None,
                              top_p: float = None, repetition_penalty: float = None,
                              frequency_penalty: float = None, presence_penalty: float = None,
                              stop: List[str] = None) -> AsyncGenerator[str, None]:
         """Generate text with streaming, supporting both GGUF and PyTorch models with config defaults"""
-        if not self.is_loaded:
-            self.load_model()
+        await self.ensure_loaded()
         
         # Get runtime defaults from config
         runtime_defaults = getattr(self, 'model_config', {}).get("runtime_defaults", {})
@@ -655,161 +1233,204 @@ Available tools: """
             stop = runtime_defaults.get("stop_sequences", ["User:", "System:"])
         
         try:
-            if self.model_type == "gguf":
-                # GGUF model generation using llama-cpp-python
-                print(f"🔧 GGUF streaming generation: max_tokens={max_tokens}")
-                
-                # Generate with streaming
-                response = self.model(
-                    prompt,
-                    max_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=top_p,
-                    frequency_penalty=frequency_penalty,
-                    presence_penalty=presence_penalty,
-                    repeat_penalty=repetition_penalty,
-                    stream=True,
-                    echo=False,
-                    stop=stop
-                )
-                
-                for chunk in response:
-                    if 'choices' in chunk and len(chunk['choices']) > 0:
-                        choice = chunk['choices'][0]
-                        if 'text' in choice and choice['text']:
-                            await asyncio.sleep(0)  # Allow other tasks to run
-                            yield choice['text']
-                            
-            else:
-                # PyTorch model generation (simplified streaming)
-                print(f"🔧 PyTorch streaming generation: max_tokens={max_tokens}")
-                
-                # For PyTorch, we'll simulate streaming by generating in chunks
-                inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True, max_length=1024)
-                
-                if hasattr(self.model, 'device'):
-                    inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
-                
-                # Generate full response first (PyTorch doesn't have native streaming)
-                with torch.no_grad():
-                    outputs = self.model.generate(
-                        **inputs,
-                        max_new_tokens=max_tokens,
-                        temperature=temperature,
-                        top_p=top_p,
-                        do_sample=True,
-                        pad_token_id=self.tokenizer.eos_token_id,
-                        eos_token_id=self.tokenizer.eos_token_id,
-                    )
-                
-                response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-                response = response[len(prompt):].strip()
-                
-                # Stream the response word by word
-                words = response.split()
-                for i, word in enumerate(words):
-                    if i == 0:
-                        yield word
-                    else:
-                        yield f" {word}"
-                    await asyncio.sleep(0.05)  # Small delay for streaming effect
-                            
+            async for text in self.iterate_in_pool(
+                lambda: self._iter_stream(prompt, max_tokens, temperature, top_p, repetition_penalty,
+                                          frequency_penalty, presence_penalty, stop)
+            ):
+                yield text
         except Exception as e:
             print(f"❌ Streaming generation error: {e}")
             yield f"Error during streaming generation: {str(e)}"
     
+    async def iterate_in_pool(self, make_iter):
+        """Drive a blocking iterator on the inference pool, yielding its items on the event loop"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+        done = object()
+        
+        def produce():
+            items = None
+            try:
+                items = make_iter()
+                for item in items:
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                # Close generators here so their cleanup runs before the inference slot is released
+                if hasattr(items, "close"):
+                    items.close()
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+        
+        async with self._infer_slots:
+            future = loop.run_in_executor(self._infer_pool, produce)
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is done:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                cancelled.set()
+                await future
+    
+    def _iter_stream(self, prompt: str, max_tokens: int, temperature: float, top_p: float,
+                     repetition_penalty: float, frequency_penalty: float, presence_penalty: float,
+                     stop: List[str]):
+        """Blocking text generator run on the inference pool"""
+        if self.model_type == "gguf":
+            # GGUF model generation using llama-cpp-python
+            print(f"🔧 GGUF streaming generation: max_tokens={max_tokens}")
+            
+            # Generate with streaming
+            response = self.model(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                frequency_penalty=frequency_penalty,
+                presence_penalty=presence_penalty,
+                repeat_penalty=repetition_penalty,
+                stream=True,
+                echo=False,
+                stop=stop
+            )
+            
+            for chunk in response:
+                if 'choices' in chunk and len(chunk['choices']) > 0:
+                    choice = chunk['choices'][0]
+                    if 'text' in choice and choice['text']:
+                        yield choice['text']
+        else:
+            # PyTorch model generation, streamed token by token from a generate() thread
+            print(f"🔧 PyTorch streaming generation: max_tokens={max_tokens}")
+            
+            inputs = self._encode_prompt(prompt)
+            prompt_len = inputs['input_ids'].shape[-1]
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            finished = threading.Event()
+            errors = []
+            
+            def run_generate():
+                try:
+                    with torch.inference_mode():
+                        self.model.generate(
+                            **inputs,
+                            max_new_tokens=max_tokens,
+                            temperature=temperature,
+                            top_p=top_p,
+                            do_sample=True,
+                            pad_token_id=self.tokenizer.eos_token_id,
+                            eos_token_id=self.tokenizer.eos_token_id,
+                            streamer=streamer,
+                            stopping_criteria=StoppingCriteriaList([StopOnEvent(finished)]),
+                            **_penalty_kwargs(prompt_len, frequency_penalty, presence_penalty),
+                        )
+                except Exception as e:
+                    errors.append(e)
+                    streamer.end()  # Unblock the consumer
+            
+            # generate() shares the model and its static cache, so it must finish before the worker is reused
+            generate_thread = threading.Thread(target=run_generate, name="llama-generate", daemon=True)
+            generate_thread.start()
+            try:
+                yield from _stream_until_stop(streamer, stop)
+            finally:
+                finished.set()
+                generate_thread.join()
+            if errors:
+                raise errors[0]
+    
     # Note: Function detection is now handled by the enhanced function_detector
     # from function_validation module for better security and validation
     
     def execute_function_calls(self, tool_calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Execute function calls with enhanced error handling and validation"""
-        results = []
-        
         # Check if function tools are available
         if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
             return [{
                 "tool_call_id": "error",
                 "role": "tool",
                 "name": "error",
-                "content": json.dumps({
+                "content": _json_dumps({
                     "error": "Function tools not available",
                     "success": False
                 })
             }]
         
-        for tool_call in tool_calls:
-            if tool_call.get("type") == "function":
-                function_name = tool_call["function"]["name"]
-                tool_call_id = tool_call.get("id", f"call_{int(time.time())}")
+        # Results are written by index into a list sized up front
+        function_calls = [tool_call for tool_call in tool_calls if tool_call.get("type") == "function"]
+        results = [None] * len(function_calls)
+        now = int(time.time())
+        
+        for i, tool_call in enumerate(function_calls):
+            function_name = tool_call["function"]["name"]
+            tool_call_id = tool_call.get("id") or f"call_{now}"
+            
+            try:
+                # Parse arguments
+                arguments = _json_loads(tool_call["function"]["arguments"])
                 
-                try:
-                    # Parse arguments
-                    arguments = json.loads(tool_call["function"]["arguments"])
+                # Additional validation before execution (if available)
+                if FUNCTION_VALIDATION_AVAILABLE and function_validator:
+                    validation = function_validator.validate_function_arguments(function_name, arguments)
                     
-                    # Additional validation before execution (if available)
-                    if FUNCTION_VALIDATION_AVAILABLE and function_validator:
-                        validation = function_validator.validate_function_arguments(function_name, arguments)
-                        
-                        if not validation.is_valid:
-                            results.append({
-                                "tool_call_id": tool_call_id,
-                                "role": "tool",
-                                "name": function_name,
-                                "content": json.dumps({
-                                    "error": f"Validation failed: {validation.error_message}",
-                                    "success": False
-                                })
+                    if not validation.is_valid:
+                        results[i] = {
+                            "tool_call_id": tool_call_id,
+                            "role": "tool",
+                            "name": function_name,
+                            "content": _json_dumps({
+                                "error": f"Validation failed: {validation.error_message}",
+                                "success": False
                             })
-                            continue
-                        
-                        # Execute function with validated arguments
-                        result = function_tools.execute_function(function_name, validation.sanitized_args)
-                    else:
-                        # Execute function without validation
-                        result = function_tools.execute_function(function_name, arguments)
-                    
-                    results.append({
-                        "tool_call_id": tool_call_id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": json.dumps(result)
-                    })
+                        }
+                        continue
                     
-                except json.JSONDecodeError as e:
-                    results.append({
-                        "tool_call_id": tool_call_id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": json.dumps({
-                            "error": f"Invalid JSON arguments: {str(e)}",
-                            "success": False
-                        })
+                    # Execute function with validated arguments
+                    result = function_tools.execute_function(function_name, validation.sanitized_args)
+                else:
+                    # Execute function without validation
+                    result = function_tools.execute_function(function_name, arguments)
+                
+                results[i] = {
+                    "tool_call_id": tool_call_id,
+                    "role": "tool",
+                    "name": function_name,
+                    "content": _json_dumps(result)
+                }
+                
+            except json.JSONDecodeError as e:
+                results[i] = {
+                    "tool_call_id": tool_call_id,
+                    "role": "tool",
+                    "name": function_name,
+                    "content": _json_dumps({
+                        "error": f"Invalid JSON arguments: {str(e)}",
+                        "success": False
                     })
-                except Exception as e:
-                    results.append({
-                        "tool_call_id": tool_call_id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": json.dumps({
-                            "error": f"Execution error: {str(e)}",
-                            "success": False
-                        })
+                }
+            except Exception as e:
+                results[i] = {
+                    "tool_call_id": tool_call_id,
+                    "role": "tool",
+                    "name": function_name,
+                    "content": _json_dumps({
+                        "error": f"Execution error: {str(e)}",
+                        "success": False
                     })
+                }
         
         return results
     
     def get_memory_info(self) -> Dict[str, Any]:
         """Get current memory usage"""
-        memory = psutil.virtual_memory()
-        
-        # Get model file size
-        model_size = "Unknown"
-        if self.model_path and self.model_path.exists():
-            if self.model_path.is_file():
-                model_size = f"{self.model_path.stat().st_size / (1024**3):.1f}GB"
-            else:
-                total_size = sum(f.stat().st_size for f in self.model_path.rglob('*') if f.is_file())
-                model_size = f"{total_size / (1024**3):.1f}GB"
+        memory = _virtual_memory()
         
         return {
             "total_gb": memory.total / (1024**3),
@@ -817,7 +1438,7 @@ Available tools: """
             "used_gb": memory.used / (1024**3),
             "percent_used": memory.percent,
             "model_type": self.model_type,
-            "model_size": model_size,
+            "model_size": self.model_size,
             "model_path": str(self.model_path) if self.model_path else None
         }
 
@@ -828,23 +1449,43 @@ start_time = time.time()
 def init_model():
     global model_manager
     model_manager = OptimizedModelManager()
-    model_manager.load_model()
+
+async def _load_model_in_background():
+    try:
+        await model_manager.ensure_loaded()
+    except Exception as e:
+        print(f"❌ Failed to load model: {e}")
 
 # FastAPI app with lifespan management
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("🚀 Starting Optimized GGUF FastAPI server...")
     init_model()
+    # Bound the default executor used for blocking tool calls (web search, databases)
+    loop = asyncio.get_running_loop()
+    tool_pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=model_manager.config.get("max_concurrent_requests", 8), thread_name_prefix="tools")
+    loop.set_default_executor(tool_pool)
+    # Load in the background so health checks are served during cold start
+    load_task = asyncio.create_task(_load_model_in_background())
     yield
     print("🛑 Shutting down server...")
-
+    load_task.cancel()
+    if model_manager and model_manager.batch_tokenizer:
+        await model_manager.batch_tokenizer.stop()
+    if model_manager and model_manager.generation_batcher:
+        await model_manager.generation_batcher.stop()
+    tool_pool.shutdown(wait=False)
+
+ResponseClass = ORJSONResponse if ORJSON_AVAILABLE else JSONResponse
 app = FastAPI(
     title="Optimized GGUF Llama Server",
     description="High-performance server supporting both GGUF and PyTorch models",
     version="3.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ResponseClass
 )
 
 app.add_middleware(
@@ -858,9 +1499,14 @@ app.add_middleware(
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@functools.cache
+def _index_html() -> bytes:
+    """UI page, read from disk once per process"""
+    return Path("static/index.html").read_bytes()
+
 @app.get("/")
 async def root():
-    return HTMLResponse(content=open("static/index.html", "r").read())
+    return HTMLResponse(content=_index_html())
 
 @app.get("/health", response_model=HealthResponse)
 async def health():
@@ -881,53 +1527,295 @@ async def health():
 async def update_location(request: Request):
     """Update location from browser geolocation"""
     if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
-        return {"success": False, "error": "Function tools not available"}
+        raise HTTPException(status_code=503, detail="Function tools not available")
     
     try:
         data = await request.json()
-        lat = data.get("lat")
-        lon = data.get("lon")
-        accuracy = data.get("accuracy")
-        
-        if lat and lon:
-            # Update the function tools location cache
-            updated_location = function_tools.update_location_from_browser(lat, lon, accuracy)
-            return {"success": True, "location": updated_location}
-        else:
-            return {"success": False, "error": "Missing coordinates"}
-            
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Expected a JSON object")
+    
+    lat = data.get("lat")
+    lon = data.get("lon")
+    accuracy = data.get("accuracy")
+    if not lat or not lon:
+        raise HTTPException(status_code=400, detail="Missing coordinates")
+    
+    try:
+        # Update the function tools location cache
+        updated_location = function_tools.update_location_from_browser(lat, lon, accuracy)
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"success": True, "location": updated_location}
 
 @app.get("/api/location/request")
 async def request_location():
     """Request location permission from user"""
     if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
-        return {"success": False, "error": "Function tools not available"}
+        raise HTTPException(status_code=503, detail="Function tools not available")
     return function_tools.request_precise_location()
 
 @app.get("/api/location/script")
 async def get_location_script():
     """Get JavaScript for browser location detection"""
+    if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
+        raise HTTPException(status_code=503, detail="Function tools not available")
     return {"script": function_tools.get_browser_location_script()}
 
+@functools.lru_cache(maxsize=512)
+def _render_transcript(turns: Tuple[Tuple[str, str], ...]) -> str:
+    """Earlier turns as a "User:"/"You:" transcript"""
+    if not turns:
+        return "No previous messages"
+    return "\n".join(f"{'You' if role == 'assistant' else 'User'}: {content}" for role, content in turns)
+
+def _previous_context(messages: List[ChatMessage]) -> str:
+    """Transcript of every message except the last; identical histories (retries, regenerations) hit the cache"""
+    return _render_transcript(tuple((msg.role, msg.content) for msg in messages[:-1]))
+
+# Tool-detection and parameter-extraction patterns, compiled once at import
+# Phrasings announcing a tool call; _TOOL_NAME marks where the tool name is captured
+_TOOL_NAME = r"([a-zA-Z_]+)"
+TOOL_PATTERNS = [
+    r"(?:using|use|with|through|via|call|calling|execute|executing|running|apply|applying)\s+(?:the\s+)?([a-zA-Z_]+)\s+(?:tool|function)",
+    r"I(?:'ll|\s+will)\s+(?:use|call|execute|run|apply)\s+(?:the\s+)?([a-zA-Z_]+)",
+    r"([a-zA-Z_]+)\s+(?:tool|function)\s+(?:returns|returned|gives|gave|shows|showed|provides|provided)",
+    r"I'll use the ([a-zA-Z_]+) tool",
+    r"Let me use the ([a-zA-Z_]+) tool",
+    r"I need to use the ([a-zA-Z_]+)",
+    r"I should use the ([a-zA-Z_]+)",
+    r"Using ([a-zA-Z_]+) to",
+    r"Based on (?:your|these) symptoms, I'll use the ([a-zA-Z_]+)",
+    r"To provide a diagnosis, I'll use the ([a-zA-Z_]+)",
+    r"For medical diagnosis, I'll use the ([a-zA-Z_]+)",
+    r"Let me diagnose this using the ([a-zA-Z_]+)"
+]
+
+@functools.lru_cache(maxsize=64)
+def _tool_call_re(tool_names: frozenset) -> "re.Pattern":
+    """TOOL_PATTERNS fused into one alternation whose captures only accept the given tool names"""
+    names = "|".join(map(re.escape, sorted(tool_names, key=len, reverse=True)))
+    return re.compile("|".join(p.replace(_TOOL_NAME, rf"\b({names})\b") for p in TOOL_PATTERNS), re.IGNORECASE)
+
+# Intent phrasings used to tell general or follow-up messages from medical queries
+FORMATTING_PATTERNS = [
+    r"(?:please|can you|could you)?\s*(?:clean|fix|improve|change|update|format|reformat|restructure|organize|present|display|show)\s+(?:the|this|that|your)?\s*(?:format|formatting|response|answer|result|output|text|content|information|presentation)",
+    r"(?:make|render|display)\s+(?:this|that|it|the response|the answer|the result|the output)\s+(?:more|better|clearer|cleaner|nicer|prettier|easier to read|more readable|more presentable)",
+    r"(?:no|without)\s+(?:queries|query)",
+    r"(?:better|cleaner|nicer|prettier|more readable|more presentable)\s+(?:format|formatting|presentation|display|layout)"
+]
+GENERAL_REQUEST_PATTERNS = [
+    r"(?:thank|thanks|thank you)",
+    r"(?:good|great|excellent|amazing|wonderful|fantastic)",
+    r"(?:hi|hello|hey)",
+    r"(?:bye|goodbye|see you)",
+    r"(?:who are you|what can you do|what are your capabilities|tell me about yourself)",
+    r"(?:help|assist|support)",
+    r"(?:stop|quit|exit|cancel)",
+    r"(?:repeat|say again|tell me again)",
+    r"(?:summarize|summary|summarization)",
+    r"(?:explain|explanation|clarify|clarification)",
+    r"(?:continue|go on|proceed|next)",
+    r"(?:previous|back|before)",
+    r"(?:correct|right|incorrect|wrong)",
+    r"(?:yes|no|maybe)",
+    r"(?:understood|got it|i see|i understand)"
+]
+FOLLOWUP_TERMS = ["what about", "how about", "what if", "verses", "versus", "compared to",
+                  "difference between", "in contrast", "this", "that", "also", "and", "but",
+                  "what does", "how does", "why does"]
+
+# Whole-word keywords marking a short message as non-medical
+NON_MEDICAL_KEYWORDS = frozenset([
+    "format", "formatting", "present", "presentation", "display", "layout",
+    "structure", "organize", "clean", "clear", "readable", "thank", "thanks",
+    "hello", "hi", "hey", "goodbye", "bye", "help", "assist"
+])
+
+# All three categories in one scan: each is a zero-width lookahead named after its category,
+# so finditer visits every position and reports each category present. Where two start on the
+# same text the earlier one is reported; formatting and general both decide the request on
+# their own, so a non-medical keyword hidden behind them never changes the outcome
+INTENT_RE = re.compile("|".join([
+    "(?=(?P<formatting>" + "|".join(FORMATTING_PATTERNS) + "))",
+    "(?=(?P<general>" + "|".join(GENERAL_REQUEST_PATTERNS) + "))",
+    "(?=(?P<nonmedical>(?<![a-z])(?:" + "|".join(sorted(NON_MEDICAL_KEYWORDS)) + ")(?![a-z])))",
+]), re.IGNORECASE)
+
+# Follow-up check on its own stops at the first hit instead of scanning for every category
+FOLLOWUP_RE = re.compile("|".join(map(re.escape, FOLLOWUP_TERMS)), re.IGNORECASE)
+
+@functools.lru_cache(maxsize=256)
+def _intents(text: str) -> frozenset:
+    """Intent categories ("formatting", "general", "nonmedical") found in text"""
+    found = set()
+    for match in INTENT_RE.finditer(text):
+        found.add(match.lastgroup)
+        if len(found) == 3:
+            break
+    return frozenset(found)
+
+@functools.lru_cache(maxsize=256)
+def _is_general_request(text: str) -> bool:
+    """Formatting request, or a short (< 5 words) general or non-medical message, rather than a medical query"""
+    intents = _intents(text)
+    return "formatting" in intents or (len(text.split()) < 5 and not intents.isdisjoint(("general", "nonmedical")))
+
+# Whole-word keywords, checked by set lookup against the message's words
+WORD_RE = re.compile(r"[a-z]+")
+USER_TYPE_KEYWORDS = (
+    ("doctor", frozenset(["doctor", "doctors", "physician", "physicians"])),
+    ("nurse", frozenset(["nurse", "nurses"])),
+    ("researcher", frozenset(["researcher", "researchers", "study", "studies"])),
+)
+
+def _message_words(text: str) -> frozenset:
+    """Lowercase words of a message"""
+    return frozenset(WORD_RE.findall(text.lower()))
+
+PARAM_RE = re.compile(r"(?:parameters|arguments|inputs|with)(?:\s+are|\s+is|\s*:\s*|\s+being|\s+as)?\s+(?:\{(.*?)\}|\"(.*?)\")", re.IGNORECASE | re.DOTALL)
+KV_RE = re.compile(r"(?:\"|\')?([\w_]+)(?:\"|\')?(?:\s*:\s*|\s*=\s*)(?:\"|\')?([\w\s\._-]+)(?:\"|\')?(?:,|$)")
+MEDICAL_CONDITION_RE = re.compile(r'(?:about|regarding|concerning|on|for)\s+([a-zA-Z0-9\s\-]+(?:disease|syndrome|condition|disorder|infection|virus|bacteria|symptoms|diagnosis|treatment|diabetes|cancer|heart|asthma))', re.IGNORECASE)
+MEDICAL_TERM_RE = re.compile(r'(?:about|regarding|concerning|on|for)\s+([a-zA-Z0-9\s\-]+(?:disease|syndrome|condition|disorder|infection|virus|bacteria|symptoms|diagnosis|treatment))', re.IGNORECASE)
+# medical_diagnosis fields in one scan; zero-width alternatives let overlapping mentions all match
+DIAGNOSIS_RE = re.compile("|".join(f"(?={pattern})" for pattern in [
+    r"(?:I have|I've been having|I've got|I am having|I'm having|experiencing|suffering from)\s+(?P<symptoms0>[^\.]+)",
+    r"(?:symptoms|problems|issues)(?:\s+are|\s+include|\s*:\s*)?\s+(?P<symptoms1>[^\.]+)",
+    r"(?:complaining of|troubled by)\s+(?P<symptoms2>[^\.]+)",
+    r"(?:I am|I'm|patient is)\s+(?P<age>\d+)",
+    r"(?P<male>\b(?:I am|I'm|patient is)\s+(?:a\s+)?(?:male|man|boy)\b)",
+    r"(?P<female>\b(?:I am|I'm|patient is)\s+(?:a\s+)?(?:female|woman|girl)\b)",
+    r"(?:medical history|history of|previously diagnosed with|past conditions?)\s+(?:includes?|is|of)?\s+(?P<history>[^\.]+)"
+]), re.IGNORECASE)
+CALC_RE = re.compile(r"calculate\s+([\d\s\+\-\*\/\(\)\^\.\%]+)", re.IGNORECASE)
+DATABASES_USED_RE = re.compile(r"Databases used in this search: ([\w\-,\s]+)")
+DATABASES_USED_LINE_RE = re.compile(r"\n\nDatabases used in this search: [\w\-,\s]+")
+
+TOOL_ENHANCE_INSTRUCTIONS = """
+
+Use this result to give a comprehensive, well-structured and user-friendly answer.
+Add any relevant medical context or explanations that would be helpful, with clear headings and bullet points where appropriate.
+DO NOT include disclaimers or warnings about consulting healthcare professionals.
+Do not mention that you are using a tool result."""
+
+def _integration_prompt(question: str, previous_context: str, tool_name: str, tool_result: str,
+                        is_followup: bool = False, enhance: bool = False) -> str:
+    """Prompt answering the user's question from a text tool result; enhance adds TOOL_ENHANCE_INSTRUCTIONS"""
+    return f"""You are answering the user's question: "{question}"
+
+Previous conversation:
+{previous_context}
+
+The tool {tool_name} returned this information: 
+{tool_result}
+
+{"This appears to be a follow-up question to the previous conversation. Make sure to connect your answer to the previous context." if is_followup else ""}
+
+Based on this information and the conversation history, provide a direct, comprehensive answer to the user's question.
+DO NOT include disclaimers or warnings about consulting healthcare professionals.
+DO NOT mention that you used a tool or reference the tool result. Simply provide the answer as if you knew it directly.
+Be concise, clear, and helpful.{TOOL_ENHANCE_INSTRUCTIONS if enhance else ""}
+
+Answer:"""
+
+_SSE_DONE = b"data: [DONE]\n\n"
+# Keep reverse proxies (nginx) from buffering the event stream
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _chat_deltas(chunks):
+    """Content strings from llama.cpp chat completion chunks"""
+    for chunk in chunks:
+        content = chunk["choices"][0]["delta"].get("content")
+        if content:
+            yield content
+
+def _wc(text: str) -> int:
+    """Word estimate for usage counts when the backend didn't report a token count"""
+    return len(text.split()) if text else 0
+
+def _chat_completion_response(model_name: str, content: str, prompt_tokens: int, completion_tokens: int,
+                              tool_call: Dict[str, Any] = None, created: int = None):
+    """OpenAI chat.completion body rendered straight to JSON, skipping FastAPI's jsonable_encoder copy"""
+    created = created or int(time.time())
+    message = {"role": "assistant", "content": content}
+    if tool_call:
+        message["tool_calls"] = [tool_call]
+    return ResponseClass({
+        "id": f"chatcmpl-{created}",
+        "object": "chat.completion",
+        "created": created,
+        "model": model_name,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if tool_call else "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    })
+
+async def _sse_frames(model_name: str, texts: AsyncGenerator[str, None], first_delta: Dict[str, Any] = None,
+                      finish_reason: str = "stop", created: int = None):
+    """Frame streamed text as OpenAI chunk events, encoding only the delta per token"""
+    created = created or int(time.time())
+    frame_prefix = (b'data: {"id":"chatcmpl-%d","object":"chat.completion.chunk","created":%d,"model":'
+                    % (created, created)) + _json_dumps_bytes(model_name) + b',"choices":[{"index":0,"delta":'
+    if first_delta:
+        yield frame_prefix + _json_dumps_bytes(first_delta) + b',"finish_reason":null}]}\n\n'
+    
+    try:
+        async for text in texts:
+            yield frame_prefix + b'{"content":' + _json_dumps_bytes(text) + b'},"finish_reason":null}]}\n\n'
+    except Exception as e:
+        print(f"❌ Streaming chat completion error: {e}")
+    yield frame_prefix + b'{},"finish_reason":' + _json_dumps_bytes(finish_reason) + b'}]}\n\n'
+    yield _SSE_DONE
+
+async def _sse_chat_stream(request: ChatCompletionRequest):
+    """Stream a plain chat completion as SSE frames"""
+    await model_manager.ensure_loaded()
+    messages = [msg.model_dump(exclude_none=True) for msg in request.messages]
+    
+    model = get_model_interface()
+    if model is not None:
+        texts = model_manager.iterate_in_pool(lambda: _chat_deltas(create_chat_completion(
+            messages, model,
+            temperature=request.temperature,
+            top_p=request.top_p,
+            max_tokens=request.max_tokens,
+            stream=True,
+            stop=request.stop
+        )))
+    else:
+        texts = model_manager.generate_stream(
+            model_manager.format_chat_prompt(messages),
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            top_p=request.top_p,
+            frequency_penalty=request.frequency_penalty,
+            presence_penalty=request.presence_penalty,
+            stop=request.stop
+        )
+    
+    async for frame in _sse_frames(request.model, texts):
+        yield frame
+
 @app.post("/v1/chat/completions")
 async def create_chat_completion_endpoint(request: ChatCompletionRequest):
     """OpenAI-compatible chat completion endpoint"""
     try:
-        # Get the model
-        model = get_model_interface()
-        
         # Check if tools are provided and handle tool calling
         if request.tools and request.tool_choice != "none":
             # Format prompt for tool usage
-            prompt = model_manager.format_chat_prompt(
-                [msg.dict() for msg in request.messages], 
-                request.tools
-            )
+            # ChatMessage reads like a dict, so the messages go in without a pydantic dump each
+            prompt = model_manager.format_chat_prompt(request.messages, request.tools)
             
             # Generate response with tools context
-            response_data = model_manager.generate_response(
+            response_data = await model_manager.generate_response_async(
                 prompt,
                 max_tokens=request.max_tokens,
                 temperature=request.temperature,
@@ -943,52 +1831,35 @@ async def create_chat_completion_endpoint(request: ChatCompletionRequest):
             tool_calls = []
             
             # Look for tool call patterns in the response
-            import re
-            
-            # Match function call patterns like "Using the calculator tool" or "I'll use the medical_search tool"
-            tool_patterns = [
-                r"(?:using|use|with|through|via|call|calling|execute|executing|running|apply|applying)\s+(?:the\s+)?([a-zA-Z_]+)\s+(?:tool|function)",
-                r"I(?:'ll|\s+will)\s+(?:use|call|execute|run|apply)\s+(?:the\s+)?([a-zA-Z_]+)",
-                r"([a-zA-Z_]+)\s+(?:tool|function)\s+(?:returns|returned|gives|gave|shows|showed|provides|provided)",
-                r"I'll use the ([a-zA-Z_]+) tool",
-                r"Let me use the ([a-zA-Z_]+) tool",
-                r"I need to use the ([a-zA-Z_]+)",
-                r"I should use the ([a-zA-Z_]+)",
-                r"Using ([a-zA-Z_]+) to",
-                r"Based on (?:your|these) symptoms, I'll use the ([a-zA-Z_]+)",
-                r"To provide a diagnosis, I'll use the ([a-zA-Z_]+)",
-                r"For medical diagnosis, I'll use the ([a-zA-Z_]+)",
-                r"Let me diagnose this using the ([a-zA-Z_]+)"
-            ]
-            
+            # One scan; the alternation only captures names of defined tools,
+            # mapped back to their declared spelling
+            tool_map = {tool["function"]["name"].lower(): tool["function"]["name"]
+                        for tool in request.tools if isinstance(tool, dict) and "function" in tool}
             detected_tools = []
-            for pattern in tool_patterns:
-                matches = re.findall(pattern, response_text, re.IGNORECASE)
-                detected_tools.extend(matches)
-            
-            # Filter to only include defined tools
-            available_tool_names = [tool["function"]["name"] for tool in request.tools if isinstance(tool, dict) and "function" in tool]
-            detected_tools = [tool for tool in detected_tools if tool.lower() in [t.lower() for t in available_tool_names]]
+            if tool_map:
+                tool_call_re = _tool_call_re(frozenset(tool_map.values()))
+                detected_tools = [tool_map[match.group(match.lastindex).lower()]
+                                  for match in tool_call_re.finditer(response_text)]
             
             # If tools were detected, execute them
             if detected_tools:
                 print(f"🔧 Detected tool usage: {detected_tools}")
                 
-                # Find the first detected tool that matches an available tool
-                tool_name = None
-                for detected in detected_tools:
-                    for available in available_tool_names:
-                        if detected.lower() == available.lower():
-                            tool_name = available
-                            break
-                    if tool_name:
-                        break
+                # The first detected tool wins
+                tool_name = detected_tools[0]
                 
                 if tool_name:
+                    # Latest and previous user turns and the latest assistant turn, in one pass
+                    last_user = prev_user = last_assistant = None
+                    for msg in request.messages:
+                        if msg.role == "user":
+                            prev_user, last_user = last_user, msg
+                        elif msg.role == "assistant":
+                            last_assistant = msg
+                    
                     # Extract parameters from the response
                     # This is a simplified extraction - in production, you'd want more robust parameter extraction
-                    param_pattern = r"(?:parameters|arguments|inputs|with)(?:\s+are|\s+is|\s*:\s*|\s+being|\s+as)?\s+(?:\{(.*?)\}|\"(.*?)\")"
-                    param_match = re.search(param_pattern, response_text, re.IGNORECASE | re.DOTALL)
+                    param_match = PARAM_RE.search(response_text)
                     
                     parameters = {}
                     if param_match:
@@ -999,68 +1870,19 @@ async def create_chat_completion_endpoint(request: ChatCompletionRequest):
                             parameters = json.loads("{" + param_text + "}")
                         except:
                             # If JSON parsing fails, try to extract key-value pairs
-                            kv_pattern = r"(?:\"|\')?([\w_]+)(?:\"|\')?(?:\s*:\s*|\s*=\s*)(?:\"|\')?([\w\s\._-]+)(?:\"|\')?(?:,|$)"
-                            kv_matches = re.findall(kv_pattern, param_text)
+                            kv_matches = KV_RE.findall(param_text)
                             parameters = {k: v for k, v in kv_matches}
                     
                     # Extract query from user message if parameters are empty
                     if not parameters and tool_name in ["medical_search", "icd11_search", "loinc_search", "umls_search", "pubmed_search", "medical_diagnosis"]:
-                        user_messages = [msg for msg in request.messages if msg.role == "user"]
-                        assistant_messages = [msg for msg in request.messages if msg.role == "assistant"]
-                        
-                        if user_messages:
-                            last_user_message = user_messages[-1].content
-                            
-                            # Check if this is a formatting request rather than a medical query
-                            formatting_patterns = [
-                                r"(?:please|can you|could you)?\s*(?:clean|fix|improve|change|update|format|reformat|restructure|organize|present|display|show)\s+(?:the|this|that|your)?\s*(?:format|formatting|response|answer|result|output|text|content|information|presentation)",
-                                r"(?:make|render|display)\s+(?:this|that|it|the response|the answer|the result|the output)\s+(?:more|better|clearer|cleaner|nicer|prettier|easier to read|more readable|more presentable)",
-                                r"(?:no|without)\s+(?:queries|query)",
-                                r"(?:better|cleaner|nicer|prettier|more readable|more presentable)\s+(?:format|formatting|presentation|display|layout)"
-                            ]
-                            
-                            # Add patterns for other general (non-medical) requests
-                            general_request_patterns = [
-                                r"(?:thank|thanks|thank you)",
-                                r"(?:good|great|excellent|amazing|wonderful|fantastic)",
-                                r"(?:hi|hello|hey)",
-                                r"(?:bye|goodbye|see you)",
-                                r"(?:who are you|what can you do|what are your capabilities|tell me about yourself)",
-                                r"(?:help|assist|support)",
-                                r"(?:stop|quit|exit|cancel)",
-                                r"(?:repeat|say again|tell me again)",
-                                r"(?:summarize|summary|summarization)",
-                                r"(?:explain|explanation|clarify|clarification)",
-                                r"(?:continue|go on|proceed|next)",
-                                r"(?:previous|back|before)",
-                                r"(?:correct|right|incorrect|wrong)",
-                                r"(?:yes|no|maybe)",
-                                r"(?:understood|got it|i see|i understand)",
-                            ]
+                        if last_user:
+                            last_user_message = last_user.content
+                            message_words = _message_words(last_user_message)
                             
-                            is_formatting_request = any(re.search(pattern, last_user_message, re.IGNORECASE) for pattern in formatting_patterns)
-                            is_general_request = any(re.search(pattern, last_user_message, re.IGNORECASE) for pattern in general_request_patterns)
-                            
-                            # Check for specific non-medical keywords
-                            non_medical_keywords = ["format", "formatting", "present", "presentation", "display", "layout", 
-                                                  "structure", "organize", "clean", "clear", "readable", "thank", "thanks",
-                                                  "hello", "hi", "hey", "goodbye", "bye", "help", "assist"]
-                            
-                            contains_non_medical_keywords = any(keyword in last_user_message.lower() for keyword in non_medical_keywords)
-                            
-                            # Check if this is a short message (likely a general request)
-                            is_short_message = len(last_user_message.split()) < 5
-                            
-                            if is_formatting_request or (is_general_request and is_short_message) or (contains_non_medical_keywords and is_short_message):
+                            if _is_general_request(last_user_message):
                                 # This is a general request, not a medical query
                                 # Get previous messages for context
-                                previous_messages = []
-                                for i, msg in enumerate(request.messages):
-                                    if i < len(request.messages) - 1:  # Skip the last user message which we already have
-                                        role = "You" if msg.role == "assistant" else "User"
-                                        previous_messages.append(f"{role}: {msg.content}")
-                                
-                                previous_context = "\n".join(previous_messages) if previous_messages else "No previous messages"
+                                previous_context = _previous_context(request.messages)
                                 
                                 # Create a prompt for the model to handle the general request
                                 general_prompt = f"""The user has made a general request: "{last_user_message}"
@@ -1075,48 +1897,34 @@ If it's a general question, greeting, or other non-medical request, respond appr
 Response:"""
                                 
                                 # Generate response
-                                response_data = model_manager.generate_response(
+                                response_data = await model_manager.generate_response_async(
                                     general_prompt,
                                     max_tokens=500,
                                     temperature=0.3
                                 )
                                 
-                                return {
-                                    "id": f"chatcmpl-{int(time.time())}",
-                                    "object": "chat.completion",
-                                    "created": int(time.time()),
-                                    "model": request.model,
-                                    "choices": [{
-                                        "index": 0,
-                                        "message": {
-                                            "role": "assistant",
-                                            "content": response_data["response"]
-                                        }
-                                    }],
-                                    "usage": {
-                                        "prompt_tokens": len(general_prompt.split()),
-                                        "completion_tokens": len(response_data["response"].split()),
-                                        "total_tokens": len(general_prompt.split()) + len(response_data["response"].split())
-                                    }
-                                }
+                                return _chat_completion_response(
+                                    request.model,
+                                    response_data["response"],
+                                    _wc(general_prompt),
+                                    response_data.get("completion_tokens") or _wc(response_data["response"])
+                                )
                     
                     # Get context from previous messages
                     context = ""
-                    if len(user_messages) > 1 and len(assistant_messages) > 0:
+                    if prev_user and last_assistant:
                         # Get the previous user query and assistant response for context
-                        prev_user_message = user_messages[-2].content if len(user_messages) > 1 else ""
-                        prev_assistant_message = assistant_messages[-1].content if assistant_messages else ""
+                        prev_user_message = prev_user.content
+                        prev_assistant_message = last_assistant.content
                         
                         # Extract medical conditions or topics from previous messages
-                        medical_conditions = re.findall(r'(?:about|regarding|concerning|on|for)\s+([a-zA-Z0-9\s\-]+(?:disease|syndrome|condition|disorder|infection|virus|bacteria|symptoms|diagnosis|treatment|diabetes|cancer|heart|asthma))', 
-                                                      prev_user_message + " " + prev_assistant_message, 
-                                                      re.IGNORECASE)
+                        medical_conditions = MEDICAL_CONDITION_RE.findall(prev_user_message + " " + prev_assistant_message)
                         
                         if medical_conditions:
                             context = f"In the context of {medical_conditions[0].strip()}, "
                     
                     # Try to extract specific medical terms or conditions
-                    medical_terms = re.findall(r'(?:about|regarding|concerning|on|for)\s+([a-zA-Z0-9\s\-]+(?:disease|syndrome|condition|disorder|infection|virus|bacteria|symptoms|diagnosis|treatment))', last_user_message, re.IGNORECASE)
+                    medical_terms = MEDICAL_TERM_RE.findall(last_user_message)
                     
                     if medical_terms:
                         parameters = {"query": medical_terms[0].strip()}
@@ -1125,231 +1933,154 @@ Response:"""
                         parameters = {"query": context + last_user_message}
                         
                     # Add user type if available
-                    if "doctor" in last_user_message.lower() or "physician" in last_user_message.lower():
-                        parameters["user_type"] = "doctor"
-                    elif "nurse" in last_user_message.lower():
-                        parameters["user_type"] = "nurse"
-                    elif "researcher" in last_user_message.lower() or "study" in last_user_message.lower():
-                        parameters["user_type"] = "researcher"
-                    else:
-                        parameters["user_type"] = "patient"
+                    parameters["user_type"] = next((user_type for user_type, keywords in USER_TYPE_KEYWORDS
+                                                    if not keywords.isdisjoint(message_words)), "patient")
                 
                 # Extract symptoms for medical diagnosis
                 if not parameters and tool_name == "medical_diagnosis":
-                    user_messages = [msg for msg in request.messages if msg.role == "user"]
-                    if user_messages:
-                        last_user_message = user_messages[-1].content
+                    if last_user:
+                        last_user_message = last_user.content
                         
-                        # Try to extract symptoms
-                        symptoms_patterns = [
-                            r"(?:I have|I've been having|I've got|I am having|I'm having|experiencing|suffering from)\s+([^\.]+)",
-                            r"(?:symptoms|problems|issues)(?:\s+are|\s+include|\s*:\s*)?\s+([^\.]+)",
-                            r"(?:complaining of|troubled by)\s+([^\.]+)"
-                        ]
+                        # First mention of each field, from a single scan
+                        found = {}
+                        for match in DIAGNOSIS_RE.finditer(last_user_message):
+                            found.setdefault(match.lastgroup, match.group(match.lastgroup))
                         
-                        for pattern in symptoms_patterns:
-                            symptoms_match = re.search(pattern, last_user_message, re.IGNORECASE)
-                            if symptoms_match:
-                                parameters["symptoms"] = symptoms_match.group(1).strip()
-                                break
+                        # Symptom phrasings in priority order; otherwise use the whole message
+                        symptoms = next((found[name] for name in ("symptoms0", "symptoms1", "symptoms2") if name in found), None)
+                        parameters["symptoms"] = symptoms.strip() if symptoms is not None else last_user_message
                         
-                        # If no specific symptoms found, use the whole message
-                        if "symptoms" not in parameters:
-                            parameters["symptoms"] = last_user_message
+                        if "age" in found:
+                            parameters["patient_age"] = int(found["age"])
                         
-                        # Try to extract age
-                        age_match = re.search(r"(?:I am|I'm|patient is)\s+(\d+)(?:\s+years?\s+old)?", last_user_message, re.IGNORECASE)
-                        if age_match:
-                            try:
-                                parameters["patient_age"] = int(age_match.group(1))
-                            except:
-                                pass
-                        
-                        # Try to extract gender
-                        if re.search(r"\b(?:I am|I'm|patient is)\s+(?:a\s+)?(?:male|man|boy)\b", last_user_message, re.IGNORECASE):
+                        if "male" in found:
                             parameters["patient_gender"] = "male"
-                        elif re.search(r"\b(?:I am|I'm|patient is)\s+(?:a\s+)?(?:female|woman|girl)\b", last_user_message, re.IGNORECASE):
+                        elif "female" in found:
                             parameters["patient_gender"] = "female"
                         
-                        # Try to extract medical history
-                        history_match = re.search(r"(?:medical history|history of|previously diagnosed with|past conditions?)\s+(?:includes?|is|of)?\s+([^\.]+)", last_user_message, re.IGNORECASE)
-                        if history_match:
-                            parameters["medical_history"] = history_match.group(1).strip()
+                        if "history" in found:
+                            parameters["medical_history"] = found["history"].strip()
                 
                 # For calculator, try to extract the expression
                 if not parameters and tool_name == "calculator":
-                    calc_pattern = r"calculate\s+([\d\s\+\-\*\/\(\)\^\.\%]+)"
-                    calc_match = re.search(calc_pattern, response_text, re.IGNORECASE)
+                    calc_match = CALC_RE.search(response_text)
                     if calc_match:
                         parameters = {"expression": calc_match.group(1).strip()}
                 
-                # Import function tools manager
-                from function_tools import function_tools
+                if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
+                    raise HTTPException(status_code=503, detail="Function tools not available")
                 
                 # Execute the function
                 print(f"🔧 Executing {tool_name} with parameters: {parameters}")
-                result = function_tools.execute_function(tool_name, parameters)
+                tool_task = asyncio.create_task(
+                    asyncio.to_thread(function_tools.execute_function, tool_name, parameters)
+                )
+                
+                # Prepare the tool-independent prompt pieces while the tool runs
+                previous_context = _previous_context(request.messages)
+                is_followup = last_user is not None and FOLLOWUP_RE.search(last_user.content or "") is not None
+                
+                result = await tool_task
                 
                 # Extract databases used if present in the result
                 databases_used = []
                 if isinstance(result, dict) and isinstance(result.get("result"), str):
                     # Look for the databases used information in the result
-                    db_match = re.search(r"Databases used in this search: ([\w\-,\s]+)", result["result"])
+                    db_match = DATABASES_USED_RE.search(result["result"])
                     if db_match:
                         databases_string = db_match.group(1)
                         databases_used = [db.strip() for db in databases_string.split(',')]
                         
                         # Remove the databases used line from the result
-                        result["result"] = re.sub(r"\n\nDatabases used in this search: [\w\-,\s]+", "", result["result"])
-                
-                # If AI generation is requested and the result is text, enhance it with the AI model
-                # Always use AI enhancement for chat completions
-                if isinstance(result.get("result"), str) and model_manager:
-                    try:
-                        # Create a prompt for the model to enhance the result
-                        prompt = f"""The following is a result from a tool called {tool_name}:
-
-{result.get("result")}
-
-Please enhance this information to make it more comprehensive, well-structured, and user-friendly.
-Add any relevant medical context, explanations, or additional information that would be helpful.
-Format your response with clear headings, bullet points where appropriate, and a logical flow.
-DO NOT include disclaimers or warnings about consulting healthcare professionals.
-IMPORTANT: Respond as if you are directly answering the user's question. Do not mention that you are enhancing a tool result.
-
-Enhanced response:"""
-
-                        # Generate enhanced response
-                        response_data = model_manager.generate_response(
-                            prompt,
-                            max_tokens=500,
-                            temperature=0.3
-                        )
-                        
-                        enhanced_result = response_data["response"].strip()
-                        
-                        # Add the enhanced result to the response
-                        result["enhanced_result"] = enhanced_result
-                        result["ai_enhanced"] = True
-                        
-                        # Replace the original result with the enhanced one for better integration
-                        if "result" in result and isinstance(result["result"], str):
-                            result["original_result"] = result["result"]
-                            result["result"] = enhanced_result
-                    except Exception as e:
-                        print(f"❌ Error enhancing result with AI: {str(e)}")
-                        result["ai_enhanced"] = False
+                        result["result"] = DATABASES_USED_LINE_RE.sub("", result["result"])
                 
                 if result:
+                    # AI enhancement is opt-in and folded into the integration prompt below
+                    # rather than spending a separate prefill+decode on rewording the tool output
+                    result["ai_enhanced"] = bool(request.ai_enhance) and isinstance(result.get("result"), str)
+                    
                     # Create a new system message with the tool result
-                    tool_result_message = f"Tool '{tool_name}' returned: {json.dumps(result)}"
+                    tool_result_message = f"Tool '{tool_name}' returned: {_json_dumps(result)}"
                     print(f"🔧 Tool result: {tool_result_message}")
                     
-                    # Add the tool result to the messages
-                    new_messages = request.messages + [
-                        ChatMessage(role="system", content=tool_result_message)
-                    ]
-                    
-                    # Generate final response with tool results
-                    final_prompt = model_manager.format_chat_prompt(
-                        [msg.dict() for msg in new_messages], 
-                        request.tools
-                    )
-                    
-                    final_response_data = model_manager.generate_response(
-                        final_prompt,
-                        max_tokens=request.max_tokens,
-                        temperature=request.temperature,
-                        top_p=request.top_p,
-                        frequency_penalty=request.frequency_penalty,
-                        presence_penalty=request.presence_penalty,
-                        stop=request.stop
-                    )
-                    
                     # Extract the tool result content
-                    tool_result = None
-                    if isinstance(result, dict) and "result" in result:
-                        tool_result = result["result"]
-                    
-                    # Create a more integrated response
-                    integrated_response = final_response_data["response"]
+                    tool_result = result.get("result")
                     
-                    # If the response doesn't seem to incorporate the tool result well,
-                    # create a better integrated response
-                    if tool_result and isinstance(tool_result, str) and tool_result not in integrated_response:
-                        # Extract previous messages for context
-                        previous_messages = []
-                        for i, msg in enumerate(request.messages):
-                            if i < len(request.messages) - 1:  # Skip the last user message which we already have
-                                role = "You" if msg.role == "assistant" else "User"
-                                previous_messages.append(f"{role}: {msg.content}")
-                        
-                        previous_context = "\n".join(previous_messages) if previous_messages else "No previous messages"
-                        
-                        # Check if this is a follow-up question
-                        is_followup = any(term in user_messages[-1].content.lower() for term in 
-                                         ["what about", "how about", "what if", "verses", "versus", "compared to", 
-                                          "difference between", "in contrast", "this", "that", "also", "and", "but", 
-                                          "what does", "how does", "why does"])
-                        
+                    # A text result goes straight to the integration prompt; a first pass over the
+                    # chat prompt would almost never quote it verbatim and would just be discarded
+                    integrate = bool(tool_result) and isinstance(tool_result, str)
+                    if integrate:
                         # Create a prompt specifically for integrating the tool result
-                        integration_prompt = f"""You are answering the user's question: "{user_messages[-1].content}"
-
-Previous conversation:
-{previous_context}
-
-The tool {tool_name} returned this information: 
-{tool_result}
-
-{"This appears to be a follow-up question to the previous conversation. Make sure to connect your answer to the previous context." if is_followup else ""}
-
-Based on this information and the conversation history, provide a direct, comprehensive answer to the user's question.
-DO NOT include disclaimers or warnings about consulting healthcare professionals.
-DO NOT mention that you used a tool or reference the tool result. Simply provide the answer as if you knew it directly.
-Be concise, clear, and helpful.
-
-Answer:"""
-                        
-                        integration_response = model_manager.generate_response(
-                            integration_prompt,
-                            max_tokens=request.max_tokens,
-                            temperature=0.3,
-                            top_p=0.9
+                        answer_prompt = _integration_prompt(
+                            last_user.content if last_user else "", previous_context, tool_name, tool_result,
+                            is_followup=is_followup, enhance=result["ai_enhanced"]
                         )
-                        
-                        integrated_response = integration_response["response"]
+                        sampling = {"temperature": 0.3, "top_p": 0.9}
+                    else:
+                        # Add the tool result as a system turn after the first prompt, which is reused
+                        # verbatim so the KV state already holding it only needs the new turn prefilled
+                        answer_prompt = model_manager.extend_chat_prompt(prompt, tool_result_message)
+                        sampling = {
+                            "temperature": request.temperature,
+                            "top_p": request.top_p,
+                            "frequency_penalty": request.frequency_penalty,
+                            "presence_penalty": request.presence_penalty,
+                            "stop": request.stop
+                        }
                     
-                    # Create response with tool usage
-                    return {
-                        "id": f"chatcmpl-{int(time.time())}",
-                        "object": "chat.completion",
-                        "created": int(time.time()),
-                        "model": request.model,
-                        "choices": [{
-                            "index": 0,
-                            "message": {
-                                "role": "assistant",
-                                "content": integrated_response,
-                                "tool_calls": [{
-                                    "id": f"call_{int(time.time())}",
-                                    "type": "function",
-                                    "function": {
-                                        "name": tool_name,
-                                        "arguments": json.dumps(parameters)
-                                    }
-                                }]
-                            },
-                            "finish_reason": "tool_calls"
-                        }],
-                        "usage": {
-                            "prompt_tokens": len(prompt.split()),
-                            "completion_tokens": len(integrated_response.split()),
-                            "total_tokens": len(prompt.split()) + len(integrated_response.split())
+                    now = int(time.time())
+                    if request.stream:
+                        # Announce the tool call up front, then stream the answer as it decodes
+                        tool_call_delta = {
+                            "role": "assistant",
+                            "tool_calls": [{
+                                "index": 0,
+                                "id": f"call_{now}",
+                                "type": "function",
+                                "function": {"name": tool_name, "arguments": _json_dumps(parameters)}
+                            }]
                         }
-                    }
+                        texts = model_manager.generate_stream(answer_prompt, max_tokens=request.max_tokens, **sampling)
+                        return StreamingResponse(_sse_frames(request.model, texts, tool_call_delta, "tool_calls", now),
+                                                 media_type="text/event-stream", headers=_SSE_HEADERS)
+                    
+                    completion_tokens = None
+                    if integrate:
+                        integrated_response = await model_manager.generate_cached(
+                            answer_prompt, max_tokens=request.max_tokens, **sampling
+                        )
+                    else:
+                        # Generate final response with tool results
+                        final_response_data = await model_manager.generate_response_async(
+                            answer_prompt, max_tokens=request.max_tokens, **sampling
+                        )
+                        integrated_response = final_response_data["response"]
+                        completion_tokens = final_response_data.get("completion_tokens")
+                    
+                    # Create response with tool usage
+                    return _chat_completion_response(
+                        request.model,
+                        integrated_response,
+                        _wc(prompt),
+                        completion_tokens or _wc(integrated_response),
+                        tool_call={
+                            "id": f"call_{now}",
+                            "type": "function",
+                            "function": {"name": tool_name, "arguments": _json_dumps(parameters)}
+                        },
+                        created=now
+                    )
+        
+        if request.stream:
+            return StreamingResponse(_sse_chat_stream(request), media_type="text/event-stream", headers=_SSE_HEADERS)
+        
+        # The model loads in the background at startup, so wait for it before reading the interface
+        await model_manager.ensure_loaded()
+        model = get_model_interface()
         
         # Use the enhanced chat completion function with system prompt
-        response = create_chat_completion(
+        response = await model_manager.run_inference(
+            create_chat_completion,
             request.messages,
             model,
             temperature=request.temperature,
@@ -1361,6 +2092,8 @@ Answer:"""
         
         # Return the response
         return response
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Chat completion error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat completion failed: {str(e)}")
@@ -1381,7 +2114,7 @@ async def model_info():
         "model_type": model_manager.model_type,
         "model_path": str(model_manager.model_path) if model_manager.model_path else None,
         "platform": model_manager.platform,
-        "configuration": model_manager.config,
+        "configuration": dict(model_manager.config),
         "model_config": model_config,
         "model_loaded": model_manager.is_loaded,
         "memory_usage": memory_info,
@@ -1397,6 +2130,9 @@ async def model_info():
 @app.get("/functions")
 async def list_functions():
     """Get available function definitions with validation info"""
+    if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
+        raise HTTPException(status_code=503, detail="Function tools not available")
+    
     validation_info = {}
     
     if function_validator:
@@ -1484,30 +2220,17 @@ async def confirm_web_search(request: Dict[str, Any]):
             confirmation = model_manager.confirmation_system.get_confirmation_by_id(session_id)
             if confirmation:
                 # Execute the web search
-                search_result = function_tools._web_search(confirmation.extracted_search_term, 5)
+                search_result = await asyncio.to_thread(function_tools._web_search, confirmation.extracted_search_term, 5)
                 
                 # Clean up the confirmation session
                 model_manager.confirmation_system.cleanup_confirmation(session_id)
                 
-                return {
-                    "id": f"chatcmpl-{int(time.time())}",
-                    "object": "chat.completion",
-                    "created": int(time.time()),
-                    "model": "HuddleAI",
-                    "choices": [{
-                        "index": 0,
-                        "message": {
-                            "role": "assistant",
-                            "content": f"{response_message}\n\n{search_result}"
-                        },
-                        "finish_reason": "stop"
-                    }],
-                    "usage": {
-                        "prompt_tokens": len(user_response.split()),
-                        "completion_tokens": len(response_message.split()) + len(search_result.split()),
-                        "total_tokens": len(user_response.split()) + len(response_message.split()) + len(search_result.split())
-                    }
-                }
+                return _chat_completion_response(
+                    "HuddleAI",
+                    f"{response_message}\n\n{search_result}",
+                    _wc(user_response),
+                    _wc(response_message) + _wc(search_result)
+                )
         else:
             # Clean up the confirmation session
             model_manager.confirmation_system.cleanup_confirmation(session_id)
@@ -1517,25 +2240,12 @@ async def confirm_web_search(request: Dict[str, Any]):
             if fallback_knowledge:
                 final_content += f"\n\n{fallback_knowledge}"
             
-            return {
-                "id": f"chatcmpl-{int(time.time())}",
-                "object": "chat.completion",
-                "created": int(time.time()),
-                "model": "HuddleAI",
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": final_content
-                    },
-                    "finish_reason": "stop"
-                }],
-                "usage": {
-                    "prompt_tokens": len(user_response.split()),
-                    "completion_tokens": len(final_content.split()),
-                    "total_tokens": len(user_response.split()) + len(final_content.split())
-                }
-            }
+            return _chat_completion_response(
+                "HuddleAI",
+                final_content,
+                _wc(user_response),
+                _wc(final_content)
+            )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Confirmation failed: {str(e)}")
@@ -1561,47 +2271,8 @@ async def execute_tool_endpoint(request: Request):
             # Combine query and symptoms for checking
             text_to_check = (query + " " + symptoms).lower()
             
-            # Define patterns for general requests
-            formatting_patterns = [
-                r"(?:please|can you|could you)?\s*(?:clean|fix|improve|change|update|format|reformat|restructure|organize|present|display|show)\s+(?:the|this|that|your)?\s*(?:format|formatting|response|answer|result|output|text|content|information|presentation)",
-                r"(?:make|render|display)\s+(?:this|that|it|the response|the answer|the result|the output)\s+(?:more|better|clearer|cleaner|nicer|prettier|easier to read|more readable|more presentable)",
-                r"(?:no|without)\s+(?:queries|query)",
-                r"(?:better|cleaner|nicer|prettier|more readable|more presentable)\s+(?:format|formatting|presentation|display|layout)"
-            ]
-            
-            # Add patterns for other general (non-medical) requests
-            general_request_patterns = [
-                r"(?:thank|thanks|thank you)",
-                r"(?:good|great|excellent|amazing|wonderful|fantastic)",
-                r"(?:hi|hello|hey)",
-                r"(?:bye|goodbye|see you)",
-                r"(?:who are you|what can you do|what are your capabilities|tell me about yourself)",
-                r"(?:help|assist|support)",
-                r"(?:stop|quit|exit|cancel)",
-                r"(?:repeat|say again|tell me again)",
-                r"(?:summarize|summary|summarization)",
-                r"(?:explain|explanation|clarify|clarification)",
-                r"(?:continue|go on|proceed|next)",
-                r"(?:previous|back|before)",
-                r"(?:correct|right|incorrect|wrong)",
-                r"(?:yes|no|maybe)",
-                r"(?:understood|got it|i see|i understand)",
-            ]
-            
-            is_formatting_request = any(re.search(pattern, text_to_check) for pattern in formatting_patterns)
-            is_general_request = any(re.search(pattern, text_to_check) for pattern in general_request_patterns)
-            
-            # Check for specific non-medical keywords
-            non_medical_keywords = ["format", "formatting", "present", "presentation", "display", "layout", 
-                                  "structure", "organize", "clean", "clear", "readable", "thank", "thanks",
-                                  "hello", "hi", "hey", "goodbye", "bye", "help", "assist"]
-            
-            contains_non_medical_keywords = any(keyword in text_to_check for keyword in non_medical_keywords)
-            
-            # Check if this is a short message (likely a general request)
-            is_short_message = len(text_to_check.split()) < 5
-            
-            if is_formatting_request or (is_general_request and is_short_message) or (contains_non_medical_keywords and is_short_message):
+            # Check if this is a formatting or general request rather than a medical query
+            if _is_general_request(text_to_check):
                 # This is a general request, not a medical query
                 # Generate a response using the model directly
                 general_prompt = f"""The user has made a general request: "{text_to_check}"
@@ -1613,7 +2284,7 @@ If it's a general question, greeting, or other non-medical request, respond appr
 Response:"""
                 
                 # Generate response
-                response_data = model_manager.generate_response(
+                response_data = await model_manager.generate_response_async(
                     general_prompt,
                     max_tokens=500,
                     temperature=0.3
@@ -1632,8 +2303,8 @@ Response:"""
                     "timestamp": int(time.time())
                 }
         
-        # Import function tools
-        from function_tools import function_tools
+        if not FUNCTION_TOOLS_AVAILABLE or not function_tools:
+            raise HTTPException(status_code=503, detail="Function tools not available")
         
         # Check if tool exists
         if tool_name not in function_tools.functions:
@@ -1641,19 +2312,19 @@ Response:"""
         
         # Execute the function
         print(f"🔧 Directly executing {tool_name} with parameters: {parameters}")
-        result = function_tools.execute_function(tool_name, parameters)
+        result = await asyncio.to_thread(function_tools.execute_function, tool_name, parameters)
         
         # Extract databases used if present in the result
         databases_used = []
         if isinstance(result, dict) and isinstance(result.get("result"), str):
             # Look for the databases used information in the result
-            db_match = re.search(r"Databases used in this search: ([\w\-,\s]+)", result["result"])
+            db_match = DATABASES_USED_RE.search(result["result"])
             if db_match:
                 databases_string = db_match.group(1)
                 databases_used = [db.strip() for db in databases_string.split(',')]
                 
                 # Remove the databases used line from the result
-                result["result"] = re.sub(r"\n\nDatabases used in this search: [\w\-,\s]+", "", result["result"])
+                result["result"] = DATABASES_USED_LINE_RE.sub("", result["result"])
         
         # If AI generation is requested and the result is text, enhance it with the AI model
         if use_ai_generation and isinstance(result.get("result"), str) and model_manager:
@@ -1671,14 +2342,12 @@ IMPORTANT: Respond as if you are directly answering the user's question. Do not
 
 Enhanced response:"""
 
-                # Generate enhanced response
-                response_data = model_manager.generate_response(
+                # Generate enhanced response (repeat lookups hit the cache)
+                enhanced_result = (await model_manager.generate_cached(
                     prompt,
                     max_tokens=500,
                     temperature=0.3
-                )
-                
-                enhanced_result = response_data["response"].strip()
+                )).strip()
                 
                 # Add the enhanced result to the response
                 result["enhanced_result"] = enhanced_result
@@ -1759,7 +2428,7 @@ if __name__ == "__main__":
     parser.add_argument("--device", type=str, choices=["cpu", "cuda", "mps"], help="Device to use")
     parser.add_argument("--n-gpu-layers", type=int, help="Number of layers to offload to GPU")
     parser.add_argument("--n-ctx", type=int, help="Context size")
-    parser.add_argument("--n-batch", type=int, help="Batch size for processing")
+    parser.add_argument("--n-batch", type=int, help="Prompt batch size (default 2048 with >=8GB RAM, else 512; env HUDDLE_N_BATCH)")
     parser.add_argument("--n-threads", type=int, help="Number of threads")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to bind to")
     parser.add_argument("--port", type=int, default=8002, help="Port to bind to")
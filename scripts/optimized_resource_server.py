@@ -6,6 +6,7 @@ Supports both GGUF and PyTorch models
 """
 
 import os
+import asyncio
 import torch
 import time
 import json
@@ -29,10 +30,13 @@ from pathlib import Path
 os.environ["PYTORCH_MPS_HIGH_WATERMARK_RATIO"] = "0.0"  # Disable upper limit for memory allocations
 os.environ["PYTORCH_MPS_LOW_WATERMARK_RATIO"] = "0.0"   # Disable lower limit
 os.environ["TRANSFORMERS_VERBOSITY"] = "error"  # Reduce warning messages
+# Expandable segments let the CUDA caching allocator grow blocks in place across varying
+# prompt lengths instead of fragmenting; must be set before CUDA initializes
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
 
 # Try importing llama-cpp-python for GGUF support
 try:
-    from llama_cpp import Llama
+    from llama_cpp import Llama, LlamaRAMCache
     LLAMA_CPP_AVAILABLE = True
     print("✅ llama-cpp-python available for GGUF models")
 except ImportError:
@@ -48,7 +52,7 @@ except ImportError:
     print("⚠️ vLLM-style optimizations not available")
 
 # Import device detection classes
-from device_detection_test import DeviceDetector, SystemInfo, DeviceInfo, ResourceAllocation, ProcessInfo
+from device_detection_test import DeviceDetector, SystemInfo, DeviceInfo, ResourceAllocation, ProcessInfo, GPU_CHIPSET_RE
 
 # Import resource monitor
 from resource_monitor import get_global_monitor, start_global_monitoring, stop_global_monitoring, get_global_monitor_with_device
@@ -56,6 +60,9 @@ from resource_monitor import get_global_monitor, start_global_monitoring, stop_g
 # Import platform-adaptive configuration
 from platform_adaptive_config import get_platform_config
 
+# Import the shared micro-batching window
+from batch_queue import collect_batch
+
 # OpenAI-compatible request models
 class ChatMessage(BaseModel):
     role: str = Field(..., description="The role of the message author (system, user, assistant)")
@@ -129,6 +136,30 @@ class HealthResponse(BaseModel):
     uptime: float = Field(..., description="Server uptime in seconds")
     memory_usage: Dict[str, Any] = Field(..., description="Memory usage information")
 
+# GPU model tiers: name pattern group -> (performance tier, memory cap GB, memory fraction, cores).
+# Alternatives are tried in order at each position, so the specific chips win over the catch-alls
+APPLE_TIER_RE = re.compile(r"m[123] (?P<max>max)|m[123] (?P<pro>pro)|m[123] (?P<ultra>ultra)|(?P<standard>m[123])")
+APPLE_GPU_TIERS = {
+    "max": ("Pro", 20, 0.8, 32),
+    "pro": ("Pro", 16, 0.75, 16),
+    "ultra": ("Ultra", 32, 0.85, 64),
+    "standard": ("Standard", 12, 0.7, 8),
+}
+NVIDIA_TIER_RE = re.compile(r"(?P<ultra>rtx 40[89]0)|(?P<pro>rtx 30[89]0)|(?P<mid>rtx 40[67]0)|(?P<standard>gtx|rtx)")
+NVIDIA_GPU_TIERS = {
+    "ultra": ("Ultra", 24, 0.9, 10000),
+    "pro": ("Pro", 20, 0.85, 8000),
+    "mid": ("Pro", 16, 0.8, 5000),
+    "standard": ("Standard", 12, 0.75, 3000),
+    "legacy": ("Legacy", 8, 0.7, 1000),
+}
+
+def _apply_gpu_tier(gpu_info: Dict[str, Any], tier: str, memory_cap_gb: int, memory_fraction: float, cores: int):
+    """Fill performance tier, recommended memory and core count from a tier table row"""
+    gpu_info['performance_tier'] = tier
+    gpu_info['recommended_memory_gb'] = min(memory_cap_gb, int(gpu_info['total_memory_gb'] * memory_fraction))
+    gpu_info['gpu_cores'] = cores
+
 # Global model instance
 model_instance = None
 start_time = time.time()
@@ -192,6 +223,7 @@ class OptimizedLlamaModel:
         self.device = self.device_detector.best_device
         self.is_loaded = False
         self.load_lock = threading.Lock()
+        self._device_gpu_info: Dict[str, Dict[str, Any]] = {}  # detect_gpu_capabilities memo per device
         
         # Get dynamic resource allocation from device detector
         allocation_info = self.device_detector.resource_allocation
@@ -248,23 +280,22 @@ class OptimizedLlamaModel:
             'allocation_info': device_config["resource_allocation"]
         }
         
-        # Add device-specific info
-        if self.device == "mps":
-            gpu_info.update(self._detect_apple_silicon())
-        elif self.device == "cuda":
-            gpu_info.update(self._detect_nvidia_gpu())
-        elif self.device == "rocm":
-            gpu_info.update(self._detect_amd_gpu())
-        else:
-            gpu_info.update(self._detect_cpu_system())
+        # Add device-specific info, probed once per device (system_profiler takes hundreds of ms)
+        if self.device not in self._device_gpu_info:
+            if self.device == "mps":
+                self._device_gpu_info[self.device] = self._detect_apple_silicon()
+            elif self.device == "cuda":
+                self._device_gpu_info[self.device] = self._detect_nvidia_gpu()
+            elif self.device == "rocm":
+                self._device_gpu_info[self.device] = self._detect_amd_gpu()
+            else:
+                self._device_gpu_info[self.device] = self._detect_cpu_system()
+        gpu_info.update(self._device_gpu_info[self.device])
         
         return gpu_info
     
     def _detect_apple_silicon(self) -> Dict[str, Any]:
         """Detect Apple Silicon GPU capabilities"""
-        import subprocess
-        import re
-        
         gpu_info = {
             'gpu_model': 'Unknown',
             'gpu_cores': 0,
@@ -282,7 +313,7 @@ class OptimizedLlamaModel:
                 output = result.stdout
                 
                 # Extract GPU model
-                gpu_match = re.search(r'Chipset Model:\s*(.+)', output)
+                gpu_match = GPU_CHIPSET_RE.search(output)
                 if gpu_match:
                     gpu_info['gpu_model'] = gpu_match.group(1).strip()
                 
@@ -294,24 +325,9 @@ class OptimizedLlamaModel:
                     gpu_info['total_memory_gb'] = total_bytes / (1024**3)
                 
                 # Auto-scale based on GPU model
-                gpu_model = gpu_info['gpu_model'].lower()
-                
-                if 'm1 max' in gpu_model or 'm2 max' in gpu_model or 'm3 max' in gpu_model:
-                    gpu_info['performance_tier'] = 'Pro'
-                    gpu_info['recommended_memory_gb'] = min(20, int(gpu_info['total_memory_gb'] * 0.8))
-                    gpu_info['gpu_cores'] = 32
-                elif 'm1 pro' in gpu_model or 'm2 pro' in gpu_model or 'm3 pro' in gpu_model:
-                    gpu_info['performance_tier'] = 'Pro'
-                    gpu_info['recommended_memory_gb'] = min(16, int(gpu_info['total_memory_gb'] * 0.75))
-                    gpu_info['gpu_cores'] = 16
-                elif 'm1 ultra' in gpu_model or 'm2 ultra' in gpu_model or 'm3 ultra' in gpu_model:
-                    gpu_info['performance_tier'] = 'Ultra'
-                    gpu_info['recommended_memory_gb'] = min(32, int(gpu_info['total_memory_gb'] * 0.85))
-                    gpu_info['gpu_cores'] = 64
-                elif 'm1' in gpu_model or 'm2' in gpu_model or 'm3' in gpu_model:
-                    gpu_info['performance_tier'] = 'Standard'
-                    gpu_info['recommended_memory_gb'] = min(12, int(gpu_info['total_memory_gb'] * 0.7))
-                    gpu_info['gpu_cores'] = 8
+                tier_match = APPLE_TIER_RE.search(gpu_info['gpu_model'].lower())
+                if tier_match:
+                    _apply_gpu_tier(gpu_info, *APPLE_GPU_TIERS[tier_match.lastgroup])
                     
         except Exception as e:
             print(f"⚠️ Could not detect Apple Silicon details: {e}")
@@ -339,28 +355,8 @@ class OptimizedLlamaModel:
                 gpu_info['total_memory_gb'] = gpu_memory / (1024**3)
                 
                 # Auto-scale based on GPU model
-                gpu_name_lower = gpu_name.lower()
-                
-                if 'rtx 4090' in gpu_name_lower or 'rtx 4080' in gpu_name_lower:
-                    gpu_info['performance_tier'] = 'Ultra'
-                    gpu_info['recommended_memory_gb'] = min(24, int(gpu_info['total_memory_gb'] * 0.9))
-                    gpu_info['gpu_cores'] = 10000  # Approximate CUDA cores
-                elif 'rtx 3090' in gpu_name_lower or 'rtx 3080' in gpu_name_lower:
-                    gpu_info['performance_tier'] = 'Pro'
-                    gpu_info['recommended_memory_gb'] = min(20, int(gpu_info['total_memory_gb'] * 0.85))
-                    gpu_info['gpu_cores'] = 8000
-                elif 'rtx 4070' in gpu_name_lower or 'rtx 4060' in gpu_name_lower:
-                    gpu_info['performance_tier'] = 'Pro'
-                    gpu_info['recommended_memory_gb'] = min(16, int(gpu_info['total_memory_gb'] * 0.8))
-                    gpu_info['gpu_cores'] = 5000
-                elif 'gtx' in gpu_name_lower or 'rtx' in gpu_name_lower:
-                    gpu_info['performance_tier'] = 'Standard'
-                    gpu_info['recommended_memory_gb'] = min(12, int(gpu_info['total_memory_gb'] * 0.75))
-                    gpu_info['gpu_cores'] = 3000
-                else:
-                    gpu_info['performance_tier'] = 'Legacy'
-                    gpu_info['recommended_memory_gb'] = min(8, int(gpu_info['total_memory_gb'] * 0.7))
-                    gpu_info['gpu_cores'] = 1000
+                tier_match = NVIDIA_TIER_RE.search(gpu_name.lower())
+                _apply_gpu_tier(gpu_info, *NVIDIA_GPU_TIERS[tier_match.lastgroup if tier_match else "legacy"])
                     
         except Exception as e:
             print(f"⚠️ Could not detect NVIDIA GPU details: {e}")
@@ -391,8 +387,6 @@ class OptimizedLlamaModel:
     
     def _detect_cpu_system(self) -> Dict[str, Any]:
         """Detect CPU system capabilities"""
-        import psutil
-        
         gpu_info = {
             'gpu_model': 'CPU Only',
             'gpu_cores': psutil.cpu_count(),
@@ -418,7 +412,6 @@ class OptimizedLlamaModel:
     def get_memory_info(self) -> Dict[str, Any]:
         """Get current memory usage with dynamic resource info"""
         memory = psutil.virtual_memory()
-        device_config = self.device_detector.generate_config()
         
         return {
             "total_gb": memory.total / (1024**3),
@@ -428,8 +421,8 @@ class OptimizedLlamaModel:
             "device": self.device,
             "allocated_gb": self.max_memory_gb,
             "conservative_mode": self.use_conservative_settings,
-            "other_apps_gb": sum(p.memory_mb for p in self.device_detector.other_processes) / 1024,
-            "cpu_percent": device_config["system_info"]["cpu_percent"]
+            "other_apps_gb": self.device_detector.other_processes_gb,
+            "cpu_percent": self.device_detector.system_info.cpu_percent
         }
     
     def get_model_path(self) -> Path:
@@ -458,7 +451,6 @@ class OptimizedLlamaModel:
         try:
             # Get current memory info
             memory_info = self.get_memory_info()
-            device_config = self.device_detector.generate_config()
             
             print(f"🔧 Dynamic Memory Optimization:")
             print(f"   Current Usage: {memory_info['used_gb']:.1f}GB")
@@ -488,13 +480,8 @@ class OptimizedLlamaModel:
                 except ImportError:
                     print("⚠️ torch.mps not available for MPS optimization")
             
-            # Standard memory optimization
-            try:
-                import torch
-                if hasattr(torch, 'cuda') and torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-            except ImportError:
-                print("⚠️ torch not available for CUDA optimization")
+            # CUDA relies on the caching allocator: empty_cache() here would scan every
+            # block on each request and create a context on cuda:0
             
             # Force garbage collection
             gc.collect()
@@ -506,6 +493,13 @@ class OptimizedLlamaModel:
         except Exception as e:
             print(f"⚠️ Memory optimization failed: {e}")
     
+    def _ensure_memory_headroom(self):
+        """Per-request memory check: leave the allocator's cached blocks in place unless system memory runs low"""
+        available_gb = psutil.virtual_memory().available / 1024**3
+        if available_gb < self.device_detector.resource_allocation.safety_margin_gb:
+            print(f"⚠️ Low memory ({available_gb:.1f}GB available), reclaiming before generation")
+            self.optimize_memory()
+    
     def load_model(self):
         """Load the model with dynamic resource management and GGUF support"""
         with self.load_lock:
@@ -532,7 +526,7 @@ class OptimizedLlamaModel:
             print(f"   - Available memory: {self.device_detector.system_info.available_memory_gb:.1f}GB")
             print(f"   - Total memory: {self.device_detector.system_info.total_memory_gb:.1f}GB")
             print(f"   - CPU usage: {self.device_detector.system_info.cpu_percent:.1f}%")
-            print(f"   - Other processes: {len(self.device_detector.other_processes)} ({(sum(p.memory_mb for p in self.device_detector.other_processes) / 1024):.1f}GB)")
+            print(f"   - Other processes: {len(self.device_detector.other_processes)} ({self.device_detector.other_processes_gb:.1f}GB)")
             
             # Recalculate resource allocation before loading
             allocation_info = self.device_detector.resource_allocation
@@ -664,6 +658,13 @@ class OptimizedLlamaModel:
         # Load the model
         self.model = Llama(**llama_kwargs)
         
+        # Keep KV state for recent prompts: multi-turn chats resend their history, so each turn
+        # restores the longest cached prefix and only prefills the new messages
+        cache_mb = int(os.environ.get("HUDDLE_PROMPT_CACHE_MB", "1024" if self.use_conservative_settings else "2048"))
+        if cache_mb > 0:
+            self.model.set_cache(LlamaRAMCache(capacity_bytes=cache_mb * 1024**2))
+            print(f"🧠 Prompt prefix cache enabled ({cache_mb}MB)")
+        
         # For GGUF models, we don't need a separate tokenizer
         self.tokenizer = self.model
         
@@ -708,7 +709,7 @@ class OptimizedLlamaModel:
             
             # Calculate safe MPS allocation based on available system memory
             available_memory_gb = self.device_detector.system_info.available_memory_gb
-            other_apps_gb = sum(p.memory_mb for p in self.device_detector.other_processes) / 1024
+            other_apps_gb = self.device_detector.other_processes_gb
             
             # Conservative MPS allocation strategy
             mps_allocation_strategies = [
@@ -905,9 +906,9 @@ class OptimizedLlamaModel:
         if not self.is_loaded:
             self.load_model()
         
-        # Pre-optimize for generation
+        # Only reclaim memory when the system is short on it
         if use_optimizations:
-            self.optimize_memory()
+            self._ensure_memory_headroom()
         
         try:
             if self.model_type == "gguf":
@@ -954,10 +955,6 @@ class OptimizedLlamaModel:
                 
                 # Generate with optimizations and chunking
                 with torch.no_grad():
-                    # Clear cache before generation
-                    if self.device == "mps" and hasattr(torch.mps, 'empty_cache'):
-                        torch.mps.empty_cache()
-                    
                     # Use streaming generation with chunking
                     for chunk_start in range(0, max_tokens, chunk_size):
                         chunk_tokens = min(chunk_size, max_tokens - chunk_start)
@@ -1011,9 +1008,9 @@ class OptimizedLlamaModel:
                                 print(f"📦 Chunk {chunk_start//chunk_size + 1}: {len(generated_tokens)} tokens, total: {total_generated}")
                                 yield chunk_text
                         
-                        # Memory management between chunks
+                        # Memory check between chunks
                         if use_optimizations:
-                            self.optimize_memory()
+                            self._ensure_memory_headroom()
                         
                         # Check if we've reached the limit
                         if total_generated >= max_tokens:
@@ -1030,9 +1027,9 @@ class OptimizedLlamaModel:
         if not self.is_loaded:
             self.load_model()
         
-        # Pre-optimize for generation
+        # Only reclaim memory when the system is short on it
         if use_optimizations:
-            self.optimize_memory()
+            self._ensure_memory_headroom()
         
         start_time = time.time()
         
@@ -1093,10 +1090,6 @@ class OptimizedLlamaModel:
                     
                     # Generate with optimizations and memory management
                     with torch.no_grad():
-                        # Clear cache before generation
-                        if self.device == "mps" and hasattr(torch.mps, 'empty_cache'):
-                            torch.mps.empty_cache()
-                        
                         outputs = self.model.generate(
                             **inputs,
                             max_new_tokens=current_max_tokens,
@@ -1116,10 +1109,6 @@ class OptimizedLlamaModel:
                             eos_token_id=self.tokenizer.eos_token_id,
                         )
                     
-                    # Clear cache after generation
-                    if self.device == "mps" and hasattr(torch.mps, 'empty_cache'):
-                        torch.mps.empty_cache()
-                    
                     # Decode response (only for PyTorch models)
                     response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
                     response = response[len(prompt):].strip()
@@ -1175,6 +1164,80 @@ class OptimizedLlamaModel:
                     # All attempts failed, return error response
                     raise e
     
+    def generate_batch(self, prompts: List[str], max_tokens: int = 100, temperature: float = 0.7,
+                       top_p: float = 0.9, repetition_penalty: float = 1.1,
+                       use_optimizations: bool = True) -> List[Dict[str, Any]]:
+        """generate_non_stream for several prompts with the same settings; PyTorch decodes them as one padded batch"""
+        if not self.is_loaded:
+            self.load_model()
+        
+        # llama.cpp has a single sequence context, so GGUF prompts run back to back
+        if self.model_type == "gguf" or len(prompts) == 1:
+            return [self.generate_non_stream(prompt, max_tokens, temperature, top_p, repetition_penalty,
+                                             use_optimizations) for prompt in prompts]
+        
+        if use_optimizations:
+            self._ensure_memory_headroom()
+        
+        start_time = time.time()
+        print(f"🔧 PyTorch batched generation: {len(prompts)} prompts, max_tokens={max_tokens}")
+        
+        # Left padding keeps every prompt flush against its generated tokens
+        padding_side = self.tokenizer.padding_side
+        self.tokenizer.padding_side = "left"
+        try:
+            inputs = self.tokenizer(
+                prompts,
+                return_tensors="pt",
+                truncation=True,
+                max_length=1024,
+                padding=True
+            )
+        finally:
+            self.tokenizer.padding_side = padding_side
+        
+        if self.device != "cpu":
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                do_sample=True,
+                pad_token_id=self.tokenizer.pad_token_id,
+                use_cache=True,
+                repetition_penalty=repetition_penalty,
+                num_beams=1,
+                return_dict_in_generate=False,
+                output_scores=False,
+                eos_token_id=self.tokenizer.eos_token_id,
+            )
+        
+        generation_time = time.time() - start_time
+        memory_usage = self.get_memory_info()
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        
+        results = []
+        for prompt, tokens in zip(prompts, new_tokens):
+            response = self.tokenizer.decode(tokens, skip_special_tokens=True).strip()
+            if not self._validate_response(response):
+                # Invalid rows take the single-prompt path with its retries and fallback
+                results.append(self.generate_non_stream(prompt, max_tokens, temperature, top_p,
+                                                        repetition_penalty, use_optimizations))
+                continue
+            tokens_generated = int((tokens != self.tokenizer.pad_token_id).sum())
+            results.append({
+                "response": response,
+                "generation_time": generation_time,
+                "tokens_generated": tokens_generated,
+                "tokens_per_second": tokens_generated / generation_time if generation_time > 0 else 0,
+                "memory_usage": memory_usage,
+                "attempts": 1
+            })
+        return results
+    
     def _validate_response(self, response: str) -> bool:
         """Validate that the response is meaningful and not empty"""
         if not response or len(response.strip()) < 1:
@@ -1302,6 +1365,73 @@ class OptimizedLlamaModel:
         print(f"   ✅ CPU: Always available as fallback")
         return "cpu"
 
+class GenerationBatcher:
+    """Shared queue in front of the model for non-streaming generations.
+    
+    Requests that arrive within batch_wait_timeout_s of each other (up to
+    max_batch_size) and share generation settings run as one generate_batch call
+    on a worker thread, so the event loop stays free; while a batch runs, new
+    requests queue up and form the next one.
+    """
+    
+    def __init__(self, model: OptimizedLlamaModel, max_batch_size: int = 8, batch_wait_timeout_s: float = 0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.batch_wait_timeout_s = batch_wait_timeout_s
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def stop(self):
+        """Stop the background batching loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def submit(self, prompt: str, max_tokens: int = 100, temperature: float = 0.7, top_p: float = 0.9,
+                     repetition_penalty: float = 1.1, use_optimizations: bool = True) -> Dict[str, Any]:
+        """Queue a generation and wait for its generate_non_stream-style result"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        settings = (max_tokens, temperature, top_p, repetition_penalty, use_optimizations)
+        await self._queue.put((prompt, settings, future))
+        return await future
+    
+    async def _run(self):
+        while True:
+            batch = await collect_batch(self._queue, self.max_batch_size, self.batch_wait_timeout_s)
+            
+            # llama.cpp decodes one prompt at a time, so GGUF jobs go one per dispatch and each
+            # caller is answered as soon as its own decode ends rather than after the whole batch
+            if self.model.model_type == "gguf":
+                dispatches = [(item[1], [item]) for item in batch]
+            else:
+                # Only requests with the same settings can share a generate call
+                groups: Dict[tuple, list] = {}
+                for item in batch:
+                    groups.setdefault(item[1], []).append(item)
+                dispatches = list(groups.items())
+            for settings, items in dispatches:
+                prompts = [prompt for prompt, _, _ in items]
+                try:
+                    results = await asyncio.to_thread(self.model.generate_batch, prompts, *settings)
+                except Exception as e:
+                    for *_, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (*_, future), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
+
+# Shared by the non-streaming endpoints once the model is up
+generation_batcher: Optional[GenerationBatcher] = None
+
 # Initialize model
 def init_model():
     global model_instance
@@ -1315,8 +1445,10 @@ start_time = time.time()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    global generation_batcher
     print("🚀 Starting Optimized Resource FastAPI Llama server...")
     init_model()
+    generation_batcher = GenerationBatcher(model_instance, max_batch_size=max(1, model_instance.batch_size))
     
     # Global resource monitoring is already started by the model instance
     # No need to start it again here
@@ -1325,6 +1457,7 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     print("🛑 Shutting down optimized server...")
+    await generation_batcher.stop()
     stop_global_monitoring()
 
 # Create FastAPI app
@@ -1481,7 +1614,7 @@ async def chat_completions(request: ChatCompletionRequest):
         print(f"🔍 Debug - Final prompt: {repr(prompt[:100])}...")
         
         # Generate response with enhanced reliability
-        result = model_instance.generate_non_stream(
+        result = await generation_batcher.submit(
             prompt=prompt,
             max_tokens=request.max_tokens or 100,
             temperature=request.temperature or 0.7,
@@ -1597,7 +1730,7 @@ async def completions(request: CompletionRequest):
             raise HTTPException(status_code=503, detail="Model not loaded")
         
         # Generate response
-        result = model_instance.generate_non_stream(
+        result = await generation_batcher.submit(
             prompt=request.prompt,
             max_tokens=request.max_tokens or 100,
             temperature=request.temperature or 0.7,
@@ -1724,7 +1857,7 @@ async def generate_stream(request: GenerateRequest):
             )
         else:
             # Non-streaming response
-            result = model_instance.generate_non_stream(
+            result = await generation_batcher.submit(
                 prompt=request.prompt,
                 max_tokens=request.max_tokens,
                 temperature=request.temperature,
@@ -1743,7 +1876,7 @@ async def generate_stream(request: GenerateRequest):
 async def generate_text(request: GenerateRequest):
     """Generate text without streaming with optimizations"""
     try:
-        result = model_instance.generate_non_stream(
+        result = await generation_batcher.submit(
             prompt=request.prompt,
             max_tokens=request.max_tokens,
             temperature=request.temperature,
@@ -530,6 +530,7 @@ __pycache__/
             "platform_adaptive_config.py",
             "device_detection_test.py",
             "resource_monitor.py",
+            "batch_queue.py",
             "vllm_style_optimizer.py"
         ]
         
@@ -659,6 +660,7 @@ __pycache__/
             self.bundled_models_dir / "platform_adaptive_config.py",
             self.bundled_models_dir / "device_detection_test.py",
             self.bundled_models_dir / "resource_monitor.py",
+            self.bundled_models_dir / "batch_queue.py",
             self.bundled_models_dir / "platform_config.json",
             self.bundled_models_dir / ".gitignore"
         ]
@@ -86,8 +86,7 @@ class VLLMStyleOptimizer:
                 except:
                     pass
         elif self.device == "cuda":
-            # CUDA memory pool
-            torch.cuda.empty_cache()
+            # CUDA memory pool (caching allocator; no empty_cache needed)
             torch.cuda.set_per_process_memory_fraction(0.85)
     
     def _setup_attention_optimizations(self):
@@ -258,8 +257,6 @@ class VLLMStyleOptimizer:
         """vLLM-style memory optimization"""
         if self.device == "mps":
             torch.mps.empty_cache()
-        elif self.device == "cuda":
-            torch.cuda.empty_cache()
         
         gc.collect()
     
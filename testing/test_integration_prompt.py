@@ -0,0 +1,31 @@
+"""Checks for the tool-result integration prompt built by scripts/optimized_gguf_server.py"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+server = pytest.importorskip("optimized_gguf_server")
+
+ARGS = ("What is type 2 diabetes?", "No previous messages", "medical_search",
+        "Type 2 diabetes is a chronic condition affecting blood sugar regulation.")
+
+
+def test_ai_enhance_adds_instructions_to_prompt():
+    plain = server._integration_prompt(*ARGS)
+    enhanced = server._integration_prompt(*ARGS, enhance=True)
+
+    instructions = server.TOOL_ENHANCE_INSTRUCTIONS.strip()
+    assert instructions not in plain
+    assert instructions in enhanced
+    assert enhanced.endswith("Answer:")
+
+
+def test_prompt_carries_question_and_tool_result():
+    prompt = server._integration_prompt(*ARGS, is_followup=True)
+
+    assert ARGS[0] in prompt
+    assert ARGS[3] in prompt
+    assert "follow-up question" in prompt